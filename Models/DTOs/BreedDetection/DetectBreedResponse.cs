@@ -41,5 +41,14 @@ namespace PawVerseAPI.Models.DTOs.BreedDetection
         
         [System.Text.Json.Serialization.JsonPropertyName("processing_time_ms")]
         public int ProcessingTimeMs { get; set; }
+        
+        [System.Text.Json.Serialization.JsonPropertyName("stage_ms")]
+        public Dictionary<string, double>? StageMs { get; set; }  // Per pipeline stage (decode, yolo, encode, ...)
+        
+        [System.Text.Json.Serialization.JsonPropertyName("index_version")]
+        public string? IndexVersion { get; set; }  // FAISS database that answered (changes on hot reload)
+        
+        [System.Text.Json.Serialization.JsonPropertyName("cache_hit")]
+        public bool? CacheHit { get; set; }  // Set when the result came from the result cache
     }
 }
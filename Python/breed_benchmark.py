@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+PawVerse Breed Detection Benchmark
+Offline, CPU-only timing of BreedDetector.detect_breed_batch, per stage
+(from the stage_ms it reports) and end to end.
+
+Runs against synthetic (or given) images and a small stand-in FAISS index
+built in a temp directory, so it needs no network, GPU or real database.
+With --models random the YOLO and CLIP architectures are built untrained,
+which keeps timings representative while skipping the weight downloads;
+images the untrained YOLO finds no pet in get a central stand-in box.
+
+    python breed_benchmark.py --batch-sizes 1 8 --threads 1 4 --output bench.json
+    python breed_benchmark.py --baseline bench.json --max-regression 0.2
+    python breed_benchmark.py --pool-workers 1 2 4 --batch-sizes 1
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from breed_detection import BreedDetector, Config, WorkerPool, faiss, torch
+
+
+# ============================================================================
+# FIXTURES (synthetic images + stand-in index)
+# ============================================================================
+
+def synthetic_jpegs(count: int, seed: int = 0) -> list:
+    """JPEG bytes of camera-sized noisy gradients, so decode cost is realistic."""
+    rng = np.random.default_rng(seed)
+    sizes = [(1600, 1200), (1280, 960), (1024, 768), (640, 480)]
+    images = []
+    for i in range(count):
+        w, h = sizes[i % len(sizes)]
+        gradient = np.linspace(0, 255, w, dtype=np.float32)[None, :, None]
+        noise = rng.normal(0, 30, (h, w, 3))
+        buf = io.BytesIO()
+        Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+def load_jpegs(image_dir: str, count: int) -> list:
+    paths = sorted(p for p in Path(image_dir).rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+    if not paths:
+        raise FileNotFoundError(f"No images under {image_dir}")
+    return [paths[i % len(paths)].read_bytes() for i in range(count)]
+
+
+def build_stand_in_index(data_dir: Path, dim: int, size: int, breeds: int, seed: int = 0):
+    """Clustered unit vectors (one cluster per breed) + id_map for dog and cat under data_dir."""
+    rng = np.random.default_rng(seed)
+    for animal_type, n_breeds in (("dog", breeds), ("cat", max(1, breeds // 10))):
+        centroids = rng.standard_normal((n_breeds, dim)).astype(np.float32)
+        codes = rng.integers(0, n_breeds, size)
+        vectors = centroids[codes] + 0.8 * rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        
+        out = data_dir / animal_type
+        out.mkdir(parents=True, exist_ok=True)
+        index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+        faiss.write_index(index, str(out / Config().FAISS_INDEX_FILES["flat"]))
+        with open(out / "id_map.json", 'w', encoding='utf-8') as f:
+            json.dump([{"breed": f"n{90000000 + int(c)}-Breed-{int(c)}"} for c in codes], f)
+
+
+def embedding_dim(detector: BreedDetector) -> int:
+    """CLIP output size read off the model, so no inference runs before a pool forks."""
+    if detector.config.BACKEND == "onnx":
+        return int(detector.models.clip_model.session.get_outputs()[0].shape[-1])
+    return int(detector.models.clip_model.visual.output_dim)
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def set_threads(detector: BreedDetector, threads: int):
+    """Apply one thread count to every compute library the pipeline uses."""
+    faiss.omp_set_num_threads(threads)
+    if detector.config.BACKEND == "onnx":
+        detector.config.ONNX_INTRA_OP_THREADS = threads
+        detector.models._load_onnx_models()
+    else:
+        torch.set_num_threads(threads)
+
+
+def fallback_box(image: Image.Image) -> list:
+    """Central box used when YOLO finds nothing (untrained weights), so later stages still run."""
+    w, h = image.size
+    return [w // 5, h // 5, w - w // 5, h - h // 5]
+
+
+class BenchDetector(BreedDetector):
+    """The served pipeline, with fallback_box standing in wherever YOLO finds no pet."""
+    
+    def detect_all_animals(self, images: list, max_pets: int = 1):
+        detections = super().detect_all_animals(images, max_pets)
+        return [pets or [(fallback_box(img), 0.0, 16)] for img, pets in zip(images, detections)]
+
+
+def run_batch(detector: BreedDetector, jpegs: list) -> tuple:
+    """
+    One detect_breed_batch call, as the server makes it. Returns ({stage: ms}
+    from the result metadata, end-to-end ms, pets YOLO really detected).
+    """
+    start = time.perf_counter()
+    results = detector.detect_breed_batch(jpegs, "dog", profile=False, multi_pet=False)
+    total_ms = (time.perf_counter() - start) * 1000
+    
+    failed = [r["error"] for r in results if not r["success"]]
+    if failed:
+        raise RuntimeError(f"Benchmark batch failed: {failed[0]}")
+    found = sum(r["metadata"]["detection_confidence"] > 0 for r in results)
+    return results[0]["metadata"]["stage_ms"], total_ms, found
+
+
+def percentiles(values: list) -> dict:
+    arr = np.asarray(values)
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "mean": round(float(arr.mean()), 3)
+    }
+
+
+def bench_config(detector: BreedDetector, jpegs: list, batch_size: int, iterations: int, warmup: int) -> dict:
+    """Time `iterations` batches of one size. Stage latencies are per batch, in ms."""
+    batches = [[jpegs[(i * batch_size + j) % len(jpegs)] for j in range(batch_size)]
+               for i in range(warmup + iterations)]
+    for batch in batches[:warmup]:
+        run_batch(detector, batch)
+    
+    per_stage = {}
+    totals, detected = [], 0
+    start = time.perf_counter()
+    for batch in batches[warmup:]:
+        timings, total_ms, found = run_batch(detector, batch)
+        for stage, ms in timings.items():
+            per_stage.setdefault(stage, []).append(ms)
+        totals.append(total_ms)
+        detected += found
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "stages_ms": {stage: percentiles(values) for stage, values in per_stage.items()},
+        "end_to_end_ms": percentiles(totals),
+        "throughput_ips": round(iterations * batch_size / elapsed, 2),
+        "detected_fraction": round(detected / (iterations * batch_size), 3)
+    }
+
+
+def bench_pool(detector: BreedDetector, paths: list, workers: int, threads: int, iterations: int,
+               warmup: int) -> dict:
+    """
+    End-to-end throughput of a WorkerPool with `workers` processes, each fed
+    single-image requests by the least-outstanding dispatcher.
+    """
+    pool = WorkerPool(workers, threads)
+    try:
+        for worker in pool.workers:
+            for i in range(warmup):
+                pool.submit("detect", ([paths[i % len(paths)]], "dog", False, None), worker=worker).result()
+        
+        total = iterations * workers
+        start = time.perf_counter()
+        futures = [pool.submit("detect", ([paths[i % len(paths)]], "dog", False, None)) for i in range(total)]
+        results = [result for future in futures for result in future.result()]
+        elapsed = time.perf_counter() - start
+        
+        memory = pool.broadcast("memory")
+        served = [w["served"] for w in pool.stats()["workers"]]
+    finally:
+        pool.close()
+    
+    return {
+        "workers": workers,
+        "threads_per_worker": pool.threads,
+        "requests": total,
+        "throughput_ips": round(total / elapsed, 2),
+        "detected_fraction": round(sum(bool(r.get("success")) for r in results) / total, 3),
+        "served_per_worker": served,
+        "worker_shared_mb": [m.get("shared") for m in memory],
+        "worker_unshared_mb": [m.get("unshared") for m in memory]
+    }
+
+
+def scaling(pool_runs: list) -> list:
+    """Speedup and parallel efficiency of each pool size relative to the smallest one."""
+    base = pool_runs[0]
+    for run in pool_runs:
+        speedup = run["throughput_ips"] / base["throughput_ips"] if base["throughput_ips"] else 0.0
+        run["speedup"] = round(speedup, 3)
+        run["efficiency"] = round(speedup * base["workers"] / run["workers"], 3)
+    return pool_runs
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Runs whose p50 end-to-end latency grew more than max_regression over the baseline."""
+    previous = {(r["batch_size"], r["threads"]): r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in report["runs"]:
+        base = previous.get((run["batch_size"], run["threads"]))
+        if base is None:
+            continue
+        old, new = base["end_to_end_ms"]["p50"], run["end_to_end_ms"]["p50"]
+        if old > 0 and new > old * (1 + max_regression):
+            regressions.append({"batch_size": run["batch_size"], "threads": run["threads"],
+                                "baseline_p50_ms": old, "p50_ms": new, "ratio": round(new / old, 3)})
+    return regressions
+
+
+# ============================================================================
+# CLI INTERFACE
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='PawVerse Breed Detection Benchmark')
+    parser.add_argument('--models', default='random', choices=['random', 'local'],
+                        help='random = untrained YOLO/CLIP (fully offline); local = configured weights')
+    parser.add_argument('--backend', default='torch', choices=['torch', 'onnx'], help='Inference backend')
+    parser.add_argument('--images', help='Directory of sample images (default: synthetic JPEGs)')
+    parser.add_argument('--num-images', type=int, default=32, help='Distinct images cycled through')
+    parser.add_argument('--index-size', type=int, default=20000, help='Vectors in the stand-in index')
+    parser.add_argument('--breeds', type=int, default=120, help='Breeds in the stand-in dog index')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--iterations', type=int, default=20, help='Timed batches per configuration')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed batches per configuration')
+    parser.add_argument('--pool-workers', type=int, nargs='+', default=[],
+                        help='Also measure a pre-forked worker pool at these sizes (e.g. 1 2 4)')
+    parser.add_argument('--pool-threads', type=int, default=0,
+                        help='Threads per pool worker (default: CPUs / workers)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report here as well as to stdout')
+    parser.add_argument('--baseline', help='Earlier report; exit 1 if p50 end-to-end regressed')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p50 slowdown vs --baseline')
+    args = parser.parse_args()
+    
+    config = Config()
+    config.BACKEND = args.backend
+    config.device = "cpu"
+    config.use_fp16 = False
+    config.RESULT_CACHE_SIZE = 0
+    if args.models == "random":
+        config.YOLO_WEIGHTS = "yolo11n.yaml"  # Architecture bundled with ultralytics
+        config.CLIP_PRETRAIN = None
+        if args.backend == "torch":
+            torch.manual_seed(args.seed)
+    
+    jpegs = load_jpegs(args.images, args.num_images) if args.images else synthetic_jpegs(args.num_images, args.seed)
+    
+    with tempfile.TemporaryDirectory(prefix="breed_bench_") as data_dir:
+        config.DATA_DIR = Path(data_dir)
+        detector = BenchDetector()
+        
+        dim = embedding_dim(detector)
+        build_stand_in_index(config.DATA_DIR, dim, args.index_size, args.breeds, args.seed)
+        
+        # Pool runs go first: the workers must fork before this process runs any inference
+        # (torch/OpenMP thread pools don't survive fork)
+        pool_runs = []
+        if args.pool_workers:
+            detector.models.preload_indexes()
+            paths = []
+            for i, data in enumerate(jpegs):
+                path = Path(data_dir) / f"sample_{i}.jpg"
+                path.write_bytes(data)
+                paths.append(str(path))
+            for workers in sorted(args.pool_workers):
+                run = bench_pool(detector, paths, workers, args.pool_threads, args.iterations, args.warmup)
+                pool_runs.append(run)
+                print(f"[Bench] pool={workers}x{run['threads_per_worker']} {run['throughput_ips']} img/s",
+                      file=sys.stderr)
+            scaling(pool_runs)
+        
+        runs = []
+        for threads in args.threads:
+            set_threads(detector, threads)
+            for batch_size in args.batch_sizes:
+                run = {"batch_size": batch_size, "threads": threads,
+                       **bench_config(detector, jpegs, batch_size, args.iterations, args.warmup)}
+                runs.append(run)
+                print(f"[Bench] batch={batch_size} threads={threads} "
+                      f"p50={run['end_to_end_ms']['p50']:.1f}ms {run['throughput_ips']} img/s", file=sys.stderr)
+    
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "faiss": faiss.__version__,
+            "torch": torch.__version__ if args.backend == "torch" else None
+        },
+        "settings": {
+            "models": args.models,
+            "backend": args.backend,
+            "images": args.images or "synthetic",
+            "num_images": len(jpegs),
+            "decode_max_side": config.DECODE_MAX_SIDE,
+            "index_size": args.index_size,
+            "index_dim": dim,
+            "iterations": args.iterations,
+            "warmup": args.warmup
+        },
+        "runs": runs
+    }
+    if pool_runs:
+        report["pool_runs"] = pool_runs
+    
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            report["regressions"] = compare(report, json.load(f), args.max_regression)
+        exit_code = 1 if report["regressions"] else 0
+    
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding='utf-8')
+    print(text)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
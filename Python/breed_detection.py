@@ -5,17 +5,77 @@ Detects pet breed from uploaded image using YOLO11 + OpenCLIP + FAISS.
 """
 
 import argparse
+import base64
+import binascii
+import copy
+import cProfile
+import gc
+import hashlib
+import importlib
+import io
 import json
+import math
+import multiprocessing
+import os
+import queue
+import socketserver
+import sqlite3
 import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 import time
+from urllib.parse import parse_qs, urlparse
 
 import numpy as np
-import torch
-import faiss
-import open_clip
-from PIL import Image
-from ultralytics import YOLO
+from PIL import Image, ImageOps
+
+
+# ============================================================================
+# LAZY IMPORTS + STARTUP PROFILE
+# ============================================================================
+
+PROCESS_START = time.perf_counter()
+STARTUP_TIMINGS = OrderedDict()  # stage -> ms, in the order imports/loads happened
+
+
+@contextmanager
+def startup_stage(name: str):
+    """Time one import or model load for --profile-startup."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def startup_profile() -> dict:
+    return {"total_ms": round((time.perf_counter() - PROCESS_START) * 1000, 1), "stages": dict(STARTUP_TIMINGS)}
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy module, imported on first attribute access.
+    torch / faiss / open_clip take seconds to import, so argument errors,
+    --help and the onnx backend (no torch at all) never pay for them.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            with startup_stage(f"import {self._name}"):
+                self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+torch = LazyModule("torch")
+faiss = LazyModule("faiss")
+open_clip = LazyModule("open_clip")
 
 
 # ============================================================================
@@ -46,6 +106,356 @@ def clean_breed_name(raw_breed: str) -> str:
     return breed
 
 
+def decode_image(source, max_side: int = None) -> Image.Image:
+    """
+    Decode an image once as upright RGB. When its long side exceeds
+    max_side, JPEGs are decoded at reduced DCT scale (1/2..1/8) and other
+    formats are reduced by an integer factor, never below max_side.
+    info["original_size"] keeps the full-resolution (oriented) size so
+    boxes found on the smaller image can be mapped back.
+    """
+    img = Image.open(source)
+    width, height = img.size
+    orientation = img.getexif().get(0x0112, 1)  # EXIF Orientation tag
+    
+    if max_side and max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+        img.draft('RGB', (math.ceil(width * ratio), math.ceil(height * ratio)))  # No-op for non-JPEG
+    
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    
+    if max_side:
+        factor = max(img.size) // max_side
+        if factor >= 2:
+            img = img.reduce(factor)
+    
+    # Orientations 5-8 rotate by 90 degrees
+    img.info["original_size"] = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+    return img
+
+
+def read_shared_memory(name: str, size: int) -> bytes:
+    """
+    Copy `size` bytes out of a named shared-memory segment that the caller
+    created and still owns (POSIX shm under /dev/shm, or a Windows named
+    file mapping).
+    """
+    from multiprocessing import shared_memory
+    
+    track = {"track": False} if sys.version_info >= (3, 13) else {}
+    segment = shared_memory.SharedMemory(name=name, **track)
+    try:
+        if size > segment.size:
+            raise ValueError(f"Shared memory segment {name} holds {segment.size} bytes, {size} requested")
+        return bytes(segment.buf[:size])
+    finally:
+        segment.close()
+        if not track and os.name == "posix":
+            # Attaching also registered it for unlinking at our exit; its lifetime is the caller's
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(segment._name, "shared_memory")
+
+
+def image_source(spec):
+    """
+    Image path, or raw bytes for in-memory specs: {"b64": "<base64>"} or
+    {"shm": "<segment name>", "size": <bytes>}. Raw bytes pass through.
+    """
+    if isinstance(spec, (str, bytes)):
+        return spec
+    if isinstance(spec, dict):
+        if "b64" in spec:
+            try:
+                return base64.b64decode(spec["b64"], validate=True)
+            except binascii.Error as e:
+                raise ValueError(f"bad base64: {e}") from None
+        if "shm" in spec:
+            try:
+                size = int(spec["size"])
+            except KeyError:
+                raise ValueError('"shm" needs a "size" (bytes)') from None
+            except (TypeError, ValueError):
+                raise ValueError(f'"size" must be a byte count, got {spec["size"]!r}') from None
+            if size <= 0:
+                raise ValueError(f'"size" must be positive, got {size}')
+            return read_shared_memory(str(spec["shm"]), size)
+    raise ValueError('image must be a path, {"b64": ...} or {"shm": ..., "size": ...}')
+
+
+def read_index(path: Path, mmap: bool = True):
+    """Read a FAISS index, memory-mapped read-only when supported (falls back to a heap copy)."""
+    if mmap:
+        # IO_FLAG_MMAP_IFC (faiss >= 1.9) also maps flat/HNSW vector storage, not just IVF lists
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(str(path), flags)
+        except RuntimeError as e:
+            print(f"[ModelManager] mmap not supported for {path.name}, reading into memory: {e}", file=sys.stderr)
+    return faiss.read_index(str(path))
+
+
+def process_memory_mb() -> dict:
+    """Resident memory of this process, split into private and file-backed pages (Linux only)."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return {}
+    
+    def mb(key):
+        return round(int(fields.get(key, '0 kB').split()[0]) / 1024, 1)
+    
+    return {"rss": mb("VmRSS"), "private": mb("RssAnon"), "file_backed": mb("RssFile")}
+
+
+def process_sharing_mb() -> dict:
+    """Pages this process shares with others (e.g. forked pool workers) vs owns alone (Linux only)."""
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return {}
+    
+    def mb(*keys):
+        return round(sum(int(fields.get(key, '0 kB').split()[0]) for key in keys) / 1024, 1)
+    
+    return {"pss": mb("Pss"), "shared": mb("Shared_Clean", "Shared_Dirty"),
+            "unshared": mb("Private_Clean", "Private_Dirty")}
+
+
+def tune_index(index, nprobe: int, ef_search: int):
+    """Apply search-time knobs to IVF (nprobe) and HNSW (efSearch) indexes; flat indexes are untouched."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def cpu_supports_bf16() -> bool:
+    """True when oneDNN runs bfloat16 natively here (AVX512-BF16 / AMX); emulated bf16 is slower than fp32."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def optimize_clip_visual(clip_model, mode: str, device: str, cache_path: Path = None):
+    """
+    Swap the CLIP visual tower for a TorchScript graph ("script": traced and
+    frozen, loaded from / saved to cache_path when given) or a torch.compile
+    wrapper ("compile", compiled lazily on the first batch of each shape).
+    """
+    if mode == "compile":
+        clip_model.visual = torch.compile(clip_model.visual)
+        return clip_model
+    if mode != "script":
+        raise ValueError(f"Unknown CLIP_COMPILE mode: {mode} (expected 'script' or 'compile')")
+    
+    if cache_path is not None and cache_path.exists():
+        clip_model.visual = torch.jit.load(str(cache_path), map_location=device)
+        print(f"[ModelManager] OpenCLIP visual graph from {cache_path.name}", file=sys.stderr)
+        return clip_model
+    
+    dtype = clip_model.visual.conv1.weight.dtype
+    example = torch.zeros(2, 3, *clip_model.visual.image_size, dtype=dtype, device=device)
+    with torch.no_grad():
+        clip_model.visual = torch.jit.freeze(torch.jit.trace(clip_model.visual, example, check_trace=False))
+    
+    if cache_path is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_suffix(".pt.tmp")
+            torch.jit.save(clip_model.visual, str(tmp))
+            tmp.replace(cache_path)
+            print(f"[ModelManager] Wrote OpenCLIP visual graph {cache_path}", file=sys.stderr)
+        except OSError as e:
+            print(f"[ModelManager] Could not cache OpenCLIP visual graph: {e}", file=sys.stderr)
+    return clip_model
+
+
+def quantize_clip_dynamic(clip_model):
+    """INT8 weights for the visual tower's Linear layers (activations quantized per batch at runtime)."""
+    clip_model.visual = torch.ao.quantization.quantize_dynamic(clip_model.visual, {torch.nn.Linear}, dtype=torch.qint8)
+    return clip_model
+
+
+# ============================================================================
+# LABEL STORE (compact, array-backed view of id_map.json)
+# ============================================================================
+
+class LabelStore:
+    """
+    Breed labels for every vector of a FAISS index.
+    
+    Holds one int32 breed code per vector plus a pre-cleaned breed-name
+    table. Per-vector paths (crop_path / src_path) stay in id_map.json and
+    are only parsed when entry() is first called. The codes are cached in
+    id_map.labels.npz next to the id_map so later starts skip the JSON.
+    """
+    
+    CACHE_NAME = "id_map.labels.npz"
+    
+    def __init__(self, codes: np.ndarray, breeds_raw: list, idmap_path: Path = None):
+        self.codes = codes.astype(np.int32, copy=False)
+        self.breeds_raw = list(breeds_raw)
+        self.breeds = [clean_breed_name(b) for b in self.breeds_raw]
+        self._idmap_path = idmap_path
+        self._entries = None
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    @classmethod
+    def from_id_map(cls, id_map, idmap_path: Path = None):
+        """Build from a parsed id_map (list of dicts, or dict keyed by str(idx))."""
+        if isinstance(id_map, list):
+            raw = [entry.get('breed', 'UNKNOWN') for entry in id_map]
+        else:
+            size = max((int(k) for k in id_map), default=-1) + 1
+            raw = ['UNKNOWN'] * size
+            for key, entry in id_map.items():
+                raw[int(key)] = entry.get('breed', 'UNKNOWN')
+        
+        breeds_raw = sorted(set(raw) | {'UNKNOWN'})
+        lookup = {breed: code for code, breed in enumerate(breeds_raw)}
+        codes = np.fromiter((lookup[b] for b in raw), dtype=np.int32, count=len(raw))
+        
+        return cls(codes, breeds_raw, idmap_path)
+    
+    @classmethod
+    def load(cls, idmap_path: Path):
+        """Load from the .npz cache if it matches id_map.json, otherwise rebuild it."""
+        cache_path = idmap_path.parent / cls.CACHE_NAME
+        stat = idmap_path.stat()
+        stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        
+        if cache_path.exists():
+            try:
+                with np.load(cache_path) as cached:
+                    if np.array_equal(cached["stamp"], stamp):
+                        return cls(cached["codes"], cached["breeds"].tolist(), idmap_path)
+            except (OSError, ValueError, KeyError):
+                pass  # Corrupt or old-format cache, rebuild below
+        
+        with open(idmap_path, 'r', encoding='utf-8') as f:
+            store = cls.from_id_map(json.load(f), idmap_path)
+        
+        # Written aside and renamed, since pool workers reloading the same id_map may race here
+        tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, codes=store.codes, breeds=np.array(store.breeds_raw), stamp=stamp)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            print(f"[LabelStore] Could not write {cache_path}: {e}", file=sys.stderr)
+        
+        return store
+    
+    def breed_scores(self, similarities: np.ndarray, indices: np.ndarray):
+        """
+        Aggregate (Q, K) neighbour matrices into (Q, B) per-breed scores,
+        using the MAX similarity of each breed. Breeds without a neighbour
+        (and FAISS -1 padding) score -inf.
+        """
+        sims = np.atleast_2d(np.asarray(similarities, dtype=np.float32))
+        idxs = np.atleast_2d(np.asarray(indices))
+        
+        valid = idxs >= 0
+        rows = np.nonzero(valid)[0]
+        codes = self.codes[idxs[valid]]
+        
+        scores = np.full((sims.shape[0], len(self.breeds)), -np.inf, dtype=np.float32)
+        np.maximum.at(scores, (rows, codes), sims[valid])
+        return scores
+    
+    def entry(self, idx: int) -> dict:
+        """Full id_map entry for one vector (paths are loaded on first use)."""
+        if self._entries is None:
+            with open(self._idmap_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        
+        if isinstance(self._entries, list):
+            return self._entries[idx]
+        return self._entries.get(str(idx), {})
+
+
+class BreedPrototypes:
+    """
+    A few reference vectors per breed (k-means medoids of the flat index,
+    built by breed_index_tools.py prototypes). Scoring a query against them
+    costs O(breeds) instead of O(corpus), so confident queries can skip the
+    full neighbour search. The file records the flat index + id_map it was
+    built from and is ignored once either changes.
+    """
+    
+    def __init__(self, vectors: np.ndarray, codes: np.ndarray, n_breeds: int):
+        # Grouped by breed so scoring is one matmul + one segmented max
+        order = np.argsort(codes, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order], dtype=np.float32)
+        self.codes = codes[order].astype(np.int32, copy=False)
+        self.n_breeds = n_breeds
+        self._starts = np.flatnonzero(np.r_[True, self.codes[1:] != self.codes[:-1]])
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    @staticmethod
+    def source_stamp(flat_path: Path, idmap_path: Path) -> str:
+        return ":".join(f"{p.stat().st_mtime_ns}:{p.stat().st_size}" for p in (flat_path, idmap_path))
+    
+    @classmethod
+    def load(cls, path: Path, labels: LabelStore, stamp: str):
+        """Prototypes mapped onto labels' breed codes, or None if missing or built from other files."""
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if str(data["stamp"]) != stamp:
+                print(f"[ModelManager] {path.name} is out of date with the index, ignoring it", file=sys.stderr)
+                return None
+            lookup = {breed: code for code, breed in enumerate(labels.breeds_raw)}
+            codes = np.array([lookup.get(b, lookup['UNKNOWN']) for b in data["breeds"].tolist()], dtype=np.int32)
+            return cls(data["vectors"], codes, len(labels.breeds))
+    
+    def breed_scores(self, vectors: np.ndarray) -> np.ndarray:
+        """(Q, B) best prototype similarity per breed; breeds without prototypes score -inf."""
+        sims = np.asarray(vectors, dtype=np.float32) @ self.vectors.T
+        scores = np.full((sims.shape[0], self.n_breeds), -np.inf, dtype=np.float32)
+        scores[:, self.codes[self._starts]] = np.maximum.reduceat(sims, self._starts, axis=1)
+        return scores
+    
+    @staticmethod
+    def margins(scores: np.ndarray) -> np.ndarray:
+        """Top-1 minus top-2 breed score per row (inf when only one breed scores)."""
+        if scores.shape[1] < 2:
+            return np.full(scores.shape[0], np.inf, dtype=np.float32)
+        top2 = -np.partition(-scores, 1, axis=1)[:, :2]
+        with np.errstate(invalid='ignore'):
+            return np.where(np.isfinite(top2[:, 1]), top2[:, 0] - top2[:, 1], np.inf)
+
+
+class SpeciesDatabase:
+    """
+    One loaded version of a species' FAISS index, labels and prototypes.
+    
+    Never mutated: a reload builds a new one and swaps it in, so a search
+    that already holds this one finishes on a consistent index + labels
+    pair and the old version is freed with its last reference.
+    """
+    
+    def __init__(self, index, labels: LabelStore, prototypes, version: str, stamp: str):
+        self.index = index
+        self.labels = labels
+        self.prototypes = prototypes
+        self.version = version    # Short hash of the files actually loaded (reported in results)
+        self.stamp = stamp        # Raw stat stamp of the watched files (compared by the watcher)
+        self.loaded_at = time.time()
+    
+    def info(self) -> dict:
+        return {"version": self.version, "vectors": self.index.ntotal, "breeds": len(self.labels.breeds),
+                "prototypes": self.prototypes is not None, "loaded_at": round(self.loaded_at, 1)}
+
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -76,12 +486,393 @@ class Config:
         self.CLIP_MODEL = "ViT-B-16"
         self.CLIP_PRETRAIN = "dfn2b"
         
-        # Device config
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.use_fp16 = torch.cuda.is_available()  # FP16 only on GPU
+        # FAISS config (non-flat variants are built by breed_index_tools.py)
+        self.FAISS_INDEX_FILES = {
+            "flat": "faiss_IndexFlatIP.faiss",
+            "ivf_flat": "faiss_IVFFlat.faiss",
+            "ivf_pq": "faiss_IVFPQ.faiss",
+            "hnsw": "faiss_HNSW.faiss",
+            "pca": "faiss_PCA.faiss",  # PCA-reduced float16 / 8-bit vectors, queries projected by the index
+        }
+        self.FAISS_INDEX_VARIANT = "flat"
+        self.FAISS_NPROBE = 16       # IVF lists visited per query
+        self.FAISS_EF_SEARCH = 128   # HNSW candidate list size
+        self.FAISS_MMAP = True       # Map index files read-only (shared page cache across processes)
+        self.FAISS_PRELOAD = False   # Load dog + cat indexes at init instead of on first request
+        
+        # Search backend: "faiss" (any FAISS_INDEX_VARIANT) or "numpy" (exact flat search over the
+        # .npy export, breed_index_tools.py export-npy) for small deployments that skip importing faiss.
+        # The .npy is memory-mapped when FAISS_MMAP is on and scanned NUMPY_BLOCK_SIZE rows at a time.
+        self.SEARCH_BACKEND = "faiss"
+        self.NUMPY_INDEX_FILE = "index_vectors.npy"
+        self.NUMPY_BLOCK_SIZE = 16384
+        
+        # Hot reload (server mode): every INDEX_RELOAD_INTERVAL seconds the loaded species' index,
+        # id_map and prototype files are stat'ed. Files that changed and then stayed unchanged for a
+        # whole interval are loaded in the background and swapped in; requests already searching
+        # finish on the old version. 0 disables it ({"cmd": "reload"} still works).
+        self.INDEX_RELOAD_INTERVAL = 0
+        
+        # Breed prototypes (breed_index_tools.py prototypes): queries whose top-1/top-2 breed
+        # margin against the prototypes is at least this skip the full search. None disables.
+        self.PROTOTYPE_MARGIN = None
+        self.PROTOTYPE_FILE = "breed_prototypes.npz"
+        
+        # Decode resolution: YOLO runs at 640 px and CLIP at 224 px, so larger
+        # uploads are decoded at reduced scale (long side >= this)
+        self.DECODE_MAX_SIDE = 1280
+        
+        # CLIP input built for the whole batch at once (ClipBatchPreprocessor) instead of
+        # open_clip's per-image transform; matches it to within one uint8 level per pixel
+        self.BATCH_PREPROCESS = True
+        
+        # Result cache (keyed by image bytes + model/index version)
+        self.RESULT_CACHE_SIZE = 1024  # In-memory LRU entries, 0 disables the cache
+        self.RESULT_CACHE_DB = None    # Optional SQLite file that persists entries across restarts
+        
+        # CLIP zero-shot species gate: when the whole photo's "close-up of a <type>" probability
+        # is at least this (and matches the requested type), YOLO is skipped and the full frame
+        # is the crop. The "other" prompts catch distant, crowded or pet-less scenes. None disables;
+        # multi-pet requests always use YOLO.
+        self.SPECIES_GATE = None
+        self.SPECIES_GATE_PROMPTS = {
+            "dog": ["a close-up photo of a dog", "a photo of a dog's face", "a portrait photo of a dog"],
+            "cat": ["a close-up photo of a cat", "a photo of a cat's face", "a portrait photo of a cat"],
+            "other": ["a photo of a dog in the distance", "a photo of a cat in the distance",
+                      "a photo of a person", "a photo of several animals", "a photo of a room",
+                      "a photo of a street", "a photo of a landscape"]
+        }
+        
+        # Micro-batching (server mode): concurrent detect requests are queued and run as one
+        # batch of up to MICRO_BATCH_SIZE, waiting at most MICRO_BATCH_WAIT_MS for more to
+        # arrive. 0 disables it (requests then run one at a time).
+        self.MICRO_BATCH_SIZE = 0
+        self.MICRO_BATCH_WAIT_MS = 5
+        self.MICRO_BATCH_QUEUE = 64       # Requests waiting beyond this are rejected right away
+        self.DECODE_WORKERS = 4           # Image decode threads (bulk mode, micro-batching)
+        
+        # Worker pool (server mode, Linux/macOS): fork this many processes after the models and
+        # indexes are loaded, so they share the weights and mmap'd indexes copy-on-write.
+        # 0 keeps a single process. POOL_THREADS = 0 splits the CPUs evenly between workers.
+        self.POOL_WORKERS = 0
+        self.POOL_THREADS = 0
+        self.POOL_PIN_CPUS = True  # Give each worker its own cores (sched_setaffinity) when they divide evenly
+        
+        # Multi-pet mode: a breed result for every dog/cat box (up to MAX_PETS, best first)
+        self.MULTI_PET = False
+        self.MAX_PETS = 10
+        
+        # Observability: metrics registry (counters + latency histograms) and request profiling
+        self.METRICS_ENABLED = False
+        self.PROFILE_REQUESTS = False  # Profile every detect call (server requests can opt in with "profile": true)
+        self.PROFILER = "cprofile"     # "cprofile" (.prof for pstats/snakeviz) or "torch" (Chrome trace .json)
+        self.PROFILE_DIR = self.BASE_DIR / "Python" / "profiles"
+        
+        # Device config (resolved on first use, see the properties below)
+        self._device = None
+        self._use_fp16 = None
+        
+        # Local copy of the CLIP weights + preprocess config, written on the first
+        # hub load so later starts skip open_clip's hub resolution
+        self.CLIP_SNAPSHOT_DIR = self.MODELS_DIR / "snapshots"
+        
+        # Inference backend: "torch" or "onnx" (CPU onnxruntime, see breed_model_tools.py export-onnx)
+        self.BACKEND = "torch"
+        self.ONNX_DIR = self.MODELS_DIR / "onnx"
+        self.ONNX_INTRA_OP_THREADS = 0  # 0 = onnxruntime default (all physical cores)
+        self.ONNX_INTER_OP_THREADS = 0
+        
+        # INT8 CLIP visual encoder on CPU: "dynamic" (torch or onnx) or "static" (onnx only,
+        # calibrated by breed_model_tools.py quantize-onnx). None keeps full precision.
+        self.CLIP_QUANTIZE = None
+        
+        # Optimized torch execution of the CLIP visual tower. CLIP_COMPILE "script" traces and
+        # freezes it with TorchScript, cached under COMPILED_DIR (keyed by weights, precision and
+        # torch version) so restarts skip the trace; "compile" uses torch.compile, with inductor's
+        # kernel cache in the same directory. None stays eager.
+        self.CLIP_COMPILE = None
+        self.COMPILED_DIR = self.MODELS_DIR / "compiled"
+        self.CPU_BF16 = False  # bfloat16 CLIP weights when the CPU has native bf16 (AVX512-BF16 / AMX)
+        self.WARMUP = False    # Dummy batches through YOLO + CLIP at init, so the first request doesn't pay for them
         
         # Create models dir
         self.MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+    
+    @device.setter
+    def device(self, value: str):
+        self._device = value
+    
+    @property
+    def use_fp16(self) -> bool:
+        """FP16 only on GPU."""
+        if self._use_fp16 is None:
+            self._use_fp16 = self.device == "cuda"
+        return self._use_fp16
+    
+    @use_fp16.setter
+    def use_fp16(self, value: bool):
+        self._use_fp16 = value
+
+
+# ============================================================================
+# ONNX RUNTIME BACKEND (CPU inference without the torch model objects)
+# ============================================================================
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy non-maximum suppression on (N, 4) xyxy boxes. Returns kept indices, best first."""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    
+    return np.array(keep, dtype=np.int64)
+
+
+class OnnxYoloDetector:
+    """YOLO11 exported to ONNX: letterbox -> onnxruntime -> class filter + NMS in NumPy."""
+    
+    def __init__(self, model_path: Path, session_options, imgsz: int = 640):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(str(model_path), session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+    
+    def letterbox(self, image: Image.Image):
+        """Resize keeping aspect ratio and pad to imgsz x imgsz with gray (as ultralytics does)."""
+        ratio = min(self.imgsz / image.width, self.imgsz / image.height)
+        new_w, new_h = round(image.width * ratio), round(image.height * ratio)
+        pad_x, pad_y = (self.imgsz - new_w) / 2, (self.imgsz - new_h) / 2
+        
+        canvas = Image.new("RGB", (self.imgsz, self.imgsz), (114, 114, 114))
+        canvas.paste(image.resize((new_w, new_h), Image.BILINEAR), (round(pad_x - 0.1), round(pad_y - 0.1)))
+        return np.asarray(canvas), ratio, (round(pad_x - 0.1), round(pad_y - 0.1))
+    
+    def predict(self, images: list, conf: float, iou: float, classes: list):
+        """Returns one (xyxy, confs, classes) NumPy triple per image, in image pixel coordinates."""
+        boxed = [self.letterbox(img) for img in images]
+        batch = np.stack([arr for arr, _, _ in boxed]).transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        
+        # (N, 4 + num_classes, anchors) -> (N, anchors, 4 + num_classes)
+        output = self.session.run(None, {self.input_name: batch})[0].transpose(0, 2, 1)
+        
+        detections = []
+        for pred, img, (_, ratio, (pad_x, pad_y)) in zip(output, images, boxed):
+            # Like ultralytics: a box counts only if its best class overall is a wanted one
+            class_scores = pred[:, 4:]
+            best = class_scores.argmax(axis=1)
+            scores = class_scores.max(axis=1)
+            mask = (scores > conf) & np.isin(best, classes)
+            
+            cx, cy, w, h = pred[mask, :4].T
+            boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+            scores, labels = scores[mask], best[mask]
+            
+            # Per-class NMS via coordinate offsets
+            keep = nms(boxes + labels[:, None] * 4096.0, scores, iou) if len(scores) else np.array([], dtype=np.int64)
+            
+            boxes = (boxes[keep] - [pad_x, pad_y, pad_x, pad_y]) / ratio
+            boxes = np.clip(boxes, 0, [img.width, img.height, img.width, img.height])
+            detections.append((boxes, scores[keep], labels[keep].astype(np.float32)))
+        
+        return detections
+
+
+class OnnxClipEncoder:
+    """OpenCLIP visual tower exported to ONNX, with the matching preprocess done in PIL/NumPy."""
+    
+    def __init__(self, model_path: Path, session_options):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(str(model_path), session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        
+        with open(model_path.with_suffix(".json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.meta = meta
+        self.image_size = meta["image_size"]
+        self.resize_mode = meta["resize_mode"]
+        self.interpolation = Image.BICUBIC if meta["interpolation"] == "bicubic" else Image.BILINEAR
+        self.mean = np.array(meta["mean"], dtype=np.float32)[:, None, None]
+        self.std = np.array(meta["std"], dtype=np.float32)[:, None, None]
+    
+    def preprocess(self, image: Image.Image) -> np.ndarray:
+        """Same steps as the open_clip eval transform: resize, center crop, scale, normalize."""
+        size = self.image_size
+        if self.resize_mode == "squash":
+            image = image.resize((size, size), self.interpolation)
+        else:
+            # torchvision Resize(size): shortest side -> size, long side truncated
+            if image.width <= image.height:
+                new_w, new_h = size, int(size * image.height / image.width)
+            else:
+                new_w, new_h = int(size * image.width / image.height), size
+            image = image.resize((new_w, new_h), self.interpolation)
+            left = int(round((new_w - size) / 2.0))
+            top = int(round((new_h - size) / 2.0))
+            image = image.crop((left, top, left + size, top + size))
+        
+        arr = np.asarray(image.convert('RGB'), dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return (arr - self.mean) / self.std
+    
+    def encode_image(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+
+# ============================================================================
+# NUMPY SEARCH BACKEND (exact inner-product search without importing faiss)
+# ============================================================================
+
+class NumpyFlatIndex:
+    """
+    Drop-in for a FAISS IndexFlatIP over an (N, D) float32 .npy file
+    (breed_index_tools.py export-npy): the corpus is scanned in blocks of
+    block_size rows, one matmul each, and argpartition keeps each query's
+    running top k, so memory stays at O(Q * (block_size + k)). Results
+    match IndexFlatIP up to float rounding (near-ties may swap places);
+    missing neighbours are padded with id -1 like FAISS.
+    """
+    
+    PAD_SIMILARITY = -np.finfo(np.float32).max  # What IndexFlatIP reports for padded slots
+    
+    def __init__(self, vectors: np.ndarray, block_size: int = 16384):
+        if vectors.ndim != 2 or vectors.dtype != np.float32:
+            raise ValueError(f"expected an (N, D) float32 array, got {vectors.dtype} {vectors.shape}")
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+        self.block_size = max(1, block_size)
+    
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True, block_size: int = 16384):
+        """Open a .npy corpus, memory-mapped read-only (shared page cache) unless mmap is False."""
+        return cls(np.load(path, mmap_mode='r' if mmap else None), block_size)
+    
+    def search(self, queries: np.ndarray, k: int):
+        """(Q, k) similarities and ids, best first, like faiss Index.search."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.d)
+        keep = min(k, self.ntotal)
+        top_sims = np.empty((len(queries), 0), dtype=np.float32)
+        top_ids = np.empty((len(queries), 0), dtype=np.int64)
+        
+        for start in range(0, self.ntotal, self.block_size):
+            sims = queries @ self.vectors[start:start + self.block_size].T
+            ids = np.broadcast_to(np.arange(start, start + sims.shape[1], dtype=np.int64), sims.shape)
+            
+            # Merge this block's candidates with the running top k
+            sims = np.concatenate([top_sims, sims], axis=1)
+            ids = np.concatenate([top_ids, ids], axis=1)
+            if sims.shape[1] > keep:
+                part = np.argpartition(-sims, keep - 1, axis=1)[:, :keep]
+                sims = np.take_along_axis(sims, part, axis=1)
+                ids = np.take_along_axis(ids, part, axis=1)
+            top_sims, top_ids = sims, ids
+        
+        order = np.lexsort((top_ids, -top_sims))  # Best first, ties by id
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        top_ids = np.take_along_axis(top_ids, order, axis=1)
+        
+        if keep < k:
+            top_sims = np.pad(top_sims, ((0, 0), (0, k - keep)), constant_values=self.PAD_SIMILARITY)
+            top_ids = np.pad(top_ids, ((0, 0), (0, k - keep)), constant_values=-1)
+        return top_sims, top_ids
+
+
+# ============================================================================
+# BATCH PREPROCESSING (CLIP input without the per-image open_clip transform)
+# ============================================================================
+
+class ClipBatchPreprocessor:
+    """
+    Batched form of the open_clip eval transform (resize the shortest side,
+    center crop, scale, normalize). Each crop is resized straight into its
+    center-crop window with one PIL call, so only pixels that survive the crop
+    are resampled, and lands in a reused planar uint8 buffer; the batch is
+    then normalized with one multiply-subtract into a reused float32 buffer.
+    Buffers are per thread: the returned array is overwritten by that
+    thread's next call.
+    """
+    
+    RESIZE_MODES = ("shortest", "squash")
+    
+    def __init__(self, image_size: int, mean, std, interpolation: str = "bicubic", resize_mode: str = "shortest"):
+        if resize_mode not in self.RESIZE_MODES:
+            raise ValueError(f"Unsupported CLIP resize_mode for batch preprocessing: {resize_mode}")
+        self.image_size = image_size
+        self.resize_mode = resize_mode
+        self.interpolation = Image.BICUBIC if interpolation == "bicubic" else Image.BILINEAR
+        
+        # (x / 255 - mean) / std == x * scale - shift
+        std = np.asarray(std, dtype=np.float32)
+        self.scale = (1.0 / (255.0 * std))[:, None, None]
+        self.shift = (np.asarray(mean, dtype=np.float32) / std)[:, None, None]
+        self._local = threading.local()
+    
+    @classmethod
+    def from_config(cls, cfg: dict):
+        """From open_clip's visual.preprocess_cfg or the exported ONNX metadata; None if unsupported."""
+        if not cfg:
+            return None
+        size = cfg.get("size", cfg.get("image_size"))
+        if isinstance(size, (tuple, list)):
+            if size[0] != size[1]:
+                return None
+            size = size[0]
+        resize_mode = cfg.get("resize_mode", "shortest")
+        if resize_mode not in cls.RESIZE_MODES:
+            return None
+        return cls(int(size), cfg["mean"], cfg["std"], cfg.get("interpolation", "bicubic"), resize_mode)
+    
+    def crop_window(self, width: int, height: int) -> tuple:
+        """Source box that torchvision's Resize(size) + CenterCrop(size) ends up sampling."""
+        size = self.image_size
+        if self.resize_mode == "squash":
+            return (0, 0, width, height)
+        
+        # Shortest side -> size, long side truncated (torchvision), then a centered size x size crop
+        if width <= height:
+            new_w, new_h = size, int(size * height / width)
+        else:
+            new_w, new_h = int(size * width / height), size
+        left = int(round((new_w - size) / 2.0))
+        top = int(round((new_h - size) / 2.0))
+        scale_x, scale_y = width / new_w, height / new_h
+        return (left * scale_x, top * scale_y, (left + size) * scale_x, (top + size) * scale_y)
+    
+    def _buffers(self, count: int):
+        pixels = getattr(self._local, "pixels", None)
+        if pixels is None or len(pixels) < count:
+            shape = (max(count, 8), 3, self.image_size, self.image_size)
+            self._local.pixels = pixels = np.empty(shape, dtype=np.uint8)
+            self._local.batch = np.empty(shape, dtype=np.float32)
+        return pixels[:count], self._local.batch[:count]
+    
+    def __call__(self, images: list) -> np.ndarray:
+        """(N, 3, S, S) float32 CLIP input for a list of PIL images."""
+        pixels, batch = self._buffers(len(images))
+        size = (self.image_size, self.image_size)
+        for i, image in enumerate(images):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            resized = image.resize(size, self.interpolation, box=self.crop_window(image.width, image.height))
+            pixels[i] = np.asarray(resized).transpose(2, 0, 1)
+        
+        np.multiply(pixels, self.scale, out=batch)
+        batch -= self.shift
+        return batch
 
 
 # ============================================================================
@@ -104,34 +895,107 @@ class ModelManager:
             self.yolo = None
             self.clip_model = None
             self.preprocess = None
-            self.faiss_indices = {}
+            self.batch_preprocess = None
+            self.databases = {}  # animal type -> SpeciesDatabase (replaced whole on reload)
+            self.species_text = None
+            self.clip_precision = "fp32"
+            self._index_lock = threading.Lock()
+            self._reload_lock = threading.RLock()
+            self._pending_stamps = {}  # animal type -> stamp seen once (or ("failed", stamp))
+            self._watcher = None
             self._load_models()
+            if self.config.FAISS_PRELOAD:
+                self.preload_indexes()
             ModelManager._initialized = True
     
+    @staticmethod
+    def onnx_paths():
+        """(yolo, clip) ONNX file locations for the configured weights."""
+        config = Config()
+        suffix = f"_int8_{config.CLIP_QUANTIZE}" if config.CLIP_QUANTIZE else ""
+        return (config.ONNX_DIR / f"{Path(config.YOLO_WEIGHTS).stem}.onnx",
+                config.ONNX_DIR / f"clip_{config.CLIP_MODEL}_{config.CLIP_PRETRAIN}{suffix}.onnx")
+    
+    def _load_onnx_models(self):
+        """Load the exported YOLO and CLIP visual graphs into onnxruntime sessions."""
+        import onnxruntime as ort
+        
+        yolo_path, clip_path = self.onnx_paths()
+        for path in (yolo_path, clip_path):
+            if not path.exists():
+                raise FileNotFoundError(f"ONNX model not found: {path} (run breed_model_tools.py export-onnx)")
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.config.ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = self.config.ONNX_INTER_OP_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        self.yolo = OnnxYoloDetector(yolo_path, options)
+        self.clip_model = OnnxClipEncoder(clip_path, options)
+        self.preprocess = self.clip_model.preprocess
+        if self.config.BATCH_PREPROCESS:
+            self.batch_preprocess = ClipBatchPreprocessor.from_config(self.clip_model.meta)
+        print(f"[ModelManager] ONNX models loaded (intra_op={options.intra_op_num_threads}, "
+              f"inter_op={options.inter_op_num_threads})", file=sys.stderr)
+    
     def _load_models(self):
         """Load YOLO and OpenCLIP models."""
         print("[ModelManager] Loading models...", file=sys.stderr)
         start = time.time()
         
+        if self.config.BACKEND == "onnx":
+            with startup_stage("load onnx models"):
+                self._load_onnx_models()
+            if self.config.CLIP_QUANTIZE:
+                self.clip_precision = "int8"
+            print(f"[ModelManager] All models loaded in {time.time() - start:.2f}s", file=sys.stderr)
+            return
+        
+        # Resolving the device imports torch; do it first so the profile attributes it to torch
+        device = self.config.device
+        
         # Load YOLO
-        self.yolo = YOLO(self.config.YOLO_WEIGHTS)
+        with startup_stage("import ultralytics"):
+            from ultralytics import YOLO
+        with startup_stage("load yolo"):
+            self.yolo = YOLO(self.config.YOLO_WEIGHTS)
         print(f"[ModelManager] YOLO loaded", file=sys.stderr)
         
         # Load OpenCLIP
-        self.clip_model, _, self.preprocess = open_clip.create_model_and_transforms(
-            self.config.CLIP_MODEL,
-            pretrained=self.config.CLIP_PRETRAIN,
-            device=self.config.device
-        )
-        self.clip_model.eval()
-        
-        # Convert to FP16 for speed optimization on GPU
-        if self.config.use_fp16:
+        with startup_stage("load clip"):
+            self._load_clip(device)
+        if self.config.BATCH_PREPROCESS:
+            preprocess_cfg = getattr(self.clip_model.visual, "preprocess_cfg", None)
+            self.batch_preprocess = ClipBatchPreprocessor.from_config(preprocess_cfg)
+        
+        # INT8 Linear layers for CPU, otherwise FP16 on GPU (or BF16 on CPUs that support it)
+        if self.config.CLIP_QUANTIZE:
+            if self.config.CLIP_QUANTIZE != "dynamic" or self.config.device != "cpu":
+                raise ValueError(f"CLIP_QUANTIZE={self.config.CLIP_QUANTIZE} is not available here: torch only "
+                                 f"supports 'dynamic' on CPU (use --backend onnx for 'static')")
+            self.clip_model = quantize_clip_dynamic(self.clip_model)
+            self.clip_precision = "int8"
+            print(f"[ModelManager] OpenCLIP loaded with dynamic INT8 linear layers on cpu", file=sys.stderr)
+        elif self.config.use_fp16:
             self.clip_model = self.clip_model.half()
+            self.clip_precision = "fp16"
             print(f"[ModelManager] OpenCLIP loaded with FP16 on {self.config.device}", file=sys.stderr)
+        elif self.config.CPU_BF16 and device == "cpu" and cpu_supports_bf16():
+            self.clip_model = self.clip_model.to(torch.bfloat16)
+            self.clip_precision = "bf16"
+            print(f"[ModelManager] OpenCLIP loaded with BF16 weights on cpu", file=sys.stderr)
         else:
+            if self.config.CPU_BF16 and device == "cpu":
+                print(f"[ModelManager] No native BF16 on this CPU, keeping FP32", file=sys.stderr)
             print(f"[ModelManager] OpenCLIP loaded on {self.config.device}", file=sys.stderr)
         
+        if self.config.CLIP_COMPILE:
+            with startup_stage("compile clip"):
+                if self.config.CLIP_COMPILE == "compile":
+                    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(self.config.COMPILED_DIR / "inductor"))
+                self.clip_model = optimize_clip_visual(self.clip_model, self.config.CLIP_COMPILE, device,
+                                                       self.compiled_clip_path(self.clip_precision))
+        
         # Clear GPU cache
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
@@ -139,228 +1003,1905 @@ class ModelManager:
         elapsed = time.time() - start
         print(f"[ModelManager] All models loaded in {elapsed:.2f}s", file=sys.stderr)
     
-    def load_faiss_index(self, animal_type: str):
-        """Load FAISS index and id_map for animal type (dog/cat)."""
-        if animal_type in self.faiss_indices:
-            return self.faiss_indices[animal_type]
+    @staticmethod
+    def clip_snapshot_path() -> Path:
+        """Local CLIP weights file; its preprocess/model config sits next to it as .json."""
+        config = Config()
+        return config.CLIP_SNAPSHOT_DIR / f"clip_{config.CLIP_MODEL}_{config.CLIP_PRETRAIN}.pt"
+    
+    @staticmethod
+    def compiled_clip_path(precision: str):
+        """Cached TorchScript graph of the configured CLIP weights at this precision (None for untrained weights)."""
+        config = Config()
+        if not config.CLIP_PRETRAIN:
+            return None
         
-        data_path = self.config.DATA_DIR / animal_type
-        faiss_path = data_path / "faiss_IndexFlatIP.faiss"
-        idmap_path = data_path / "id_map.json"
+        stamp = [config.CLIP_MODEL, config.CLIP_PRETRAIN, precision, config.device, torch.__version__]
+        snapshot = ModelManager.clip_snapshot_path()
+        if snapshot.exists():
+            stat = snapshot.stat()
+            stamp += [stat.st_size, stat.st_mtime_ns]
+        key = hashlib.sha1(json.dumps(stamp).encode('utf-8')).hexdigest()[:12]
+        return config.COMPILED_DIR / f"clip_{config.CLIP_MODEL}_{config.CLIP_PRETRAIN}_{precision}_{key}.pt"
+    
+    def _load_clip(self, device: str):
+        """Create OpenCLIP from the local snapshot if present, else from the hub (and snapshot it)."""
+        self.clip_model, self.preprocess = self._create_clip(device)
+    
+    def _create_clip(self, device: str):
+        """(model, preprocess) in eval mode, from the local snapshot if present, else from the hub."""
+        snapshot = self.clip_snapshot_path()
+        meta_path = snapshot.with_suffix(".json")
         
-        if not faiss_path.exists():
-            raise FileNotFoundError(f"FAISS index not found: {faiss_path}")
-        if not idmap_path.exists():
-            raise FileNotFoundError(f"ID map not found: {idmap_path}")
+        if self.config.CLIP_PRETRAIN and snapshot.exists() and meta_path.exists():
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            
+            # A file path bypasses the pretrained tag, so its config has to be passed explicitly
+            clip_model, _, preprocess = open_clip.create_model_and_transforms(
+                self.config.CLIP_MODEL,
+                pretrained=str(snapshot),
+                device=device,
+                force_quick_gelu=meta["quick_gelu"],
+                image_mean=meta["mean"],
+                image_std=meta["std"],
+                image_interpolation=meta["interpolation"],
+                image_resize_mode=meta["resize_mode"]
+            )
+            print(f"[ModelManager] OpenCLIP weights from snapshot {snapshot.name}", file=sys.stderr)
+        else:
+            clip_model, _, preprocess = open_clip.create_model_and_transforms(
+                self.config.CLIP_MODEL,
+                pretrained=self.config.CLIP_PRETRAIN,
+                device=device
+            )
+            if self.config.CLIP_PRETRAIN:
+                self._write_clip_snapshot(clip_model, snapshot)
         
-        # Load FAISS index
-        index = faiss.read_index(str(faiss_path))
+        clip_model.eval()
+        return clip_model, preprocess
+    
+    def species_text_embeddings(self):
+        """
+        (class names, (C, D) L2-normalised text embeddings) for the species
+        gate: the mean of each class's prompt embeddings. Cached on disk next
+        to the CLIP snapshot, keyed by model + prompts, so the text tower only
+        runs once (for the onnx backend a temporary torch model is used).
+        """
+        if self.species_text is not None:
+            return self.species_text
         
-        # Load id_map
-        with open(idmap_path, 'r', encoding='utf-8') as f:
-            id_map = json.load(f)
+        prompts = self.config.SPECIES_GATE_PROMPTS
+        key = json.dumps([self.config.CLIP_MODEL, self.config.CLIP_PRETRAIN, prompts], sort_keys=True)
+        path = self.config.CLIP_SNAPSHOT_DIR / f"species_prompts_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.npz"
         
-        self.faiss_indices[animal_type] = (index, id_map)
-        print(f"[ModelManager] Loaded {animal_type} database: {index.ntotal} vectors", file=sys.stderr)
+        if path.exists():
+            with np.load(path) as data:
+                self.species_text = (data["names"].tolist(), data["embeddings"])
+            return self.species_text
         
-        return index, id_map
-
-
-# ============================================================================
-# DETECTION PIPELINE
-# ============================================================================
-
-class BreedDetector:
-    """Main detection pipeline."""
-    
-    def __init__(self):
-        self.models = ModelManager()
-        self.config = Config()
-    
-    def detect_animal(self, image_path: str):
-        """Detect dog/cat using YOLO. Returns (bbox, confidence, class) or (None, None, None)."""
-        results = self.models.yolo.predict(
-            source=image_path,
-            conf=self.config.YOLO_CONF,
-            iou=self.config.YOLO_IOU,
-            classes=self.config.YOLO_CLASSES,
-            verbose=False
-        )
-        
-        r = results[0]
-        if r.boxes is None or r.boxes.shape[0] == 0:
-            return None, None, None
-        
-        # Get highest confidence detection
-        confs = r.boxes.conf.cpu().numpy()
-        classes = r.boxes.cls.cpu().numpy()
-        i_best = int(np.argmax(confs))
-        
-        bbox = r.boxes.xyxy.cpu().numpy().astype(int)[i_best]
-        conf = float(confs[i_best])
-        animal_class = int(classes[i_best])
-        
-        return bbox.tolist(), conf, animal_class
-    
-    def crop_image(self, image_path: str, bbox: list, pad: int = 2):
-        """Crop image with padding around bounding box."""
-        img = Image.open(image_path).convert('RGB')
+        if self.config.BACKEND == "onnx":
+            text_model, device = self._create_clip("cpu")[0], "cpu"
+        else:
+            text_model, device = self.clip_model, self.config.device
+        tokenizer = open_clip.get_tokenizer(self.config.CLIP_MODEL)
         
-        if bbox is None:
-            return img
+        names, embeddings = list(prompts), []
+        with torch.no_grad():
+            for name in names:
+                features = text_model.encode_text(tokenizer(prompts[name]).to(device)).float()
+                mean = torch.nn.functional.normalize(features, dim=-1).mean(dim=0)
+                embeddings.append(torch.nn.functional.normalize(mean, dim=-1).cpu().numpy())
+        self.species_text = (names, np.stack(embeddings).astype(np.float32))
         
-        x1, y1, x2, y2 = bbox
-        x1 = max(0, x1 - pad)
-        y1 = max(0, y1 - pad)
-        x2 = min(img.width, x2 + pad)
-        y2 = min(img.height, y2 + pad)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'wb') as f:
+                np.savez(f, names=np.array(names), embeddings=self.species_text[1])
+        except OSError as e:
+            print(f"[ModelManager] Could not cache species prompts: {e}", file=sys.stderr)
         
-        if x2 <= x1 or y2 <= y1:
-            return img
+        return self.species_text
+    
+    def _write_clip_snapshot(self, clip_model, snapshot: Path):
+        """Save the just-resolved weights (fp32, CPU) and their config; failures only cost the speedup."""
+        cfg = open_clip.get_pretrained_cfg(self.config.CLIP_MODEL, self.config.CLIP_PRETRAIN)
+        meta = {
+            "clip_model": self.config.CLIP_MODEL,
+            "pretrained": self.config.CLIP_PRETRAIN,
+            "quick_gelu": bool(cfg.get("quick_gelu", False)),
+            "mean": list(cfg.get("mean") or clip_model.visual.image_mean),
+            "std": list(cfg.get("std") or clip_model.visual.image_std),
+            "interpolation": cfg.get("interpolation", "bicubic"),
+            "resize_mode": cfg.get("resize_mode", "shortest")
+        }
         
-        return img.crop((x1, y1, x2, y2))
+        try:
+            snapshot.parent.mkdir(parents=True, exist_ok=True)
+            tmp = snapshot.with_suffix(".pt.tmp")
+            torch.save({k: v.cpu() for k, v in clip_model.state_dict().items()}, tmp)
+            tmp.replace(snapshot)
+            with open(snapshot.with_suffix(".json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+            print(f"[ModelManager] Wrote OpenCLIP snapshot {snapshot}", file=sys.stderr)
+        except OSError as e:
+            print(f"[ModelManager] Could not write OpenCLIP snapshot: {e}", file=sys.stderr)
     
-    def embed_image(self, image: Image.Image):
-        """Embed image using OpenCLIP."""
-        with torch.no_grad():
-            img_tensor = self.models.preprocess(image).unsqueeze(0).to(self.config.device)
-            
-            # Convert to FP16 if enabled
-            if self.config.use_fp16:
-                img_tensor = img_tensor.half()
-            
-            features = self.models.clip_model.encode_image(img_tensor)
-            features = torch.nn.functional.normalize(features, dim=-1)
+    def database(self, animal_type: str) -> SpeciesDatabase:
+        """Current index, labels and prototypes for animal type (dog/cat), loaded on first use."""
+        database = self.databases.get(animal_type)
+        if database is not None:
+            return database
         
-        return features.cpu().float().numpy()  # Back to FP32 for FAISS
+        # Concurrent first requests for the same species must not load it twice
+        with self._index_lock:
+            if animal_type not in self.databases:
+                with startup_stage(f"load {animal_type} index"):
+                    self.databases[animal_type] = self._read_database(animal_type)
+        
+        return self.databases[animal_type]
     
-    def search_faiss(self, vector: np.ndarray, animal_type: str, top_k: int = 10):
-        """Search in FAISS index."""
-        index, id_map = self.models.load_faiss_index(animal_type)
-        similarities, indices = index.search(vector, top_k)
-        return similarities[0].tolist(), indices[0].tolist(), id_map
+    def load_faiss_index(self, animal_type: str):
+        """Load FAISS index and breed labels for animal type (dog/cat)."""
+        database = self.database(animal_type)
+        return database.index, database.labels
     
-    def vote_breed(self, similarities: list, indices: list, id_map: list):
-        """Weighted voting to determine best breed."""
-        breed_scores = {}
-        
-        for sim, idx in zip(similarities, indices):
-            # Get breed from id_map
-            if isinstance(id_map, list):
-                breed = id_map[idx].get('breed', 'UNKNOWN')
-            else:  # dict
-                breed = id_map.get(str(idx), {}).get('breed', 'UNKNOWN')
-            
-            # Accumulate similarity scores (use max score for each breed)
-            if breed not in breed_scores:
-                breed_scores[breed] = float(sim)
-            else:
-                breed_scores[breed] = max(breed_scores[breed], float(sim))
+    def index_version(self, animal_type: str) -> str:
+        """Short stamp of the loaded index + id_map files for animal type."""
+        return self.database(animal_type).version
+    
+    def _database_paths(self, animal_type: str):
+        """(index, id_map, prototypes or None) files a species is read from."""
+        data_path = self.config.DATA_DIR / animal_type
+        if self.config.SEARCH_BACKEND == "numpy":
+            index_path = data_path / self.config.NUMPY_INDEX_FILE
+        else:
+            index_path = data_path / self.config.FAISS_INDEX_FILES[self.config.FAISS_INDEX_VARIANT]
+            if not index_path.exists():
+                index_path = data_path / self.config.FAISS_INDEX_FILES["flat"]
+        prototypes_path = data_path / self.config.PROTOTYPE_FILE if self.config.PROTOTYPE_MARGIN is not None else None
+        return index_path, data_path / "id_map.json", prototypes_path
+    
+    @staticmethod
+    def files_stamp(paths) -> str:
+        """Name, mtime and size of each file ("-" for a missing one)."""
+        parts = []
+        for path in paths:
+            try:
+                stat = path.stat()
+                parts.append(f"{path.name}:{stat.st_mtime_ns}:{stat.st_size}")
+            except OSError:
+                parts.append(f"{path.name}:-")
+        return ":".join(parts)
+    
+    def _read_database(self, animal_type: str) -> SpeciesDatabase:
+        """Read one species' index, labels and prototypes from disk."""
+        index_path, idmap_path, prototypes_path = self._database_paths(animal_type)
+        # Taken before reading, so files replaced mid-read still count as changed on the next check
+        stamp = self.files_stamp(p for p in (index_path, idmap_path, prototypes_path) if p is not None)
         
-        if not breed_scores:
-            return "UNKNOWN", 0.0
+        numpy_backend = self.config.SEARCH_BACKEND == "numpy"
+        variant = self.config.FAISS_INDEX_VARIANT
+        if not numpy_backend and index_path.name != self.config.FAISS_INDEX_FILES[variant]:
+            print(f"[ModelManager] {variant} index not found for {animal_type}, using flat", file=sys.stderr)
+        if not index_path.exists():
+            if numpy_backend:
+                raise FileNotFoundError(f"NumPy index not found: {index_path} (run breed_index_tools.py export-npy)")
+            raise FileNotFoundError(f"FAISS index not found: {index_path}")
+        if not idmap_path.exists():
+            raise FileNotFoundError(f"ID map not found: {idmap_path}")
         
-        # Get best breed
-        best_breed = max(breed_scores.items(), key=lambda x: x[1])
+        mem_before = process_memory_mb()
         
-        return best_breed[0], best_breed[1]
-    
-    def get_top_breeds(self, similarities: list, indices: list, id_map: list, top_k: int = 5):
-        """Get top K breed candidates with aggregated scores."""
-        breed_scores = {}
+        # Load the index (faiss is only imported for the faiss backend)
+        if numpy_backend:
+            index = NumpyFlatIndex.load(index_path, self.config.FAISS_MMAP, self.config.NUMPY_BLOCK_SIZE)
+        else:
+            index = read_index(index_path, mmap=self.config.FAISS_MMAP)
+            tune_index(index, self.config.FAISS_NPROBE, self.config.FAISS_EF_SEARCH)
         
-        # Aggregate scores - use MAX score for each unique breed
-        for sim, idx in zip(similarities, indices):
-            if isinstance(id_map, list):
-                breed = id_map[idx].get('breed', 'UNKNOWN')
-            else:
-                breed = id_map.get(str(idx), {}).get('breed', 'UNKNOWN')
+        # Load breed labels (compact view of id_map)
+        labels = LabelStore.load(idmap_path)
+        
+        # Breed prototypes for the first-stage vote (only when enabled). They are stamped
+        # with the flat index, so a .npy-only deployment goes without them.
+        stamped = [index_path, idmap_path]
+        prototypes = None
+        flat_path = index_path.parent / self.config.FAISS_INDEX_FILES["flat"]
+        if prototypes_path is not None and flat_path.exists():
+            prototypes = BreedPrototypes.load(prototypes_path, labels, BreedPrototypes.source_stamp(flat_path, idmap_path))
+            if prototypes is not None:
+                stamped.append(prototypes_path)
+        
+        version = hashlib.sha1(self.files_stamp(stamped).encode('utf-8')).hexdigest()[:12]
+        
+        mem_after = process_memory_mb()
+        private_mb = mem_after.get("private", 0) - mem_before.get("private", 0)
+        print(f"[ModelManager] Loaded {animal_type} database ({index_path.name}, {version}): {index.ntotal} vectors, "
+              f"{len(labels.breeds)} breeds, +{private_mb:.1f} MB private RSS", file=sys.stderr)
+        
+        return SpeciesDatabase(index, labels, prototypes, version, stamp)
+    
+    def reload_database(self, animal_type: str) -> SpeciesDatabase:
+        """
+        Read a species' files again and swap the result in. Searches already
+        holding the previous SpeciesDatabase finish on it. Raises (keeping the
+        current version) if the new files can't be read or don't line up.
+        """
+        with self._reload_lock:
+            database = self._read_database(animal_type)
+            if database.index.ntotal != len(database.labels):
+                raise ValueError(f"index has {database.index.ntotal} vectors but id_map has "
+                                 f"{len(database.labels)} entries")
+            previous = self.databases.get(animal_type)
+            self.databases[animal_type] = database
+        
+        if previous is not None:
+            print(f"[ModelManager] Reloaded {animal_type} database: {previous.version} -> {database.version}",
+                  file=sys.stderr)
+        return database
+    
+    def check_for_updates(self, settle: bool = True) -> dict:
+        """
+        Reload every loaded species whose files changed; returns {type: new version}.
+        With settle, a change is only loaded once the files look the same on two
+        checks in a row, so a rebuild still swapping its files in isn't picked up
+        half-way. Files that failed to load are not retried until they change again.
+        """
+        reloaded = {}
+        with self._reload_lock:
+            for animal_type, database in list(self.databases.items()):
+                stamp = self.files_stamp(p for p in self._database_paths(animal_type) if p is not None)
+                pending = self._pending_stamps.get(animal_type)
+                if stamp == database.stamp or (settle and pending == ("failed", stamp)):
+                    continue
+                if settle and pending != stamp:
+                    self._pending_stamps[animal_type] = stamp
+                    continue
+                
+                try:
+                    reloaded[animal_type] = self.reload_database(animal_type).version
+                    self._pending_stamps.pop(animal_type, None)
+                except Exception as e:
+                    self._pending_stamps[animal_type] = ("failed", stamp)
+                    print(f"[ModelManager] Keeping {animal_type} database {database.version}, reload failed: {e}",
+                          file=sys.stderr)
+        return reloaded
+    
+    def start_index_watcher(self, interval: float):
+        """Run check_for_updates every interval seconds on a daemon thread (once per process)."""
+        if self._watcher is not None or interval <= 0:
+            return
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_for_updates()
+                except Exception as e:
+                    print(f"[ModelManager] Index watcher error: {e}", file=sys.stderr)
+        
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+        print(f"[ModelManager] Watching index files every {interval:g}s", file=sys.stderr)
+    
+    def preload_indexes(self, animal_types=("dog", "cat")):
+        """Load every species up front so no request pays the first-read cost."""
+        for animal_type in animal_types:
+            try:
+                self.load_faiss_index(animal_type)
+            except FileNotFoundError as e:
+                print(f"[ModelManager] Skipping preload of {animal_type}: {e}", file=sys.stderr)
+
+
+# ============================================================================
+# RESULT CACHE (content-addressed: image bytes + model/index version)
+# ============================================================================
+
+class ResultCache:
+    """
+    Bounded in-memory LRU of detection entries, optionally backed by SQLite.
+    
+    An entry holds the YOLO boxes, their CLIP embeddings (one row per pet),
+    the index version per species they were searched against and the final
+    result. BreedDetector serves the result when the index versions still
+    match and re-runs only the FAISS search when they don't.
+    """
+    
+    def __init__(self, max_items: int = 1024, db_path: str = None):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "partial_hits": 0, "misses": 0}
+        self.metrics = None  # MetricsRegistry mirror of the counters, set by BreedDetector
+        
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, entry TEXT, embedding BLOB)")
+            self._db.commit()
+    
+    def get(self, key: str):
+        """Entry for key (memory first, then disk), or None."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                return entry
             
-            if breed not in breed_scores:
-                breed_scores[breed] = float(sim)
-            else:
-                breed_scores[breed] = max(breed_scores[breed], float(sim))
+            if self._db is None:
+                return None
+            
+            row = self._db.execute("SELECT entry, embedding FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            
+            entry = json.loads(row[0])
+            if row[1] is not None:
+                entry["embedding"] = np.frombuffer(row[1], dtype=np.float32).reshape(len(entry["pets"]), -1)
+            self._remember(key, entry)
+            return entry
+    
+    def put(self, key: str, entry: dict):
+        with self._lock:
+            self._remember(key, entry)
+            
+            if self._db is not None:
+                embedding = entry.get("embedding")
+                blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+                stored = {k: v for k, v in entry.items() if k != "embedding"}
+                self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                                 (key, json.dumps(stored, ensure_ascii=False), blob))
+                self._db.commit()
+    
+    def _remember(self, key: str, entry: dict):
+        self._items[key] = entry
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+    
+    def count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+        if self.metrics is not None:
+            self.metrics.inc("breed_cache_lookups_total", {"outcome": counter})
+    
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self.counters.values())
+            served = self.counters["hits"] + self.counters["partial_hits"]
+            return {
+                **self.counters,
+                "hit_rate": round(served / lookups, 4) if lookups else 0.0,
+                "size": len(self._items),
+                "max_items": self.max_items,
+                "disk": self._db is not None
+            }
+
+
+# ============================================================================
+# METRICS + PROFILING
+# ============================================================================
+
+class MetricsRegistry:
+    """
+    Counters and latency histograms, exportable as JSON or Prometheus text.
+    
+    Series are keyed by name plus labels. Histograms use fixed millisecond
+    buckets so exports from several worker processes can be summed.
+    """
+    
+    LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    
+    HELP = {
+        "breed_requests_total": "Images processed, by outcome (detected / no_pet / error)",
+        "breed_errors_total": "Failed images, by exception type",
+        "breed_cache_lookups_total": "Result cache lookups, by outcome",
+        "breed_search_total": "Pets answered by the breed prototypes vs the full neighbour search",
+        "breed_species_gate_total": "Images the CLIP species gate answered without YOLO (fired) or passed on",
+        "breed_scheduler_batches_total": "Pipeline batches run by the micro-batching scheduler",
+        "breed_scheduler_items_total": "Images run by the micro-batching scheduler (divide by batches for mean size)",
+        "breed_scheduler_rejected_total": "Requests turned away because the scheduler queue was full",
+        "breed_request_duration_ms": "Time to answer one image (wall time of its batch)",
+        "breed_stage_duration_ms": "Pipeline stage wall time per batch"
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> {"buckets": cumulative counts, "count", "sum"}
+    
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((labels or {}).items()))
+    
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name: str, value_ms: float, labels: dict = None):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": [0] * len(self.LATENCY_BUCKETS_MS), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.LATENCY_BUCKETS_MS):
+                if value_ms <= bound:
+                    hist["buckets"][i] += 1
+            hist["count"] += 1
+            hist["sum"] += value_ms
+    
+    def merge(self, snapshot: dict):
+        """Add another registry's to_json() snapshot into this one (e.g. from a pool worker)."""
+        for counter in snapshot["counters"]:
+            self.inc(counter["name"], counter["labels"], counter["value"])
         
-        # Sort by score descending
-        sorted_breeds = sorted(breed_scores.items(), key=lambda x: x[1], reverse=True)
+        for entry in snapshot["histograms"]:
+            key = self._key(entry["name"], entry["labels"])
+            with self._lock:
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = {"buckets": [0] * len(self.LATENCY_BUCKETS_MS), "count": 0, "sum": 0.0}
+                for i, bound in enumerate(self.LATENCY_BUCKETS_MS):
+                    hist["buckets"][i] += entry["buckets_ms"][str(bound)]
+                hist["count"] += entry["count"]
+                hist["sum"] += entry["sum_ms"]
+    
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels),
+                                "buckets_ms": dict(zip(map(str, self.LATENCY_BUCKETS_MS), hist["buckets"])),
+                                "count": hist["count"], "sum_ms": round(hist["sum"], 3)}
+                               for (name, labels), hist in sorted(self.histograms.items())]
+            }
+    
+    def to_prometheus(self) -> str:
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+        
+        lines, described = [], set()
         
-        # Return top K
-        top_breeds = []
-        for rank, (breed, score) in enumerate(sorted_breeds[:top_k], start=1):
-            top_breeds.append({
-                "breed": clean_breed_name(breed),
-                "breed_raw": breed,
-                "score": round(score, 3),
-                "rank": rank
-            })
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
         
-        return top_breeds
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name, "counter")
+                lines.append(f"{name}{fmt(labels)} {value}")
+            
+            for (name, labels), hist in sorted(self.histograms.items()):
+                describe(name, "histogram")
+                for bound, count in zip(self.LATENCY_BUCKETS_MS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist['sum']:.3f}")
+                lines.append(f"{name}_count{fmt(labels)} {hist['count']}")
+        
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """Wall time per pipeline stage for one detect_breed_batch call (ms, accumulated per stage)."""
     
-    def detect_breed(self, image_path: str, animal_type: str = "dog"):
-        """Main detection pipeline."""
+    def __init__(self):
+        self.stages = OrderedDict()
+    
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+    
+    def as_dict(self) -> dict:
+        return {name: round(ms, 1) for name, ms in self.stages.items()}
+
+
+@contextmanager
+def profile_request(profiler: str, out_dir: Path, label: str = "request"):
+    """
+    Profile the wrapped block and write one trace file to out_dir.
+    Yields the trace path: cProfile -> .prof, torch.profiler -> Chrome trace .json.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{label}"
+    
+    if profiler == "torch":
+        path = out_dir / f"{stamp}.json"
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+            yield path
+        prof.export_chrome_trace(str(path))
+    else:
+        path = out_dir / f"{stamp}.prof"
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield path
+        finally:
+            prof.disable()
+            prof.dump_stats(str(path))
+    
+    print(f"[Profile] Wrote {path}", file=sys.stderr)
+
+
+def write_metrics(metrics: MetricsRegistry, path: str):
+    """Dump the registry to path: Prometheus text for .prom, JSON otherwise."""
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(".prom"):
+            f.write(metrics.to_prometheus())
+        else:
+            json.dump(metrics.to_json(), f, indent=2)
+    print(f"[Metrics] Wrote {path}", file=sys.stderr)
+
+
+# ============================================================================
+# DETECTION PIPELINE
+# ============================================================================
+
+class BreedDetector:
+    """Main detection pipeline."""
+    
+    NO_PET_ERROR = "No pet detected in image. Please upload a clearer photo with the pet visible."
+    CACHE_FORMAT = 2  # Bump when the cache entry layout changes (2 = list of pets per image)
+    
+    def __init__(self):
+        self.models = ModelManager()
+        self.config = Config()
+        self.cache = ResultCache(self.config.RESULT_CACHE_SIZE, self.config.RESULT_CACHE_DB) \
+            if self.config.RESULT_CACHE_SIZE > 0 else None
+        self.metrics = MetricsRegistry() if self.config.METRICS_ENABLED else None
+        if self.cache is not None:
+            self.cache.metrics = self.metrics
+        
+        # Anything that changes box or embedding for the same bytes invalidates the cache
+        model_id = (f"{self.config.CLIP_MODEL}:{self.config.CLIP_PRETRAIN}:{Path(self.config.YOLO_WEIGHTS).name}:"
+                    f"{self.config.YOLO_CONF}:{self.config.YOLO_IOU}:{self.config.BACKEND}:{self.models.clip_precision}:"
+                    f"{self.config.MAX_PETS}:{self.config.PROTOTYPE_MARGIN}:{self.config.SPECIES_GATE}:"
+                    f"{self.models.batch_preprocess is not None}:"
+                    f"v{self.CACHE_FORMAT}")
+        self.model_version = hashlib.sha1(model_id.encode('utf-8')).hexdigest()[:12]
+    
+    def read_input(self, image, multi_pet: bool = False):
+        """
+        Return (source, cache_key) for an image path, encoded image bytes or
+        PIL image. Paths are read once here so the cache key and the decode
+        share the same bytes. PIL images are keyed by info["sha256"] when the
+        caller provides it.
+        """
+        if self.cache is None:
+            return (io.BytesIO(image) if isinstance(image, bytes) else image), None
+        
+        prefix = f"{self.model_version}:multi:" if multi_pet else f"{self.model_version}:"
+        if isinstance(image, Image.Image):
+            digest = image.info.get("sha256")
+            return image, f"{prefix}{digest}" if digest else None
+        
+        data = image if isinstance(image, bytes) else Path(image).read_bytes()
+        return io.BytesIO(data), f"{prefix}{hashlib.sha256(data).hexdigest()}"
+    
+    def load_image(self, image, max_side: int = None):
+        """Decode an image path / file object (or pass through a PIL image) as RGB."""
+        if isinstance(image, Image.Image):
+            return image if image.mode == 'RGB' else image.convert('RGB')
+        return decode_image(image, max_side)
+    
+    def to_original_coords(self, image: Image.Image, bbox: list):
+        """Map a box found on a reduced-resolution decode back to full-resolution pixels."""
+        orig_w, orig_h = image.info.get("original_size", image.size)
+        scale_x, scale_y = orig_w / image.width, orig_h / image.height
+        
+        x1, y1, x2, y2 = bbox
+        return [
+            int(round(x1 * scale_x)),
+            int(round(y1 * scale_y)),
+            min(orig_w, int(round(x2 * scale_x))),
+            min(orig_h, int(round(y2 * scale_y)))
+        ]
+    
+    def detect_all_animals(self, images: list, max_pets: int = 1):
+        """
+        Detect dogs/cats in a batch of images with one YOLO call. Returns, per
+        image, a list of up to max_pets (bbox, confidence, class), best first.
+        """
+        if self.config.BACKEND == "onnx":
+            raw = self.models.yolo.predict(images, self.config.YOLO_CONF, self.config.YOLO_IOU,
+                                           self.config.YOLO_CLASSES)
+        else:
+            results = self.models.yolo.predict(
+                source=images,
+                conf=self.config.YOLO_CONF,
+                iou=self.config.YOLO_IOU,
+                classes=self.config.YOLO_CLASSES,
+                verbose=False
+            )
+            raw = [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy())
+                   if r.boxes is not None else (np.empty((0, 4)), np.empty(0), np.empty(0))
+                   for r in results]
+        
+        detections = []
+        for xyxy, confs, classes in raw:
+            # Highest confidence first (stable, so ties keep YOLO's order)
+            order = np.argsort(-confs, kind='stable')[:max_pets]
+            boxes = xyxy.astype(int)
+            detections.append([(boxes[i].tolist(), float(confs[i]), int(classes[i])) for i in order])
+        
+        return detections
+    
+    def detect_animals(self, images: list):
+        """Detect dog/cat in a batch of images with one YOLO call. Returns one (bbox, confidence, class) per image."""
+        return [pets[0] if pets else (None, None, None) for pets in self.detect_all_animals(images)]
+    
+    def species_gate(self, images: list, animal_type: str):
+        """
+        Zero-shot species check on whole images (one CLIP pass). Returns, per
+        image, (species, probability, embedding) when the photo is a confident
+        close-up of animal_type, else None. The embedding doubles as the
+        breed query since the crop would be the full frame.
+        """
+        names, text = self.models.species_text_embeddings()
+        vectors = self.embed_images(images)
+        
+        # CLIP's trained logit scale is ~100
+        logits = 100.0 * vectors @ text.T
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        
+        gated = []
+        for vector, row in zip(vectors, probs):
+            best = int(np.argmax(row))
+            confident = names[best] == animal_type and row[best] >= self.config.SPECIES_GATE
+            gated.append((animal_type, float(row[best]), vector) if confident else None)
+        return gated
+    
+    def detect_animal(self, image):
+        """Detect dog/cat using YOLO. Returns (bbox, confidence, class) or (None, None, None)."""
+        return self.detect_animals([self.load_image(image)])[0]
+    
+    def crop_image(self, image, bbox: list, pad: int = 2):
+        """Crop image with padding around bounding box."""
+        img = self.load_image(image)
+        
+        if bbox is None:
+            return img
+        
+        x1, y1, x2, y2 = bbox
+        x1 = max(0, x1 - pad)
+        y1 = max(0, y1 - pad)
+        x2 = min(img.width, x2 + pad)
+        y2 = min(img.height, y2 + pad)
+        
+        if x2 <= x1 or y2 <= y1:
+            return img
+        
+        return img.crop((x1, y1, x2, y2))
+    
+    def preprocess_images(self, images: list):
+        """CLIP input batch for a list of crops (a NumPy array for onnx, a device tensor for torch)."""
+        if self.models.batch_preprocess is not None:
+            batch = self.models.batch_preprocess(images)
+            if self.config.BACKEND == "onnx":
+                return batch
+            img_tensor = torch.from_numpy(batch).to(self.config.device)
+        elif self.config.BACKEND == "onnx":
+            return np.stack([self.models.preprocess(img) for img in images])
+        else:
+            img_tensor = torch.stack([self.models.preprocess(img) for img in images]).to(self.config.device)
+        
+        # Match the CLIP weights' precision
+        if self.config.use_fp16:
+            img_tensor = img_tensor.half()
+        elif self.models.clip_precision == "bf16":
+            img_tensor = img_tensor.bfloat16()
+        
+        return img_tensor
+    
+    def encode_batch(self, batch):
+        """One OpenCLIP forward pass over a preprocessed batch. Returns L2-normalised (N, D) float32."""
+        if self.config.BACKEND == "onnx":
+            features = self.models.clip_model.encode_image(batch)
+            return features / np.linalg.norm(features, axis=-1, keepdims=True)
+        
+        with torch.inference_mode():
+            features = self.models.clip_model.encode_image(batch)
+            features = torch.nn.functional.normalize(features.float(), dim=-1)
+        
+        return features.cpu().float().numpy()  # Back to FP32 for FAISS
+    
+    def embed_images(self, images: list):
+        """Embed a batch of images with one OpenCLIP forward pass. Returns an (N, D) float32 array."""
+        return self.encode_batch(self.preprocess_images(images))
+    
+    def embed_image(self, image: Image.Image):
+        """Embed image using OpenCLIP."""
+        return self.embed_images([image])
+    
+    def warmup(self, batch_sizes=(1,)):
+        """
+        Push blank batches through YOLO and CLIP so allocator growth, kernel
+        selection and graph optimisation (TorchScript re-optimises on the
+        second call, torch.compile compiles per shape) happen before the
+        first real request.
+        """
+        start = time.time()
+        for size in sorted(set(batch_sizes)):
+            images = [Image.new("RGB", (640, 480), (127, 127, 127)) for _ in range(size)]
+            for _ in range(2):
+                self.detect_animals(images)
+                self.embed_images(images)
+        print(f"[BreedDetector] Warm-up (batches {sorted(set(batch_sizes))}) in {time.time() - start:.2f}s",
+              file=sys.stderr)
+    
+    def search_faiss_batch(self, vectors: np.ndarray, animal_type: str, top_k: int = 10,
+                           database: SpeciesDatabase = None):
+        """Search an (N, D) matrix of query vectors in one FAISS call. Returns (N, K) arrays."""
+        database = database or self.models.database(animal_type)
+        similarities, indices = database.index.search(np.ascontiguousarray(vectors, dtype=np.float32), top_k)
+        return similarities, indices, database.labels
+    
+    def search_faiss(self, vector: np.ndarray, animal_type: str, top_k: int = 10):
+        """Search in FAISS index."""
+        similarities, indices, labels = self.search_faiss_batch(vector, animal_type, top_k)
+        return similarities[0].tolist(), indices[0].tolist(), labels
+    
+    def vote_breed(self, similarities: list, indices: list, labels: LabelStore):
+        """Weighted voting to determine best breed."""
+        scores = labels.breed_scores(similarities, indices)[0]
+        best = int(np.argmax(scores))
+        
+        if not np.isfinite(scores[best]):
+            return "UNKNOWN", 0.0
+        
+        return labels.breeds_raw[best], float(scores[best])
+    
+    def prototype_vote(self, vectors: np.ndarray, animal_type: str, top_k: int = 5,
+                       database: SpeciesDatabase = None):
+        """
+        First-stage vote against the breed prototypes. Returns top K breed
+        candidates per row, or None for rows whose top-1/top-2 margin is below
+        PROTOTYPE_MARGIN (and for every row when prototypes are unavailable).
+        """
+        database = database or self.models.database(animal_type)
+        if self.config.PROTOTYPE_MARGIN is None or database.prototypes is None:
+            return [None] * len(vectors)
+        
+        scores = database.prototypes.breed_scores(vectors)
+        confident = BreedPrototypes.margins(scores) >= self.config.PROTOTYPE_MARGIN
+        return [top_breeds if ok else None
+                for top_breeds, ok in zip(self.top_breeds_from_scores(scores, database.labels, top_k), confident)]
+    
+    def get_top_breeds_batch(self, similarities: np.ndarray, indices: np.ndarray, labels: LabelStore, top_k: int = 5):
+        """Top K breed candidates for each row of (Q, K) search results."""
+        return self.top_breeds_from_scores(labels.breed_scores(similarities, indices), labels, top_k)
+    
+    def top_breeds_from_scores(self, scores: np.ndarray, labels: LabelStore, top_k: int = 5):
+        """Top K breed candidates for each row of (Q, B) per-breed scores."""
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        
+        batch = []
+        for row_scores, row_order in zip(scores, order):
+            top_breeds = []
+            for code in row_order:
+                score = float(row_scores[code])
+                if not np.isfinite(score):
+                    break
+                top_breeds.append({
+                    "breed": labels.breeds[code],
+                    "breed_raw": labels.breeds_raw[code],
+                    "score": round(score, 3),
+                    "rank": len(top_breeds) + 1
+                })
+            batch.append(top_breeds)
+        
+        return batch
+    
+    def get_top_breeds(self, similarities: list, indices: list, labels: LabelStore, top_k: int = 5):
+        """Get top K breed candidates with aggregated scores."""
+        return self.get_top_breeds_batch(similarities, indices, labels, top_k)[0]
+    
+    def pet_result(self, top_breeds: list, detected_type: str, det_conf: float, bbox: list):
+        """Breed answer for one detected pet (an entry of "pets" in multi-pet mode)."""
+        # Get best breed (first in top_breeds)
+        if top_breeds:
+            best = top_breeds[0]
+            breed_clean = best["breed"]
+            best_breed_raw = best["breed_raw"]
+            confidence = best["score"]
+        else:
+            breed_clean = "Unknown"
+            best_breed_raw = "Unknown"
+            confidence = 0.0
+        
+        return {
+            "breed": breed_clean,
+            "breed_raw": best_breed_raw,
+            "confidence": round(confidence, 3),
+            "animal_type": detected_type,
+            "top_breeds": top_breeds,
+            "detection_confidence": round(det_conf, 3),
+            "bounding_box": bbox
+        }
+    
+    def build_result(self, top_breeds: list, detected_type: str, det_conf: float, bbox: list, start_time: float,
+                     pets: list = None, index_version: str = None):
+        """
+        Format one successful detection in the response schema (pets: every pet,
+        multi-pet mode; index_version: the database version the breeds came from).
+        """
+        best = self.pet_result(top_breeds, detected_type, det_conf, bbox)
+        
+        # Calculate processing time
+        process_time = int((time.time() - start_time) * 1000)
+        
+        result = {
+            "success": True,
+            "breed": best["breed"],
+            "breed_raw": best["breed_raw"],
+            "confidence": best["confidence"],
+            "animal_type": detected_type,
+            "top_breeds": top_breeds,
+            "metadata": {
+                "animal_detected": True,
+                "detection_confidence": best["detection_confidence"],
+                "bounding_box": bbox,
+                "processing_time_ms": process_time
+            }
+        }
+        
+        if index_version is not None:
+            result["metadata"]["index_version"] = index_version
+        if pets is not None:
+            result["pets"] = pets
+            result["metadata"]["pet_count"] = len(pets)
+        
+        return result
+    
+    def cached_result(self, entry: dict, start_time: float):
+        """Copy of a cached result with this request's timing."""
+        result = copy.deepcopy(entry["result"])
+        result["metadata"]["processing_time_ms"] = int((time.time() - start_time) * 1000)
+        result["metadata"]["cache_hit"] = True
+        return result
+    
+    def error_result(self, message: str):
+        """Format a failed detection in the response schema."""
+        return {
+            "success": False,
+            "error": message,
+            "animal_detected": False
+        }
+    
+    def detect_breed_batch(self, images: list, animal_type: str = "dog", profile: bool = None,
+                           multi_pet: bool = None):
+        """
+        Batched detection pipeline: one YOLO call, one CLIP forward pass and
+        one FAISS search per species for all images. Returns one result per
+        input, in order, in the same schema as detect_breed.
+        
+        multi_pet (default Config.MULTI_PET) answers every dog/cat box, not
+        just the best one: the best pet still fills the top-level fields and
+        all of them are listed under "pets".
+        profile (default Config.PROFILE_REQUESTS) wraps the call in the
+        configured profiler; the trace path is added to each result.
+        """
+        if multi_pet is None:
+            multi_pet = self.config.MULTI_PET
+        if profile is None:
+            profile = self.config.PROFILE_REQUESTS
+        if not profile:
+            return self._run_batch(images, animal_type, multi_pet)
+        
+        with profile_request(self.config.PROFILER, self.config.PROFILE_DIR, f"batch{len(images)}") as trace:
+            results = self._run_batch(images, animal_type, multi_pet)
+        for result in results:
+            result.setdefault("metadata", {})["profile_trace"] = str(trace)
+        return results
+    
+    def _run_batch(self, images: list, animal_type: str, multi_pet: bool):
         start_time = time.time()
+        timer = StageTimer()
+        results = [None] * len(images)
+        error_types = []
+        pets = []        # (slot, bbox, det_conf, detected_type, vector), best pet of each slot first
+        to_detect = []   # (slot, image, cache_key)
+        slot_keys = {}   # slot -> cache key, for slots whose result is (re)computed below
+        
+        # Step 0: Cache lookup, then decode the rest (a bad file only fails its own slot)
+        for i, image in enumerate(images):
+            try:
+                with timer.stage("read"):
+                    source, key = self.read_input(image, multi_pet)
+                    entry = self.cache.get(key) if key else None
+                
+                if entry is None:
+                    if key:
+                        self.cache.count("misses")
+                    with timer.stage("decode"):
+                        to_detect.append((i, self.load_image(source, self.config.DECODE_MAX_SIDE), key))
+                    continue
+                
+                if not entry["pets"]:
+                    self.cache.count("hits")
+                    results[i] = self.error_result(self.NO_PET_ERROR)
+                elif all(entry["index_version"].get(pet["animal_type"]) == self.models.index_version(pet["animal_type"])
+                         for pet in entry["pets"]):
+                    self.cache.count("hits")
+                    results[i] = self.cached_result(entry, start_time)
+                else:
+                    # Index was rebuilt since: keep boxes + embeddings, redo the search
+                    self.cache.count("partial_hits")
+                    slot_keys[i] = key
+                    for pet, vector in zip(entry["pets"], entry["embedding"]):
+                        pets.append((i, pet["bbox"], pet["det_conf"], pet["animal_type"], vector))
+            except Exception as e:
+                results[i] = self.error_result(f"Processing error: {str(e)}")
+                error_types.append(type(e).__name__)
         
         try:
-            # Step 1: Detect animal
-            bbox, det_conf, animal_class = self.detect_animal(image_path)
+            # Step 1a: Close-ups of the requested species skip YOLO (full frame = crop)
+            if to_detect and self.config.SPECIES_GATE is not None and not multi_pet:
+                with timer.stage("gate"):
+                    gated = self.species_gate([img for _, img, _ in to_detect], animal_type)
+                
+                remaining = []
+                for (i, img, key), gate in zip(to_detect, gated):
+                    if gate is None:
+                        remaining.append((i, img, key))
+                        continue
+                    detected_type, prob, vector = gate
+                    slot_keys[i] = key
+                    pets.append((i, self.to_original_coords(img, [0, 0, img.width, img.height]), prob,
+                                 detected_type, vector))
+                
+                if self.metrics is not None:
+                    self.metrics.inc("breed_species_gate_total", {"outcome": "fired"}, len(to_detect) - len(remaining))
+                    self.metrics.inc("breed_species_gate_total", {"outcome": "fallback"}, len(remaining))
+                to_detect = remaining
             
-            if bbox is None:
-                return {
-                    "success": False,
-                    "error": "No pet detected in image. Please upload a clearer photo with the pet visible.",
-                    "animal_detected": False
-                }
+            if to_detect:
+                # Step 1: Detect animals
+                max_pets = self.config.MAX_PETS if multi_pet else 1
+                with timer.stage("yolo"):
+                    detections = self.detect_all_animals([img for _, img, _ in to_detect], max_pets)
+                
+                found = []
+                for (i, img, key), boxes in zip(to_detect, detections):
+                    if not boxes:
+                        results[i] = self.error_result(self.NO_PET_ERROR)
+                        if key:
+                            self.cache.put(key, {"pets": []})
+                        continue
+                    
+                    slot_keys[i] = key
+                    for bbox, det_conf, animal_class in boxes:
+                        # Determine animal type from YOLO class
+                        detected_type = "cat" if animal_class == 15 else "dog"
+                        found.append((i, img, bbox, det_conf, detected_type))
+                
+                if found:
+                    # Step 2: Crop images (from the same decoded buffer YOLO saw)
+                    with timer.stage("crop"):
+                        crops = [self.crop_image(img, bbox) for _, img, bbox, _, _ in found]
+                    
+                    # Step 3: Embed every pet of every image in one stacked forward pass
+                    with timer.stage("preprocess"):
+                        batch = self.preprocess_images(crops)
+                    with timer.stage("encode"):
+                        vectors = self.encode_batch(batch)
+                    
+                    for (i, img, bbox, det_conf, detected_type), vector in zip(found, vectors):
+                        pets.append((i, self.to_original_coords(img, bbox), det_conf, detected_type, vector))
             
-            # Determine animal type from YOLO class
-            detected_type = "cat" if animal_class == 15 else "dog"
+            # Step 4: Search FAISS once per species (search more to get better aggregation),
+            # except for pets the breed prototypes already answer with a clear margin.
+            # One database snapshot per species for the whole batch, so a reload mid-batch can't mix versions.
+            pet_breeds = [None] * len(pets)
+            versions = {}
+            for species in ("dog", "cat"):
+                rows = [row for row, pet in enumerate(pets) if pet[3] == species]
+                if not rows:
+                    continue
+                
+                database = self.models.database(species)
+                versions[species] = database.version
+                if self.config.PROTOTYPE_MARGIN is not None:
+                    with timer.stage("prototype"):
+                        first_stage = self.prototype_vote(np.stack([pets[row][4] for row in rows]), species, top_k=5,
+                                                          database=database)
+                    
+                    for row, top_breeds in zip(rows, first_stage):
+                        pet_breeds[row] = top_breeds
+                    rows = [row for row, top_breeds in zip(rows, first_stage) if top_breeds is None]
+                    
+                    if self.metrics is not None:
+                        self.metrics.inc("breed_search_total", {"path": "prototype"}, len(first_stage) - len(rows))
+                        self.metrics.inc("breed_search_total", {"path": "full"}, len(rows))
+                    if not rows:
+                        continue
+                
+                with timer.stage("search"):
+                    vectors = np.stack([pets[row][4] for row in rows])
+                    sims, idxs, labels = self.search_faiss_batch(vectors, species, top_k=50, database=database)
+                
+                # Step 5: Get top K breed candidates (one vectorized vote per species)
+                with timer.stage("vote"):
+                    for row, top_breeds in zip(rows, self.get_top_breeds_batch(sims, idxs, labels, top_k=5)):
+                        pet_breeds[row] = top_breeds
             
-            # Step 2: Crop image
-            crop = self.crop_image(image_path, bbox)
+            # Step 6: One result per image, its best pet first
+            by_slot = OrderedDict()
+            for row, pet in enumerate(pets):
+                by_slot.setdefault(pet[0], []).append(row)
             
-            # Step 3: Embed
-            vector = self.embed_image(crop)
-            
-            # Step 4: Search FAISS (search more to get better aggregation)
-            sims, idxs, id_map = self.search_faiss(vector, detected_type, top_k=50)
+            for i, rows in by_slot.items():
+                _, bbox, det_conf, detected_type, _ = pets[rows[0]]
+                all_pets = None
+                if multi_pet:
+                    all_pets = [self.pet_result(pet_breeds[row], pets[row][3], pets[row][2], pets[row][1])
+                                for row in rows]
+                results[i] = self.build_result(pet_breeds[rows[0]], detected_type, det_conf, bbox, start_time, all_pets,
+                                               versions[detected_type])
+                
+                key = slot_keys.get(i)
+                if key:
+                    self.cache.put(key, {
+                        "pets": [{"bbox": pets[row][1], "det_conf": pets[row][2], "animal_type": pets[row][3]}
+                                 for row in rows],
+                        "embedding": np.stack([pets[row][4] for row in rows]).astype(np.float32),  # Not a view
+                        "index_version": {pets[row][3]: versions[pets[row][3]] for row in rows},
+                        "result": copy.deepcopy(results[i])
+                    })
+        
+        except Exception as e:
+            for i, result in enumerate(results):
+                if result is None:
+                    results[i] = self.error_result(f"Processing error: {str(e)}")
+                    error_types.append(type(e).__name__)
+        
+        # Stage timings are per batch; cached copies above were taken before they were added
+        stage_ms = timer.as_dict()
+        for result in results:
+            if result["success"]:
+                result["metadata"]["stage_ms"] = stage_ms
+        
+        if self.metrics is not None:
+            self.record_metrics(results, timer, error_types, start_time)
+        
+        return results
+    
+    def record_metrics(self, results: list, timer: StageTimer, error_types: list, start_time: float):
+        """Count outcomes / errors and observe latencies for one batch."""
+        elapsed_ms = (time.time() - start_time) * 1000
+        for result in results:
+            if result["success"]:
+                outcome = "detected"
+            elif result.get("error") == self.NO_PET_ERROR:
+                outcome = "no_pet"
+            else:
+                outcome = "error"
+            self.metrics.inc("breed_requests_total", {"outcome": outcome})
+            self.metrics.observe("breed_request_duration_ms", elapsed_ms)
+        
+        for error_type in error_types:
+            self.metrics.inc("breed_errors_total", {"type": error_type})
+        for stage, ms in timer.stages.items():
+            self.metrics.observe("breed_stage_duration_ms", ms, {"stage": stage})
+    
+    def detect_breed(self, image_path, animal_type: str = "dog", profile: bool = None, multi_pet: bool = None):
+        """Main detection pipeline (image path or encoded image bytes)."""
+        return self.detect_breed_batch([image_path], animal_type, profile, multi_pet)[0]
+
+
+# ============================================================================
+# MICRO-BATCHING SCHEDULER (concurrent requests -> one pipeline batch)
+# ============================================================================
+
+class BatchScheduler:
+    """
+    Bounded request queue in front of a BreedDetector.
+    
+    submit() hands the upload to a decode thread pool and queues it; one
+    worker thread takes everything queued (waiting up to max_wait_ms for
+    more, at most max_batch items) and runs it as one detect_breed_batch call
+    per (type, profile, multi_pet) group, so uploads decode while the models
+    run. Each caller gets a Future resolved with its result dict. When the
+    queue is full the Future is resolved at once with an error instead.
+    """
+    
+    QUEUE_FULL_ERROR = "Breed detection is busy, please try again shortly."
+    
+    def __init__(self, detector: BreedDetector, max_batch: int = 16, max_wait_ms: float = 5,
+                 queue_size: int = 64, decode_workers: int = 4):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self.batches = self.items = self.rejected = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._decoder = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode")
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+    
+    def submit(self, image, animal_type: str = "dog", profile: bool = None, multi_pet: bool = None):
+        """Queue one image (path, encoded bytes or PIL image). Returns a Future of its result."""
+        from concurrent.futures import Future
+        
+        future = Future()
+        source = image if isinstance(image, Image.Image) else self._decoder.submit(read_and_decode, image)
+        try:
+            self._queue.put_nowait((source, (animal_type, profile, multi_pet), future))
+        except queue.Full:
+            if not isinstance(source, Image.Image):
+                source.cancel()
+            self.rejected += 1
+            if self.detector.metrics is not None:
+                self.detector.metrics.inc("breed_scheduler_rejected_total")
+            future.set_result(self.detector.error_result(self.QUEUE_FULL_ERROR))
+        return future
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
             
-            # Step 5: Get top K breed candidates
-            top_breeds = self.get_top_breeds(sims, idxs, id_map, top_k=5)
+            # Whatever piled up while the models were busy joins without waiting
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
             
-            # Step 6: Get best breed (first in top_breeds)
-            if top_breeds:
-                best = top_breeds[0]
-                breed_clean = best["breed"]
-                best_breed_raw = best["breed_raw"]
-                confidence = best["score"]
-            else:
-                breed_clean = "Unknown"
-                best_breed_raw = "Unknown"
-                confidence = 0.0
+            self._run_batch(batch)
+    
+    def _run_batch(self, batch: list):
+        groups = OrderedDict()
+        for source, options, future in batch:
+            groups.setdefault(options, []).append((source, future))
+        
+        for (animal_type, profile, multi_pet), items in groups.items():
+            images, futures = [], []
+            for source, future in items:
+                try:
+                    images.append(source if isinstance(source, Image.Image) else source.result())
+                    futures.append(future)
+                except Exception as e:
+                    future.set_result(self.detector.error_result(f"Processing error: {str(e)}"))
+            if not images:
+                continue
             
-            # Calculate processing time
-            process_time = int((time.time() - start_time) * 1000)
+            try:
+                results = self.detector.detect_breed_batch(images, animal_type, profile, multi_pet)
+            except Exception as e:
+                results = [self.detector.error_result(f"Processing error: {str(e)}") for _ in images]
+            for future, result in zip(futures, results):
+                future.set_result(result)
             
+            self.batches += 1
+            self.items += len(images)
+            if self.detector.metrics is not None:
+                self.detector.metrics.inc("breed_scheduler_batches_total")
+                self.detector.metrics.inc("breed_scheduler_items_total", value=len(images))
+    
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "rejected": self.rejected,
+            "queue_depth": self._queue.qsize()
+        }
+    
+    def stop(self):
+        """Finish the batch in flight; requests still queued get an error result."""
+        self._stopped.set()
+        self._worker.join()
+        while True:
+            try:
+                _, _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_result(self.detector.error_result("Server is shutting down"))
+        self._decoder.shutdown(wait=False, cancel_futures=True)
+
+
+# ============================================================================
+# WORKER POOL (pre-forked processes sharing the loaded models)
+# ============================================================================
+
+def pool_worker_main(conn, threads: int, cpus: list):
+    """
+    Body of one forked worker: pin its threads (and CPUs), then answer
+    (op, payload) messages in order until it receives None. The inherited
+    ModelManager singleton means BreedDetector() loads nothing.
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    
+    detector = BreedDetector()
+    if detector.config.SEARCH_BACKEND == "faiss":
+        faiss.omp_set_num_threads(threads)
+    if detector.config.BACKEND == "onnx":
+        # onnxruntime sessions don't survive fork (their thread pools stay in the parent)
+        detector.config.ONNX_INTRA_OP_THREADS = threads
+        detector.config.ONNX_INTER_OP_THREADS = 1
+        detector.models._load_onnx_models()
+    else:
+        torch.set_num_threads(threads)
+    if detector.config.WARMUP:
+        detector.warmup()
+    # The parent's threads don't survive fork, so each worker watches the index files itself
+    detector.models.start_index_watcher(detector.config.INDEX_RELOAD_INTERVAL)
+    
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        
+        op, payload = message
+        if op == "detect":
+            try:
+                reply = detector.detect_breed_batch(*payload)
+            except Exception as e:
+                reply = [detector.error_result(f"Processing error: {str(e)}") for _ in payload[0]]
+        elif op == "metrics":
+            reply = detector.metrics.to_json() if detector.metrics is not None else None
+        elif op == "memory":
+            reply = {**process_memory_mb(), **process_sharing_mb()}
+        elif op == "cache":
+            reply = detector.cache.stats() if detector.cache is not None else None
+        elif op == "ping":
+            reply = True
+        elif op == "reload":
+            reply = detector.models.check_for_updates(settle=False)
+        elif op == "indexes":
+            reply = {t: db.info() for t, db in detector.models.databases.items()}
+        else:
+            reply = None
+        conn.send(reply)
+
+
+class WorkerPool:
+    """
+    K forked copies of the loaded pipeline behind one dispatcher.
+    
+    The parent loads the models and indexes, freezes the GC (so collections
+    don't dirty the shared pages) and forks the workers, which then share
+    the weights and mmap'd indexes copy-on-write. Each worker gets
+    threads_per_worker torch/faiss/onnxruntime threads and, with pin_cpus,
+    its own cores. Requests go to the worker with the fewest outstanding
+    ones; a reader thread per worker resolves their Futures in order.
+    Sends take only that worker's send lock, so a large upload to one
+    worker doesn't hold up dispatch to the others.
+    """
+    
+    def __init__(self, size: int, threads_per_worker: int = 0, pin_cpus: bool = True):
+        from collections import deque
+        
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("Worker pool needs fork (Linux/macOS)")
+        ctx = multiprocessing.get_context("fork")
+        
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        self.threads = threads_per_worker or max(1, len(cpus) // size)
+        pin = pin_cpus and size * self.threads <= len(cpus)
+        
+        gc.freeze()
+        self.workers = []
+        for i in range(size):
+            conn, child_conn = ctx.Pipe()
+            worker_cpus = cpus[i * self.threads:(i + 1) * self.threads] if pin else None
+            process = ctx.Process(target=pool_worker_main, args=(child_conn, self.threads, worker_cpus),
+                                  name=f"breed-worker-{i}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.workers.append({"process": process, "conn": conn, "pending": deque(), "served": 0,
+                                 "cpus": worker_cpus, "alive": True, "send_lock": threading.Lock()})
+        
+        # Reader threads only start once every fork is done
+        self._lock = threading.Lock()
+        for worker in self.workers:
+            threading.Thread(target=self._read, args=(worker,), name=f"pool-reader-{worker['process'].pid}",
+                             daemon=True).start()
+        print(f"[WorkerPool] {size} workers x {self.threads} threads"
+              f"{' (pinned)' if pin else ''}", file=sys.stderr)
+    
+    def _read(self, worker: dict):
+        while True:
+            try:
+                reply = worker["conn"].recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = worker["pending"].popleft()
+                worker["served"] += 1
+            future.set_result(reply)
+        
+        # Worker died (or the pool closed): take it out of rotation and fail its requests
+        with self._lock:
+            worker["alive"] = False
+            pending = list(worker["pending"])
+            worker["pending"].clear()
+        for future in pending:
+            future.set_exception(RuntimeError(f"Pool worker {worker['process'].pid} exited"))
+    
+    def submit(self, op: str, payload=None, worker: dict = None):
+        """Send one message to the given (or least busy) worker. Returns a Future of its reply."""
+        from concurrent.futures import Future
+        
+        future = Future()
+        if worker is None:
+            with self._lock:
+                alive = [w for w in self.workers if w["alive"]]
+                if not alive:
+                    raise RuntimeError("No pool workers left")
+                worker = min(alive, key=lambda w: len(w["pending"]))
+        
+        # Queue the Future and send under the worker's send lock so the reader's
+        # FIFO pops line up with the order messages reached the pipe
+        with worker["send_lock"]:
+            with self._lock:
+                if not worker["alive"]:
+                    raise RuntimeError(f"Pool worker {worker['process'].pid} exited")
+                worker["pending"].append(future)
+            try:
+                worker["conn"].send((op, payload))
+            except Exception as e:
+                # Nothing reached the worker (unpicklable payload or closed pipe), so no reply will come
+                with self._lock:
+                    if future in worker["pending"]:
+                        worker["pending"].remove(future)
+                if not future.done():
+                    future.set_exception(e)
+        return future
+    
+    def detect_batch(self, images: list, animal_type: str = "dog", profile: bool = None,
+                     multi_pet: bool = None) -> list:
+        return self.submit("detect", (images, animal_type, profile, multi_pet)).result()
+    
+    def broadcast(self, op: str) -> list:
+        """Ask every live worker the same question; returns their replies."""
+        futures = [self.submit(op, worker=w) for w in self.workers if w["alive"]]
+        return [future.result() for future in futures]
+    
+    def metrics(self):
+        """One registry summing every worker's metrics (None when metrics are disabled)."""
+        snapshots = [s for s in self.broadcast("metrics") if s is not None]
+        if not snapshots:
+            return None
+        merged = MetricsRegistry()
+        for snapshot in snapshots:
+            merged.merge(snapshot)
+        return merged
+    
+    def cache_stats(self):
+        """Every worker's result cache added up (None when caching is disabled)."""
+        snapshots = [s for s in self.broadcast("cache") if s is not None]
+        if not snapshots:
+            return None
+        counted = ("hits", "partial_hits", "misses", "size", "max_items")
+        merged = {key: sum(s[key] for s in snapshots) for key in counted}
+        lookups = merged["hits"] + merged["partial_hits"] + merged["misses"]
+        merged["hit_rate"] = round((merged["hits"] + merged["partial_hits"]) / lookups, 4) if lookups else 0.0
+        merged["disk"] = any(s["disk"] for s in snapshots)
+        merged["workers"] = len(snapshots)
+        return merged
+    
+    def stats(self) -> dict:
+        with self._lock:
             return {
+                "threads_per_worker": self.threads,
+                "workers": [{"pid": w["process"].pid, "alive": w["alive"], "served": w["served"],
+                             "outstanding": len(w["pending"]), "cpus": w["cpus"]} for w in self.workers]
+            }
+    
+    def close(self, timeout: float = 10):
+        for worker in self.workers:
+            try:
+                with worker["send_lock"]:
+                    worker["conn"].send(None)
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker["process"].join(timeout)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            worker["conn"].close()
+        gc.unfreeze()
+
+
+# ============================================================================
+# SERVER MODE (long-running process, models stay resident)
+# ============================================================================
+
+class DetectionServer:
+    """
+    Keeps one BreedDetector loaded and answers JSON requests.
+    
+    Request:  {"id": 1, "image": "path/to/img.jpg", "type": "dog"}
+    Batch:    {"id": 2, "images": ["a.jpg", "b.jpg"]} -> {"success": true, "results": [...]}
+    In memory: an image may be {"b64": "<base64 bytes>"} or {"shm": "<name>", "size": N}
+              (a shared-memory segment the caller creates and removes) instead of a path.
+    Commands: {"cmd": "ping"} | {"cmd": "stats"} | {"cmd": "shutdown"}
+              {"cmd": "reload"}  (swap in changed index files now, see Config.INDEX_RELOAD_INTERVAL)
+              {"cmd": "metrics", "format": "json" | "prometheus"}  (needs --metrics)
+    Detect requests may add "profile": true to dump a trace for just that call,
+    and "multi_pet": true / false to override --multi-pet.
+    The response is the detect_breed result (plus "id" when one was sent).
+    With a scheduler, concurrent detect requests are batched together; with
+    a worker pool they run in parallel processes. Either way stdio responses
+    may come back out of order (match them by "id").
+    """
+    
+    def __init__(self, detector: BreedDetector, scheduler: BatchScheduler = None, pool: WorkerPool = None):
+        self.detector = detector
+        self.scheduler = scheduler
+        self.pool = pool
+        self.started_at = time.time()
+        self.requests_served = 0
+        self.shutdown_requested = threading.Event()
+        self._lock = threading.Lock()  # Models are not re-entrant
+    
+    def handle(self, request: dict) -> dict:
+        """Dispatch one decoded request."""
+        cmd = request.get("cmd", "detect")
+        
+        if cmd == "ping":
+            return {"success": True, "message": "pong"}
+        
+        if cmd == "stats":
+            stats = {
                 "success": True,
-                "breed": breed_clean,
-                "breed_raw": best_breed_raw,
-                "confidence": round(confidence, 3),
-                "animal_type": detected_type,
-                "top_breeds": top_breeds,
-                "metadata": {
-                    "animal_detected": True,
-                    "detection_confidence": round(det_conf, 3),
-                    "bounding_box": bbox,
-                    "processing_time_ms": process_time
-                }
+                "requests_served": self.requests_served,
+                "uptime_s": round(time.time() - self.started_at, 1)
             }
-            
+            # With a pool the parent's cache is never used; each worker keeps its own
+            cache = self.pool.cache_stats() if self.pool is not None else None
+            if self.pool is None and self.detector.cache is not None:
+                cache = self.detector.cache.stats()
+            if cache is not None:
+                stats["cache"] = cache
+            if self.scheduler is not None:
+                stats["scheduler"] = self.scheduler.stats()
+            if self.pool is not None:
+                stats["pool"] = self.pool.stats()
+                stats["indexes"] = self.pool.broadcast("indexes")
+            else:
+                stats["indexes"] = {t: db.info() for t, db in self.detector.models.databases.items()}
+            return stats
+        
+        if cmd == "reload":
+            if self.pool is not None:
+                return {"success": True, "reloaded": self.pool.broadcast("reload")}
+            return {"success": True, "reloaded": self.detector.models.check_for_updates(settle=False)}
+        
+        if cmd == "metrics":
+            metrics = self.pool.metrics() if self.pool is not None else self.detector.metrics
+            if metrics is None:
+                return {"success": False, "error": "Metrics are disabled (start with --metrics)"}
+            if request.get("format") == "prometheus":
+                return {"success": True, "format": "prometheus", "metrics": metrics.to_prometheus()}
+            return {"success": True, "format": "json", "metrics": metrics.to_json()}
+        
+        if cmd == "shutdown":
+            self.shutdown_requested.set()
+            return {"success": True, "message": "Shutting down"}
+        
+        if cmd != "detect":
+            return {"success": False, "error": f"Unknown command: {cmd}"}
+        
+        animal_type = request.get("type", "dog")
+        profile = True if request.get("profile") else None
+        multi_pet = request.get("multi_pet")
+        
+        if "images" not in request and not request.get("image"):
+            return {"success": False, "error": "'image' field required"}
+        try:
+            images = [image_source(spec) for spec in request.get("images", [request.get("image")])]
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            return {"success": False, "error": f"Invalid image: {str(e)}"}
+        
+        if "images" in request:
+            return {"success": True, "results": self.detect(images, animal_type, profile, multi_pet)}
+        return self.detect(images, animal_type, profile, multi_pet)[0]
+    
+    @property
+    def max_in_flight(self) -> int:
+        """Detect requests worth running at once (1 = answer them one by one)."""
+        if self.scheduler is not None:
+            return self.scheduler.queue_size + self.scheduler.max_batch
+        if self.pool is not None:
+            return 2 * len(self.pool.workers)
+        return 1
+    
+    def detect(self, images: list, animal_type: str, profile: bool, multi_pet: bool) -> list:
+        """Run through the scheduler or worker pool when there is one, else directly under the model lock."""
+        if self.scheduler is not None or self.pool is not None:
+            if self.scheduler is not None:
+                futures = [self.scheduler.submit(image, animal_type, profile, multi_pet) for image in images]
+                results = [future.result() for future in futures]
+            else:
+                try:
+                    results = self.pool.detect_batch(images, animal_type, profile, multi_pet)
+                except RuntimeError as e:
+                    results = [self.detector.error_result(f"Processing error: {str(e)}") for _ in images]
+            with self._lock:
+                self.requests_served += len(results)
+            return results
+        
+        with self._lock:
+            results = self.detector.detect_breed_batch(images, animal_type, profile, multi_pet)
+            self.requests_served += len(results)
+        return results
+    
+    @staticmethod
+    def decode_line(line):
+        """(request, None) for a JSON object line (str or UTF-8 bytes), else (None, error response)."""
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+        except ValueError as e:
+            return None, {"success": False, "error": f"Invalid request: {str(e)}"}
+        return request, None
+    
+    def handle_request(self, request: dict) -> dict:
+        """Dispatch one decoded request and echo back its id (errors become an error response)."""
+        try:
+            response = self.handle(request)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Processing error: {str(e)}",
-                "animal_detected": False
-            }
+            # The request must still get an answer, and the serving loop must survive
+            print(f"[DetectionServer] Request failed: {type(e).__name__}: {e}", file=sys.stderr)
+            response = {"success": False, "error": f"Processing error: {str(e)}"}
+        if "id" in request:
+            response = {"id": request["id"], **response}
+        return response
+    
+    def handle_line(self, line) -> dict:
+        """Decode one JSON line (str or bytes), dispatch it and echo back the request id."""
+        request, error = self.decode_line(line)
+        return error if request is None else self.handle_request(request)
+
+
+def serve_stdio(server: DetectionServer, out):
+    """
+    JSON-lines loop: one request per stdin line, one response per stdout line.
+    With a scheduler or worker pool, detect requests are answered from
+    worker threads as they finish (so several can be in flight); other
+    commands are answered inline.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    # Read as bytes: a line that isn't UTF-8 gets an error response instead of ending the loop
+    stdin = open(sys.stdin.fileno(), 'rb', closefd=False)
+    write_lock = threading.Lock()
+    
+    def write(response: dict):
+        with write_lock:
+            out.write(json.dumps(response, ensure_ascii=False) + "\n")
+            out.flush()
+    
+    def respond(request: dict):
+        write(server.handle_request(request))
+    
+    # Enough threads to keep the scheduler / workers busy; later lines wait in the executor
+    concurrent = server.max_in_flight > 1
+    with ThreadPoolExecutor(max_workers=server.max_in_flight, thread_name_prefix="stdio") as pool:
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            
+            # Parsed once here (lines can carry base64 images)
+            request, error = server.decode_line(line)
+            if error is not None:
+                write(error)
+                continue
+            
+            if concurrent and request.get("cmd", "detect") == "detect":
+                pool.submit(respond, request)
+                continue
+            
+            respond(request)
+            if server.shutdown_requested.is_set():
+                break
+
+
+def make_unix_listener(server: DetectionServer, socket_path: str):
+    """Local Unix socket speaking the same JSON-lines protocol as stdio."""
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise RuntimeError("Unix sockets are not supported on this platform")
+    
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.strip()
+                if not line:
+                    continue
+                response = server.handle_line(line)
+                self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+                self.wfile.flush()
+    
+    Path(socket_path).unlink(missing_ok=True)
+    listener = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    listener.daemon_threads = True
+    return listener
+
+
+def make_http_listener(server: DetectionServer, address: str):
+    """
+    Local HTTP listener: POST /detect with a JSON body (or the image itself
+    as an image/* or application/octet-stream body, ?type=cat),
+    GET /health, GET /metrics (Prometheus text).
+    """
+    host, _, port = address.rpartition(':')
+    
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, server.handle({"cmd": "stats"}))
+            elif self.path == "/metrics":
+                response = server.handle({"cmd": "metrics", "format": "prometheus"})
+                if not response["success"]:
+                    self._send_json(404, response)
+                    return
+                body = response["metrics"].encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {"success": False, "error": "Not found"})
+        
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/detect":
+                self._send_json(404, {"success": False, "error": "Not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("image/") or content_type.startswith("application/octet-stream"):
+                query = parse_qs(url.query)
+                request = {"image": body, "type": query.get("type", ["dog"])[0]}
+                if "multi_pet" in query:  # Absent keeps the server's --multi-pet default
+                    request["multi_pet"] = query["multi_pet"][0] in ("1", "true")
+                self._send_json(200, server.handle(request))
+                return
+            try:
+                line = body.decode('utf-8')
+            except UnicodeDecodeError as e:
+                self._send_json(400, {"success": False, "error": f"Invalid request: {str(e)}"})
+                return
+            self._send_json(200, server.handle_line(line))
+        
+        def log_message(self, format, *args):
+            print(f"[DetectionServer] {self.address_string()} {format % args}", file=sys.stderr)
+    
+    listener = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    listener.daemon_threads = True
+    return listener
+
+
+def run_server(detector: BreedDetector, use_stdio: bool, socket_path: str = None, http_address: str = None):
+    """Run the requested frontends until stdin closes or a shutdown command arrives."""
+    # Keep stdout reserved for protocol responses; stray prints go to stderr
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    sys.stdout = sys.stderr
+    
+    config = detector.config
+    scheduler = pool = None
+    if config.POOL_WORKERS > 0:
+        # Workers inherit the indexes already mapped, instead of each loading its own
+        detector.models.preload_indexes()
+        pool = WorkerPool(config.POOL_WORKERS, config.POOL_THREADS, config.POOL_PIN_CPUS)
+        if config.WARMUP:
+            pool.broadcast("ping")  # Answered once each worker has warmed up
+    elif config.MICRO_BATCH_SIZE > 0:
+        scheduler = BatchScheduler(detector, config.MICRO_BATCH_SIZE, config.MICRO_BATCH_WAIT_MS,
+                                   config.MICRO_BATCH_QUEUE, config.DECODE_WORKERS)
+        print(f"[DetectionServer] Micro-batching up to {config.MICRO_BATCH_SIZE} requests "
+              f"(wait {config.MICRO_BATCH_WAIT_MS} ms, queue {config.MICRO_BATCH_QUEUE})", file=sys.stderr)
+    
+    if pool is None:
+        detector.models.start_index_watcher(config.INDEX_RELOAD_INTERVAL)  # Pool workers run their own
+    
+    server = DetectionServer(detector, scheduler, pool)
+    listeners = []
+    if socket_path:
+        listeners.append(make_unix_listener(server, socket_path))
+        print(f"[DetectionServer] Listening on unix:{socket_path}", file=sys.stderr)
+    if http_address:
+        listeners.append(make_http_listener(server, http_address))
+        print(f"[DetectionServer] Listening on http://{http_address}", file=sys.stderr)
+    
+    for listener in listeners:
+        threading.Thread(target=listener.serve_forever, daemon=True).start()
+    
+    # Ready signal (same shape as --init-only)
+    out.write(json.dumps({"success": True, "message": "Models initialized"}) + "\n")
+    out.flush()
+    
+    try:
+        if use_stdio:
+            serve_stdio(server, out)
+        else:
+            server.shutdown_requested.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for listener in listeners:
+            listener.shutdown()
+            listener.server_close()
+        if socket_path:
+            Path(socket_path).unlink(missing_ok=True)
+        if scheduler is not None:
+            scheduler.stop()
+        if pool is not None:
+            pool.close()
+
+
+# ============================================================================
+# BULK MODE (directory / manifest -> streaming JSON lines)
+# ============================================================================
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def iter_input_dir(input_dir: str):
+    """Yield (id, path) for every image under a directory, id = relative path."""
+    root = Path(input_dir)
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+            yield path.relative_to(root).as_posix(), str(path)
+
+
+def iter_manifest(manifest_path: str):
+    """Yield (id, path) for every non-empty manifest line, id = the line itself."""
+    base = Path(manifest_path).parent
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = Path(line)
+            yield line, str(path if path.is_absolute() else base / path)
+
+
+def read_done_ids(output_path: str) -> set:
+    """Collect ids already written to a JSONL output (a torn last line is ignored)."""
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def open_output(output_path: str):
+    """Open a JSONL output for appending, starting on a fresh line if a previous run died mid-write."""
+    path = Path(output_path)
+    torn = False
+    if path.exists() and path.stat().st_size > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, 2)
+            torn = f.read(1) != b"\n"
+    
+    out = open(path, 'a', encoding='utf-8')
+    if torn:
+        out.write("\n")
+    return out
+
+
+def read_and_decode(source):
+    """Fully decode an image path or bytes in a worker thread (PIL releases the GIL while decoding)."""
+    data = source if isinstance(source, bytes) else Path(source).read_bytes()
+    img = decode_image(io.BytesIO(data), Config().DECODE_MAX_SIDE)
+    
+    # Lets BreedDetector's result cache recognise re-uploaded files
+    img.info["sha256"] = hashlib.sha256(data).hexdigest()
+    return img
+
+
+def run_bulk(detector: BreedDetector, items, out, batch_size: int = 16, workers: int = 4, done_ids: set = None,
+             animal_type: str = "dog"):
+    """
+    Stream (id, path) items through detect_breed_batch and write one JSON
+    line per image as soon as its batch finishes. Decoding runs in a thread
+    pool that stays at most two batches ahead of inference, so memory is
+    bounded regardless of how many images are processed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    
+    done_ids = done_ids or set()
+    start = time.time()
+    processed = skipped = failed = 0
+    pending = deque()
+    
+    def flush_batch(batch):
+        nonlocal processed, failed
+        ids = [item_id for item_id, _ in batch]
+        results = [None] * len(batch)
+        images, slots = [], []
+        
+        for slot, (_, future) in enumerate(batch):
+            try:
+                images.append(future.result())
+                slots.append(slot)
+            except Exception as e:
+                results[slot] = detector.error_result(f"Processing error: {str(e)}")
+        
+        if images:
+            for slot, result in zip(slots, detector.detect_breed_batch(images, animal_type)):
+                results[slot] = result
+        
+        for item_id, result in zip(ids, results):
+            out.write(json.dumps({"id": item_id, **result}, ensure_ascii=False) + "\n")
+            failed += not result["success"]
+        out.flush()
+        processed += len(batch)
+        
+        elapsed = time.time() - start
+        print(f"[Bulk] {processed} processed, {skipped} skipped, {failed} without result "
+              f"({processed / max(elapsed, 1e-6):.1f} img/s)", file=sys.stderr)
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item_id, path in items:
+            if item_id in done_ids:
+                skipped += 1
+                continue
+            
+            pending.append((item_id, pool.submit(read_and_decode, path)))
+            
+            # Keep one batch decoding ahead while the current one runs
+            if len(pending) >= 2 * batch_size:
+                flush_batch([pending.popleft() for _ in range(batch_size)])
+        
+        while pending:
+            flush_batch([pending.popleft() for _ in range(min(batch_size, len(pending)))])
+    
+    return {"processed": processed, "skipped": skipped, "failed": failed,
+            "elapsed_s": round(time.time() - start, 2)}
 
 
 # ============================================================================
@@ -370,27 +2911,179 @@ class BreedDetector:
 def main():
     parser = argparse.ArgumentParser(description='PawVerse Breed Detection')
     parser.add_argument('--image', help='Path to image file')
+    parser.add_argument('--stdin', nargs='?', const='raw', choices=['raw', 'base64'],
+                        help='Read the image bytes (raw, or base64 text) from stdin instead of --image')
     parser.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
-    parser.add_argument('--init-only', action='store_true', help='Only initialize models')
+    parser.add_argument('--init-only', action='store_true', help='Only initialize models (and write the local CLIP snapshot)')
+    parser.add_argument('--profile-startup', action='store_true', help='Print an import/model-load timing breakdown to stderr')
+    parser.add_argument('--index-variant', default='flat', choices=['flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'pca'],
+                        help='FAISS index variant to load (see breed_index_tools.py convert)')
+    parser.add_argument('--search-backend', default='faiss', choices=['faiss', 'numpy'],
+                        help='Neighbour search: FAISS, or exact NumPy search over the .npy export (no faiss import)')
+    parser.add_argument('--nprobe', type=int, help='IVF lists visited per query')
+    parser.add_argument('--ef-search', type=int, help='HNSW search candidate list size')
+    parser.add_argument('--preload', action='store_true', help='Load dog and cat indexes at startup')
+    parser.add_argument('--prototype-margin', type=float,
+                        help='Answer from breed prototypes when their top-1/top-2 margin is at least this')
+    parser.add_argument('--index-reload', type=float,
+                        help='Server mode: check the index files every N seconds and swap in rebuilt ones (0 = off)')
+    parser.add_argument('--no-mmap', action='store_true', help='Read indexes into memory instead of mapping them')
+    parser.add_argument('--decode-max-side', type=int, help='Decode large uploads at reduced scale down to this long side (0 = full size)')
+    parser.add_argument('--backend', default='torch', choices=['torch', 'onnx'], help='Inference backend')
+    parser.add_argument('--onnx-threads', type=int, help='onnxruntime intra-op threads (0 = all cores)')
+    parser.add_argument('--onnx-inter-threads', type=int, help='onnxruntime inter-op threads')
+    parser.add_argument('--clip-quantize', choices=['dynamic', 'static'], help='INT8 CLIP encoder on CPU (static needs --backend onnx)')
+    parser.add_argument('--clip-compile', choices=['script', 'compile'],
+                        help='TorchScript (cached across restarts) or torch.compile graph of the CLIP encoder')
+    parser.add_argument('--bf16', action='store_true', help='BF16 CLIP weights on CPUs with native bf16 (AMX / AVX512-BF16)')
+    parser.add_argument('--warmup', action='store_true', help='Run dummy batches through the models before serving')
+    parser.add_argument('--optimize', action='store_true', help='Shorthand for --clip-compile script --bf16 --warmup')
+    parser.add_argument('--species-gate', type=float,
+                        help='Skip YOLO for close-ups whose zero-shot --type probability is at least this')
+    parser.add_argument('--multi-pet', action='store_true', help='Answer every dog/cat in the photo (listed under "pets")')
+    parser.add_argument('--max-pets', type=int, help='Most pets answered per photo in multi-pet mode')
+    parser.add_argument('--cache-size', type=int, help='In-memory result cache entries (0 disables)')
+    parser.add_argument('--cache-db', help='SQLite file persisting the result cache across restarts')
+    parser.add_argument('--metrics', action='store_true', help='Collect counters/latency histograms (server: cmd "metrics", GET /metrics)')
+    parser.add_argument('--metrics-out', help='Write metrics here on exit (.prom = Prometheus text, else JSON); implies --metrics')
+    parser.add_argument('--profile-requests', action='store_true', help='Profile every detect call and write a trace per call')
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'torch'], help='Profiler used for traces')
+    parser.add_argument('--profile-dir', help='Directory for profile traces (default: Python/profiles)')
+    parser.add_argument('--serve', action='store_true', help='Keep models loaded and answer JSON-lines requests on stdin/stdout')
+    parser.add_argument('--socket', help='Also listen on this Unix socket path (JSON lines)')
+    parser.add_argument('--http', help='Also listen for HTTP requests on HOST:PORT (POST /detect)')
+    parser.add_argument('--pool', type=int, help='Server mode: fork N worker processes sharing the loaded models')
+    parser.add_argument('--pool-threads', type=int, help='Server mode: torch/faiss threads per pool worker (default: CPUs / N)')
+    parser.add_argument('--no-pin-cpus', action='store_true', help='Server mode: do not pin pool workers to their own cores')
+    parser.add_argument('--micro-batch', type=int, help='Server mode: batch up to N concurrent requests (0 = off)')
+    parser.add_argument('--micro-batch-wait-ms', type=float, help='Server mode: longest wait for a batch to fill')
+    parser.add_argument('--micro-batch-queue', type=int, help='Server mode: queued requests before new ones are rejected')
+    parser.add_argument('--input-dir', help='Bulk mode: process every image under this directory')
+    parser.add_argument('--manifest', help='Bulk mode: process image paths listed one per line in this file')
+    parser.add_argument('--output', help='Bulk mode: append JSON lines here (default: stdout)')
+    parser.add_argument('--resume', action='store_true', help='Bulk mode: skip ids already present in --output')
+    parser.add_argument('--batch-size', type=int, default=16, help='Bulk mode: images per inference batch')
+    parser.add_argument('--workers', type=int, default=4, help='Image decode threads (bulk mode, micro-batching)')
     
     args = parser.parse_args()
     
+    # Usage errors are reported before any heavy import or model load
+    server_mode = args.serve or args.socket or args.http
+    bulk_mode = args.input_dir or args.manifest
+    if not (args.init_only or server_mode or bulk_mode or args.image or args.stdin):
+        print(json.dumps({"success": False, "error": "--image argument required"}))
+        return
+    
+    # Read before the model load so the writing process isn't held up for its duration
+    image_bytes = None
+    if args.stdin and not (args.init_only or server_mode or bulk_mode):
+        data = sys.stdin.buffer.read()
+        image_bytes = base64.b64decode(data) if args.stdin == "base64" else data
+        if not image_bytes:
+            print(json.dumps({"success": False, "error": "No image bytes on stdin"}))
+            return
+    
+    config = Config()
+    config.FAISS_INDEX_VARIANT = args.index_variant
+    config.SEARCH_BACKEND = args.search_backend
+    if args.nprobe:
+        config.FAISS_NPROBE = args.nprobe
+    if args.ef_search:
+        config.FAISS_EF_SEARCH = args.ef_search
+    config.FAISS_PRELOAD = args.preload
+    config.PROTOTYPE_MARGIN = args.prototype_margin
+    config.FAISS_MMAP = not args.no_mmap
+    if args.index_reload is not None:
+        config.INDEX_RELOAD_INTERVAL = args.index_reload
+    config.BACKEND = args.backend
+    config.CLIP_QUANTIZE = args.clip_quantize
+    config.CLIP_COMPILE = args.clip_compile or ("script" if args.optimize else None)
+    config.CPU_BF16 = args.bf16 or args.optimize
+    config.WARMUP = args.warmup or args.optimize
+    if args.onnx_threads is not None:
+        config.ONNX_INTRA_OP_THREADS = args.onnx_threads
+    if args.onnx_inter_threads is not None:
+        config.ONNX_INTER_OP_THREADS = args.onnx_inter_threads
+    if args.decode_max_side is not None:
+        config.DECODE_MAX_SIDE = args.decode_max_side
+    if args.cache_size is not None:
+        config.RESULT_CACHE_SIZE = args.cache_size
+    config.RESULT_CACHE_DB = args.cache_db
+    config.SPECIES_GATE = args.species_gate
+    config.DECODE_WORKERS = args.workers
+    if args.pool is not None:
+        config.POOL_WORKERS = args.pool
+    if args.pool_threads is not None:
+        config.POOL_THREADS = args.pool_threads
+    config.POOL_PIN_CPUS = not args.no_pin_cpus
+    if args.micro_batch is not None:
+        config.MICRO_BATCH_SIZE = args.micro_batch
+    if args.micro_batch_wait_ms is not None:
+        config.MICRO_BATCH_WAIT_MS = args.micro_batch_wait_ms
+    if args.micro_batch_queue is not None:
+        config.MICRO_BATCH_QUEUE = args.micro_batch_queue
+    config.MULTI_PET = args.multi_pet
+    if args.max_pets:
+        config.MAX_PETS = args.max_pets
+    config.METRICS_ENABLED = args.metrics or bool(args.metrics_out)
+    config.PROFILE_REQUESTS = args.profile_requests
+    config.PROFILER = args.profiler
+    if args.profile_dir:
+        config.PROFILE_DIR = Path(args.profile_dir)
+    
     # Initialize detector (loads models)
     detector = BreedDetector()
     
-    if args.init_only:
-        print(json.dumps({"success": True, "message": "Models initialized"}))
-        return
+    # A single detection also loads its index, so that profile is printed after the result
+    single_image = not (args.init_only or server_mode or bulk_mode)
     
-    if not args.image:
-        print(json.dumps({"success": False, "error": "--image argument required"}))
-        return
+    # Pool workers warm up after the fork instead (inference must not run before it)
+    if config.WARMUP and not (server_mode and config.POOL_WORKERS > 0):
+        sizes = [1]
+        if server_mode and config.MICRO_BATCH_SIZE > 0:
+            sizes.append(config.MICRO_BATCH_SIZE)
+        if bulk_mode:
+            sizes.append(args.batch_size)
+        detector.warmup(sizes)
+    if args.profile_startup and not single_image:
+        print(f"[Startup] {json.dumps(startup_profile())}", file=sys.stderr)
     
-    # Run detection
-    result = detector.detect_breed(args.image, args.type)
+    if args.init_only:
+        result = {"success": True, "message": "Models initialized"}
+        if args.profile_startup:
+            result["startup"] = startup_profile()
+        print(json.dumps(result))
+        return
     
-    # Output JSON to stdout
-    print(json.dumps(result, ensure_ascii=False))
+    try:
+        if server_mode:
+            run_server(detector, use_stdio=args.serve, socket_path=args.socket, http_address=args.http)
+            return
+        
+        if bulk_mode:
+            items = iter_input_dir(args.input_dir) if args.input_dir else iter_manifest(args.manifest)
+            done_ids = read_done_ids(args.output) if args.resume and args.output else set()
+            
+            if args.output:
+                with open_output(args.output) as out:
+                    summary = run_bulk(detector, items, out, args.batch_size, args.workers, done_ids, args.type)
+            else:
+                summary = run_bulk(detector, items, sys.stdout, args.batch_size, args.workers, done_ids, args.type)
+            
+            print(f"[Bulk] Done: {json.dumps(summary)}", file=sys.stderr)
+            return
+        
+        # Run detection
+        result = detector.detect_breed(image_bytes if image_bytes is not None else args.image, args.type)
+        
+        # Output JSON to stdout
+        print(json.dumps(result, ensure_ascii=False))
+        
+        if args.profile_startup:
+            print(f"[Startup] {json.dumps(startup_profile())}", file=sys.stderr)
+    finally:
+        if args.metrics_out:
+            write_metrics(detector.metrics, args.metrics_out)
 
 
 if __name__ == '__main__':
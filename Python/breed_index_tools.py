@@ -0,0 +1,888 @@
+#!/usr/bin/env python3
+"""
+PawVerse Breed Index Tools
+Offline utilities for the dog/cat FAISS databases in Services/DetectBreed.
+
+    python breed_index_tools.py convert --type dog --variant hnsw
+    python breed_index_tools.py convert --type dog --variant pca --pca-dim 128 --codec fp16
+    python breed_index_tools.py bench --type dog --variant ivf_flat --nprobe 4 16 64
+    python breed_index_tools.py bench --type dog --pca-dims 64 128 256 --codecs fp16 sq8
+    python breed_index_tools.py build --type dog --images path/to/Images
+    python breed_index_tools.py prototypes --type dog --per-breed 3
+    python breed_index_tools.py export-npy --type dog
+    python breed_index_tools.py bench-numpy --type dog --sizes 1000 10000 100000
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+from breed_detection import (BreedDetector, BreedPrototypes, Config, IMAGE_EXTENSIONS, LabelStore,
+                             NumpyFlatIndex, process_memory_mb, read_and_decode, read_index, tune_index)
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def load_index(animal_type: str, variant: str = "flat"):
+    """Read one stored index variant for animal type (dog/cat)."""
+    config = Config()
+    path = config.DATA_DIR / animal_type / config.FAISS_INDEX_FILES[variant]
+    if not path.exists():
+        raise FileNotFoundError(f"FAISS index not found: {path} (run 'convert' first)")
+    return faiss.read_index(str(path))
+
+
+def load_labels(animal_type: str) -> LabelStore:
+    return LabelStore.load(Config().DATA_DIR / animal_type / "id_map.json")
+
+
+def index_vectors(index) -> np.ndarray:
+    """All stored vectors of a flat index as an (N, D) float32 array."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_memory_mb(index) -> float:
+    """Serialized size of an index, a close proxy for its resident size."""
+    return round(faiss.serialize_index(index).nbytes / 2**20, 2)
+
+
+# ============================================================================
+# CONVERT (flat -> IVF-Flat / IVF-PQ / HNSW / PCA-reduced)
+# ============================================================================
+
+# Storage of the PCA-reduced vectors: float32, float16 or 8-bit scalar quantized (per-dim range)
+REDUCED_CODECS = {
+    "fp32": None,
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def default_nlist(n: int) -> int:
+    """~4*sqrt(N) lists, keeping at least 39 training points per centroid."""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+
+def pca_transform(vectors: np.ndarray, dim: int, whiten: bool = False):
+    """
+    D -> dim projection learned on the reference vectors. Plain: uncentered
+    PCA (top eigenvectors of X^T X), whose inner products best approximate
+    the original ones, so scores stay on the cosine scale. Whitened: centered
+    PCA scaled to unit variance per component (the index re-normalizes it).
+    """
+    d = vectors.shape[1]
+    if not 0 < dim < d:
+        raise ValueError(f"PCA dim must be between 1 and {d - 1}, got {dim}")
+    
+    if whiten:
+        return faiss.PCAMatrix(d, dim, -0.5)  # Trained along with the index
+    
+    _, eigenvectors = np.linalg.eigh(vectors.T.astype(np.float64) @ vectors)
+    transform = faiss.LinearTransform(d, dim, False)
+    components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :dim].T, dtype=np.float32)
+    faiss.copy_array_to_vector(components.ravel(), transform.A)
+    transform.is_trained = True
+    return transform
+
+
+def reduced_params(index) -> dict:
+    """pca_dim / codec / whiten of a stored "pca" variant, so rebuilds keep its settings."""
+    pretransform = faiss.downcast_index(index)  # Keep index referenced: the store belongs to it
+    store = faiss.downcast_index(pretransform.index)
+    if isinstance(store, faiss.IndexFlat):
+        codec = "fp32"
+    else:
+        codec = next(name for name, qtype in REDUCED_CODECS.items() if qtype == store.sq.qtype)
+    return {"pca_dim": store.d, "codec": codec, "whiten": pretransform.chain.size() > 1}
+
+
+def build_variant(vectors: np.ndarray, variant: str, nlist: int = None, pq_m: int = 64,
+                  pq_nbits: int = 8, hnsw_m: int = 32, ef_construction: int = 200,
+                  pca_dim: int = 128, codec: str = "fp16", whiten: bool = False):
+    """
+    Build an inner-product index of the given variant over vectors (ids keep their order).
+    "pca" stores PCA-reduced vectors; the projection is part of the index, so
+    queries go through the same one inside index.search.
+    """
+    n, d = vectors.shape
+    metric = faiss.METRIC_INNER_PRODUCT
+    
+    if variant == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif variant in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(d)
+        if variant == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits, metric)
+        index.train(vectors)
+    elif variant == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif variant == "pca":
+        transform = pca_transform(vectors, pca_dim, whiten)
+        qtype = REDUCED_CODECS[codec]
+        if qtype is None:
+            store = faiss.IndexFlatIP(pca_dim)
+        else:
+            store = faiss.IndexScalarQuantizer(pca_dim, qtype, metric)
+        if whiten:
+            index = faiss.IndexPreTransform(faiss.NormalizationTransform(pca_dim, 2.0), store)
+            index.prepend_transform(transform)
+        else:
+            index = faiss.IndexPreTransform(transform, store)
+        index.train(vectors)  # Whitening PCA and the 8-bit quantizer's ranges
+    else:
+        raise ValueError(f"Unknown index variant: {variant}")
+    
+    index.add(vectors)
+    return index
+
+
+def cmd_convert(args):
+    config = Config()
+    flat = load_index(args.type, "flat")
+    vectors = index_vectors(flat)
+    
+    start = time.time()
+    index = build_variant(vectors, args.variant, args.nlist, args.pq_m, args.pq_nbits,
+                          args.hnsw_m, args.ef_construction, args.pca_dim, args.codec, args.whiten)
+    
+    out_path = config.DATA_DIR / args.type / config.FAISS_INDEX_FILES[args.variant]
+    faiss.write_index(index, str(out_path))
+    
+    print(json.dumps({
+        "success": True,
+        "type": args.type,
+        "variant": args.variant,
+        "path": str(out_path),
+        "ntotal": index.ntotal,
+        "build_s": round(time.time() - start, 2),
+        **(reduced_params(index) if args.variant == "pca" else {}),
+        "memory_mb": index_memory_mb(index),
+        "flat_memory_mb": index_memory_mb(flat)
+    }))
+
+
+# ============================================================================
+# BENCHMARK (recall@K and breed agreement against the flat baseline)
+# ============================================================================
+
+def search_leave_one_out(index, queries: np.ndarray, ids: np.ndarray, k: int):
+    """Search k+1 neighbours and drop each query's own vector so it can't vote for itself."""
+    sims, idxs = index.search(queries, k + 1)
+    keep = idxs != ids[:, None]
+    
+    # Rows where self wasn't returned keep their first k hits
+    keep[keep.all(axis=1), -1] = False
+    
+    return sims[keep].reshape(-1, k), idxs[keep].reshape(-1, k)
+
+
+def top1_codes(labels: LabelStore, sims: np.ndarray, idxs: np.ndarray) -> np.ndarray:
+    return np.argmax(labels.breed_scores(sims, idxs), axis=1)
+
+
+def measure(index, queries: np.ndarray, ids: np.ndarray, k: int, labels: LabelStore,
+            base_idxs: np.ndarray, base_top1: np.ndarray, latency_queries: int = 200) -> dict:
+    """Recall@k, breed agreement, batched QPS and single-query latency for one configuration."""
+    start = time.perf_counter()
+    sims, idxs = search_leave_one_out(index, queries, ids, k)
+    elapsed = time.perf_counter() - start
+    
+    recall = np.mean([np.isin(row, base_row).sum() / k for row, base_row in zip(idxs, base_idxs)])
+    agreement = np.mean(top1_codes(labels, sims, idxs) == base_top1)
+    
+    latencies = []
+    for q in queries[:latency_queries]:
+        t = time.perf_counter()
+        index.search(q[None, :], k + 1)
+        latencies.append((time.perf_counter() - t) * 1000)
+    
+    return {
+        f"recall_at_{k}": round(float(recall), 4),
+        "breed_agreement": round(float(agreement), 4),
+        "qps_batch": round(len(queries) / elapsed, 1),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "memory_mb": index_memory_mb(index)
+    }
+
+
+def cmd_bench(args):
+    labels = load_labels(args.type)
+    flat = load_index(args.type, "flat")
+    vectors = index_vectors(flat)
+    
+    rng = np.random.default_rng(args.seed)
+    ids = np.sort(rng.choice(flat.ntotal, size=min(args.queries, flat.ntotal), replace=False))
+    queries = np.ascontiguousarray(vectors[ids])
+    
+    base_sims, base_idxs = search_leave_one_out(flat, queries, ids, args.k)
+    base_top1 = top1_codes(labels, base_sims, base_idxs)
+    
+    runs = [{"variant": "flat", **measure(flat, queries, ids, args.k, labels, base_idxs, base_top1)}]
+    
+    for variant in args.variant:
+        index = load_index(args.type, variant)
+        if variant == "pca":
+            run = {"variant": variant, **reduced_params(index),
+                   **measure(index, queries, ids, args.k, labels, base_idxs, base_top1)}
+            runs.append(run)
+            print(f"[Bench] {json.dumps(run)}", file=sys.stderr)
+            continue
+        
+        param, values = ("ef_search", args.ef_search) if variant == "hnsw" else ("nprobe", args.nprobe)
+        for value in values:
+            # Only the knob matching the variant takes effect
+            tune_index(index, nprobe=value, ef_search=value)
+            run = {"variant": variant, param: value,
+                   **measure(index, queries, ids, args.k, labels, base_idxs, base_top1)}
+            runs.append(run)
+            print(f"[Bench] {json.dumps(run)}", file=sys.stderr)
+    
+    # PCA-reduced stores built in memory, one per target dimension x codec
+    if args.pca_dims:
+        spectrum = np.linalg.eigvalsh(vectors.T.astype(np.float64) @ vectors)[::-1]
+    for dim in args.pca_dims:
+        for codec in args.codecs:
+            start = time.time()
+            index = build_variant(vectors, "pca", pca_dim=dim, codec=codec, whiten=args.whiten)
+            run = {"variant": "pca", "pca_dim": dim, "codec": codec, "whiten": args.whiten,
+                   "energy": round(float(spectrum[:dim].sum() / spectrum.sum()), 4),
+                   "build_s": round(time.time() - start, 2),
+                   **measure(index, queries, ids, args.k, labels, base_idxs, base_top1)}
+            runs.append(run)
+            print(f"[Bench] {json.dumps(run)}", file=sys.stderr)
+    
+    print(json.dumps({
+        "type": args.type,
+        "ntotal": flat.ntotal,
+        "queries": len(ids),
+        "k": args.k,
+        "faiss_threads": faiss.omp_get_max_threads(),
+        "results": runs
+    }, indent=2))
+
+
+# ============================================================================
+# PROTOTYPES (a few medoids per breed for the first-stage vote)
+# ============================================================================
+
+def prototype_ids(vectors: np.ndarray, labels: LabelStore, per_breed: int = 3, seed: int = 0) -> np.ndarray:
+    """Row ids of up to per_breed spherical k-means medoids for every breed, sorted."""
+    ids = []
+    for code in np.unique(labels.codes):
+        members = np.flatnonzero(labels.codes == code)
+        if len(members) <= per_breed:
+            ids.extend(members.tolist())
+            continue
+        
+        kmeans = faiss.Kmeans(vectors.shape[1], per_breed, niter=20, seed=seed, spherical=True,
+                              min_points_per_centroid=1)
+        kmeans.train(np.ascontiguousarray(vectors[members]))
+        
+        # Snap each centroid to its closest member so scores stay on the neighbour-similarity scale
+        closest = np.argmax(kmeans.centroids @ vectors[members].T, axis=1)
+        ids.extend(members[np.unique(closest)].tolist())
+    
+    return np.array(sorted(ids), dtype=np.int64)
+
+
+def write_prototypes(animal_type: str, vectors: np.ndarray, labels: LabelStore, ids: np.ndarray, per_breed: int):
+    """Save prototypes next to the flat index, stamped with the index + id_map they came from."""
+    config = Config()
+    out_dir = config.DATA_DIR / animal_type
+    path = out_dir / config.PROTOTYPE_FILE
+    stamp = BreedPrototypes.source_stamp(out_dir / config.FAISS_INDEX_FILES["flat"], out_dir / "id_map.json")
+    
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, 'wb') as f:
+        np.savez(f, vectors=vectors[ids], breeds=np.array([labels.breeds_raw[c] for c in labels.codes[ids]]),
+                 ids=ids, per_breed=per_breed, stamp=stamp)
+    os.replace(tmp, path)
+    return path
+
+
+def cmd_prototypes(args):
+    labels = load_labels(args.type)
+    flat = load_index(args.type, "flat")
+    vectors = index_vectors(flat)
+    
+    start = time.time()
+    ids = prototype_ids(vectors, labels, args.per_breed, args.seed)
+    build_s = time.time() - start
+    path = write_prototypes(args.type, vectors, labels, ids, args.per_breed)
+    
+    # Held-out check: each query's own vector is excluded from both stages
+    rng = np.random.default_rng(args.seed)
+    qids = np.sort(rng.choice(flat.ntotal, size=min(args.queries, flat.ntotal), replace=False))
+    queries = np.ascontiguousarray(vectors[qids])
+    
+    t = time.perf_counter()
+    base_sims, base_idxs = search_leave_one_out(flat, queries, qids, args.k)
+    flat_ms = (time.perf_counter() - t) * 1000 / len(qids)
+    base_top1 = top1_codes(labels, base_sims, base_idxs)
+    
+    t = time.perf_counter()
+    sims = queries @ vectors[ids].T
+    sims[qids[:, None] == ids[None, :]] = -np.inf
+    scores = np.full((len(qids), len(labels.breeds)), -np.inf, dtype=np.float32)
+    for code in np.unique(labels.codes[ids]):
+        scores[:, code] = sims[:, labels.codes[ids] == code].max(axis=1)
+    margins = BreedPrototypes.margins(scores)
+    prototype_ms = (time.perf_counter() - t) * 1000 / len(qids)
+    proto_top1 = np.argmax(scores, axis=1)
+    
+    sweep = []
+    for margin in args.margins:
+        confident = margins >= margin
+        answered = np.where(confident, proto_top1, base_top1)
+        sweep.append({
+            "margin": margin,
+            "prototype_fraction": round(float(confident.mean()), 4),
+            "breed_agreement": round(float(np.mean(answered == base_top1)), 4),
+            "est_search_ms": round(prototype_ms + (1 - float(confident.mean())) * flat_ms, 4)
+        })
+    
+    print(json.dumps({
+        "success": True,
+        "type": args.type,
+        "path": str(path),
+        "prototypes": len(ids),
+        "breeds": int(len(np.unique(labels.codes))),
+        "ntotal": flat.ntotal,
+        "build_s": round(build_s, 2),
+        "queries": len(qids),
+        "flat_search_ms": round(flat_ms, 4),
+        "prototype_ms": round(prototype_ms, 4),
+        "margins": sweep
+    }, indent=2))
+
+
+# ============================================================================
+# MEMORY (private RSS per process: heap read vs mmap)
+# ============================================================================
+
+def probe_index_memory(data_dir: str, animal_type: str, variant: str, mmap: bool) -> dict:
+    """Runs in a fresh process: load one index, touch it with a search, report the RSS growth."""
+    config = Config()
+    if data_dir:
+        config.DATA_DIR = Path(data_dir)
+    
+    before = process_memory_mb()
+    index = read_index(config.DATA_DIR / animal_type / config.FAISS_INDEX_FILES[variant], mmap=mmap)
+    index.search(np.zeros((1, index.d), dtype=np.float32), 50)
+    after = process_memory_mb()
+    
+    return {key: round(after[key] - before[key], 1) for key in after}
+
+
+def cmd_memory(args):
+    if not process_memory_mb():
+        raise RuntimeError("memory probe needs /proc (Linux)")
+    
+    report = {"type": args.type, "variant": args.variant}
+    ctx = multiprocessing.get_context("spawn")
+    for mode, mmap in (("heap", False), ("mmap", True)):
+        with ctx.Pool(1) as pool:
+            report[mode] = pool.apply(probe_index_memory, (args.data_dir, args.type, args.variant, mmap))
+    
+    # File-backed pages live in the shared page cache, so only private pages multiply per worker
+    report["private_saved_mb_per_process"] = round(report["heap"]["private"] - report["mmap"]["private"], 1)
+    print(json.dumps(report, indent=2))
+
+
+# ============================================================================
+# NUMPY BACKEND (.npy export + comparison with IndexFlatIP)
+# ============================================================================
+
+# Fresh-interpreter probe: import cost of breed_detection + a search engine, then its first
+# search (OpenMP / BLAS start-up)
+ENGINE_PROBE = (
+    "import json, time\n"
+    "start = time.perf_counter()\n"
+    "import numpy as np\n"
+    "from breed_detection import NumpyFlatIndex\n"
+    "%s\n"
+    "imported = time.perf_counter()\n"
+    "x = np.random.default_rng(0).standard_normal((1000, 512)).astype(np.float32)\n"
+    "%s\n"
+    "print(json.dumps({'import_ms': (imported - start) * 1000,\n"
+    "                  'first_search_ms': (time.perf_counter() - imported) * 1000}))\n"
+)
+ENGINE_PROBES = {
+    "faiss": ENGINE_PROBE % ("import faiss",
+                             "index = faiss.IndexFlatIP(512); index.add(x); index.search(x[:1], 50)"),
+    "numpy": ENGINE_PROBE % ("", "NumpyFlatIndex(x).search(x[:1], 50)"),
+}
+
+
+def save_npy(path: Path, vectors: np.ndarray):
+    """(N, D) float32 corpus as a plain .npy (written through a handle, so no suffix is appended)."""
+    with open(path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def cmd_export_npy(args):
+    config = Config()
+    flat = load_index(args.type, "flat")
+    out_path = config.DATA_DIR / args.type / config.NUMPY_INDEX_FILE
+    
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    save_npy(tmp, index_vectors(flat))
+    os.replace(tmp, out_path)
+    
+    print(json.dumps({
+        "success": True,
+        "type": args.type,
+        "path": str(out_path),
+        "ntotal": flat.ntotal,
+        "size_mb": round(out_path.stat().st_size / 2**20, 2)
+    }))
+
+
+def search_timings(index, queries: np.ndarray, k: int, latency_queries: int = 200):
+    """(similarities, ids, batched QPS, single-query p50 latency in ms) for one engine."""
+    start = time.perf_counter()
+    sims, idxs = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    
+    latencies = []
+    for q in queries[:latency_queries]:
+        t = time.perf_counter()
+        index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - t) * 1000)
+    
+    return sims, idxs, round(len(queries) / elapsed, 1), round(float(np.percentile(latencies, 50)), 3)
+
+
+def cmd_bench_numpy(args):
+    """NumPy engine vs IndexFlatIP on growing prefixes of the flat index; exits 1 if any result differs."""
+    labels = load_labels(args.type)
+    vectors = index_vectors(load_index(args.type, "flat"))
+    
+    rng = np.random.default_rng(args.seed)
+    queries = np.ascontiguousarray(vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)),
+                                                      replace=False)])
+    
+    runs = []
+    failures = []
+    for size in sorted({min(size, len(vectors)) for size in args.sizes}):
+        corpus = np.ascontiguousarray(vectors[:size])
+        flat = faiss.IndexFlatIP(corpus.shape[1])
+        flat.add(corpus)
+        engine = NumpyFlatIndex(corpus, args.block_size)
+        
+        f_sims, f_idxs, f_qps, f_p50 = search_timings(flat, queries, args.k)
+        n_sims, n_idxs, n_qps, n_p50 = search_timings(engine, queries, args.k)
+        
+        # Rounding can only reorder near-ties, so compare similarities slot by slot as well as ids
+        max_sim_diff = float(np.abs(f_sims - n_sims).max())
+        agreement = float(np.mean(top1_codes(labels, f_sims, f_idxs) == top1_codes(labels, n_sims, n_idxs)))
+        run = {
+            "ntotal": size,
+            "faiss": {"qps_batch": f_qps, "latency_ms_p50": f_p50},
+            "numpy": {"qps_batch": n_qps, "latency_ms_p50": n_p50},
+            "id_match": round(float(np.mean(np.all(f_idxs == n_idxs, axis=1))), 4),
+            "max_sim_diff": max_sim_diff,
+            "breed_agreement": round(agreement, 4)
+        }
+        runs.append(run)
+        print(f"[Bench] {json.dumps(run)}", file=sys.stderr)
+        
+        if max_sim_diff > args.max_sim_diff:
+            failures.append(f"{size} vectors: similarities differ by {max_sim_diff:.2e}")
+    
+    # Start-up side: engine import + first search in a fresh interpreter, and opening the stored files
+    startup = {}
+    for name, probe in ENGINE_PROBES.items():
+        proc = subprocess.run([sys.executable, "-c", probe], cwd=Path(__file__).parent,
+                              capture_output=True, text=True)
+        startup[name] = json.loads(proc.stdout) if proc.returncode == 0 else {"error": proc.stderr[-300:]}
+    
+    config = Config()
+    data_path = config.DATA_DIR / args.type
+    for name, path, opener in (("faiss", data_path / config.FAISS_INDEX_FILES["flat"], read_index),
+                               ("numpy", data_path / config.NUMPY_INDEX_FILE, NumpyFlatIndex.load)):
+        if path.exists():
+            start = time.perf_counter()
+            opener(path)
+            startup[name]["open_ms"] = (time.perf_counter() - start) * 1000
+    for timings in startup.values():
+        for key, value in timings.items():
+            if isinstance(value, float):
+                timings[key] = round(value, 1)
+    
+    print(json.dumps({
+        "success": not failures,
+        "failures": failures,
+        "type": args.type,
+        "queries": len(queries),
+        "k": args.k,
+        "block_size": args.block_size,
+        "faiss_threads": faiss.omp_get_max_threads(),
+        "startup": startup,
+        "results": runs
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+# ============================================================================
+# BUILD (incremental: only new or changed images are embedded)
+# ============================================================================
+
+MANIFEST_NAME = "build_manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def scan_labelled_folder(root: Path) -> dict:
+    """rel path -> (breed label, path, size, mtime_ns) for every image under root/<breed label>/."""
+    files = {}
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or not path.is_file():
+            continue
+        rel = path.relative_to(root)
+        if len(rel.parts) < 2:
+            continue  # Loose files at the root have no breed folder
+        stat = path.stat()
+        files[rel.as_posix()] = (rel.parts[0], path, stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path: Path) -> str:
+    """Same mtime+size stamp ModelManager uses, to notice an index replaced behind the manifest's back."""
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def embedder_signature(config: Config) -> str:
+    """Everything that changes the crop or embedding of an image; a mismatch forces a full rebuild."""
+    return (f"{config.CLIP_MODEL}:{config.CLIP_PRETRAIN}:{Path(config.YOLO_WEIGHTS).name}:"
+            f"{config.YOLO_CONF}:{config.YOLO_IOU}:{config.CLIP_QUANTIZE}:{config.DECODE_MAX_SIDE}")
+
+
+def load_manifest(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get("format") == MANIFEST_FORMAT else {}
+
+
+def embed_files(detector: BreedDetector, paths: list, batch_size: int = 32, workers: int = 4,
+                no_pet: str = "full") -> tuple:
+    """
+    Crop + embed image files the way BreedDetector does for a query: YOLO's
+    best box on the reduced decode, padded crop, OpenCLIP. Decoding runs in a
+    thread pool kept two batches ahead. Returns (vectors (N, D) float32,
+    per-file info dicts); a file skipped for having no pet gets no vector
+    and an info marked "skipped".
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    
+    vectors, infos = [], []
+    pending = deque()
+    start = time.time()
+    
+    def flush_batch(batch):
+        images = [future.result() for future in batch]
+        detections = detector.detect_animals(images)
+        
+        crops, kept = [], []
+        for img, (bbox, det_conf, _) in zip(images, detections):
+            if bbox is None and no_pet == "skip":
+                infos.append({"sha256": img.info["sha256"], "skipped": True})
+                continue
+            crops.append(detector.crop_image(img, bbox))
+            info = {"sha256": img.info["sha256"]}
+            if bbox is not None:
+                info["bbox"] = detector.to_original_coords(img, bbox)
+                info["det_conf"] = round(det_conf, 4)
+            infos.append(info)
+        
+        if crops:
+            vectors.append(detector.embed_images(crops))
+        
+        elapsed = time.time() - start
+        print(f"[Build] {len(infos)}/{len(paths)} embedded ({len(infos) / max(elapsed, 1e-6):.1f} img/s)",
+              file=sys.stderr)
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            pending.append(pool.submit(read_and_decode, str(path)))
+            if len(pending) >= 2 * batch_size:
+                flush_batch([pending.popleft() for _ in range(batch_size)])
+        
+        while pending:
+            flush_batch([pending.popleft() for _ in range(min(batch_size, len(pending)))])
+    
+    dim = vectors[0].shape[1] if vectors else 0
+    return (np.concatenate(vectors) if vectors else np.empty((0, dim), dtype=np.float32)), infos
+
+
+def cmd_build(args):
+    config = Config()
+    start = time.time()
+    out_dir = config.DATA_DIR / args.type
+    flat_path = out_dir / config.FAISS_INDEX_FILES["flat"]
+    idmap_path = out_dir / "id_map.json"
+    manifest_path = out_dir / MANIFEST_NAME
+    
+    files = scan_labelled_folder(Path(args.images))
+    if not files:
+        raise FileNotFoundError(f"No images under {args.images}/<breed>/")
+    
+    # Previous build, trusted only if it produced the index that is on disk now
+    manifest = load_manifest(manifest_path)
+    signature = embedder_signature(config)
+    previous = {}
+    if args.full:
+        print("[Build] --full given, re-embedding everything", file=sys.stderr)
+    elif not manifest:
+        print(f"[Build] No {MANIFEST_NAME} in {out_dir}, building from scratch", file=sys.stderr)
+    elif manifest.get("embedder") != signature:
+        print("[Build] Model settings changed since the last build, re-embedding everything", file=sys.stderr)
+    elif not flat_path.exists() or manifest.get("index_stamp") != file_stamp(flat_path):
+        print(f"[Build] {flat_path.name} was replaced outside this tool, re-embedding everything", file=sys.stderr)
+    else:
+        previous = manifest["files"]
+    
+    # Reuse by path when size+mtime match, else by content hash (so renames and
+    # moves between breed folders only relabel), else embed. Files the last
+    # build skipped for having no pet stay skipped only under --no-pet skip.
+    if args.no_pet != "skip":
+        previous = {rel: entry for rel, entry in previous.items() if not entry.get("skipped")}
+    by_hash = {entry["sha256"]: entry for entry in previous.values()}
+    reuse, to_embed = {}, []
+    untouched = 0
+    for rel, (breed, path, size, mtime_ns) in files.items():
+        old = previous.get(rel)
+        if old and old["size"] == size and old["mtime_ns"] == mtime_ns:
+            reuse[rel] = old
+            untouched += 1
+            continue
+        if previous:
+            old = by_hash.get(file_sha256(path))
+            if old:
+                reuse[rel] = old
+                continue
+        to_embed.append(rel)
+    
+    kept = {entry["sha256"] for entry in reuse.values()}
+    removed = sum(entry["sha256"] not in kept for entry in previous.values())
+    summary = {"type": args.type, "images": len(files), "reused": len(reuse), "embedded": len(to_embed),
+               "removed": removed}
+    if args.dry_run:
+        print(json.dumps({"success": True, "dry_run": True, **summary}))
+        return
+    
+    if untouched == len(files) == len(previous):
+        print(json.dumps({"success": True, "unchanged": True, **summary}))
+        return
+    
+    # Embed only the delta
+    embed_start = time.time()
+    new_vectors, new_infos = np.empty((0, 0), dtype=np.float32), []
+    if to_embed:
+        detector = BreedDetector()
+        new_vectors, new_infos = embed_files(detector, [files[rel][1] for rel in to_embed],
+                                             args.batch_size, args.workers, args.no_pet)
+    embed_s = time.time() - embed_start
+    
+    has_rows = any("row" in entry for entry in reuse.values())
+    old_vectors = index_vectors(faiss.read_index(str(flat_path))) if has_rows else None
+    dim = old_vectors.shape[1] if old_vectors is not None else new_vectors.shape[1]
+    
+    # Assemble in path order so the same folder always yields the same ids
+    fresh = {}
+    row = 0
+    for rel, info in zip(to_embed, new_infos):
+        fresh[rel] = (None if info.get("skipped") else row, info)
+        row += not info.get("skipped")
+    
+    vectors, id_map, manifest_files = [], [], {}
+    for rel, (breed, path, size, mtime_ns) in files.items():
+        entry = reuse.get(rel) or fresh[rel][1]
+        if entry.get("skipped"):
+            # No pet found and --no-pet skip: remembered by hash, but no row
+            manifest_files[rel] = {"sha256": entry["sha256"], "size": size, "mtime_ns": mtime_ns, "skipped": True}
+            continue
+        if rel in reuse:
+            old = reuse[rel]
+            vectors.append(old_vectors[old["row"]])
+            sha = old["sha256"]
+            extra = {k: old[k] for k in ("bbox", "det_conf") if k in old}
+        else:
+            new_row, info = fresh[rel]
+            vectors.append(new_vectors[new_row])
+            sha = info["sha256"]
+            extra = {k: info[k] for k in ("bbox", "det_conf") if k in info}
+        
+        manifest_files[rel] = {"row": len(id_map), "sha256": sha, "size": size, "mtime_ns": mtime_ns, **extra}
+        id_map.append({"breed": breed, "src_path": rel, "crop_path": "", **extra})
+    
+    vectors = np.ascontiguousarray(np.stack(vectors) if vectors else np.empty((0, dim)), dtype=np.float32)
+    index = build_variant(vectors, "flat")
+    
+    # Stage every file first, then swap them in back to back so a reader never
+    # pairs a new index with an old id_map for longer than a few renames.
+    # Existing ANN variants are rebuilt too, since their ids would no longer line up.
+    staged = []
+    out_dir.mkdir(parents=True, exist_ok=True)
+    
+    def stage(path: Path, write):
+        tmp = path.with_name(path.name + ".tmp")
+        write(tmp)
+        staged.append((tmp, path))
+    
+    variants = [v for v in ("ivf_flat", "ivf_pq", "hnsw", "pca")
+                if (out_dir / config.FAISS_INDEX_FILES[v]).exists()]
+    for variant in variants:
+        params = reduced_params(load_index(args.type, variant)) if variant == "pca" else {}
+        variant_index = build_variant(vectors, variant, **params)
+        stage(out_dir / config.FAISS_INDEX_FILES[variant], lambda p, ix=variant_index: faiss.write_index(ix, str(p)))
+    stage(flat_path, lambda p: faiss.write_index(index, str(p)))
+    npy_path = out_dir / config.NUMPY_INDEX_FILE
+    if npy_path.exists():
+        stage(npy_path, lambda p: save_npy(p, vectors))
+    stage(idmap_path, lambda p: p.write_text(json.dumps(id_map, ensure_ascii=False), encoding='utf-8'))
+    
+    for tmp, path in staged:
+        os.replace(tmp, path)
+    
+    # Prototypes are stamped with the files just swapped in, so they come after them
+    prototypes_path = out_dir / config.PROTOTYPE_FILE
+    if prototypes_path.exists():
+        with np.load(prototypes_path) as data:
+            per_breed = int(data["per_breed"]) if "per_breed" in data else 3
+        labels = load_labels(args.type)
+        write_prototypes(args.type, vectors, labels, prototype_ids(vectors, labels, per_breed), per_breed)
+    
+    # The manifest goes last and pins the index it describes
+    manifest = {"format": MANIFEST_FORMAT, "embedder": signature, "index_stamp": file_stamp(flat_path),
+                "files": manifest_files}
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest), encoding='utf-8')
+    os.replace(tmp, manifest_path)
+    
+    print(json.dumps({
+        "success": True,
+        **summary,
+        "no_pet": sum("bbox" not in info for info in new_infos),
+        "ntotal": index.ntotal,
+        "variants_rebuilt": variants,
+        "prototypes_rebuilt": prototypes_path.exists(),
+        "embed_s": round(embed_s, 2),
+        "total_s": round(time.time() - start, 2)
+    }))
+
+
+# ============================================================================
+# CLI INTERFACE
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='PawVerse Breed Index Tools')
+    parser.add_argument('--data-dir', help='Database root with dog/ and cat/ (default: Services/DetectBreed)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    
+    convert = sub.add_parser('convert', help='Build an ANN variant from the flat index')
+    convert.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    convert.add_argument('--variant', required=True, choices=['ivf_flat', 'ivf_pq', 'hnsw', 'pca'])
+    convert.add_argument('--nlist', type=int, help='IVF lists (default ~4*sqrt(N))')
+    convert.add_argument('--pq-m', type=int, default=64, help='IVF-PQ sub-quantizers (must divide D)')
+    convert.add_argument('--pq-nbits', type=int, default=8, help='IVF-PQ bits per sub-quantizer')
+    convert.add_argument('--hnsw-m', type=int, default=32, help='HNSW neighbours per node')
+    convert.add_argument('--ef-construction', type=int, default=200, help='HNSW build-time candidate list size')
+    convert.add_argument('--pca-dim', type=int, default=128, help='PCA: reduced dimension')
+    convert.add_argument('--codec', default='fp16', choices=list(REDUCED_CODECS),
+                         help='PCA: storage of the reduced vectors')
+    convert.add_argument('--whiten', action='store_true', help='PCA: whiten and re-normalize the reduced vectors')
+    convert.set_defaults(func=cmd_convert)
+    
+    bench = sub.add_parser('bench', help='Compare ANN variants against the flat baseline')
+    bench.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    bench.add_argument('--variant', nargs='*', default=[], choices=['ivf_flat', 'ivf_pq', 'hnsw', 'pca'])
+    bench.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64], help='IVF nprobe sweep')
+    bench.add_argument('--ef-search', type=int, nargs='+', default=[64, 128, 256], help='HNSW efSearch sweep')
+    bench.add_argument('--pca-dims', type=int, nargs='*', default=[],
+                       help='PCA-reduced stores to build and compare')
+    bench.add_argument('--codecs', nargs='+', default=['fp16'], choices=list(REDUCED_CODECS),
+                       help='Storage of the reduced vectors (with --pca-dims)')
+    bench.add_argument('--whiten', action='store_true', help='Whiten the reduced vectors (with --pca-dims)')
+    bench.add_argument('--queries', type=int, default=1000, help='Reference vectors used as held-out queries')
+    bench.add_argument('--k', type=int, default=50, help='Neighbours per query (the service uses 50)')
+    bench.add_argument('--seed', type=int, default=0)
+    bench.set_defaults(func=cmd_bench)
+    
+    prototypes = sub.add_parser('prototypes', help='Build per-breed prototypes and sweep the fallback margin')
+    prototypes.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    prototypes.add_argument('--per-breed', type=int, default=3, help='k-means medoids kept per breed')
+    prototypes.add_argument('--margins', type=float, nargs='+', default=[0.0, 0.01, 0.02, 0.05, 0.1],
+                            help='Top-1/top-2 margins to report (PROTOTYPE_MARGIN candidates)')
+    prototypes.add_argument('--queries', type=int, default=1000, help='Reference vectors used as held-out queries')
+    prototypes.add_argument('--k', type=int, default=50, help='Neighbours of the full search (the service uses 50)')
+    prototypes.add_argument('--seed', type=int, default=0)
+    prototypes.set_defaults(func=cmd_prototypes)
+    
+    memory = sub.add_parser('memory', help='Private RSS of one worker: heap read vs mmap')
+    memory.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    memory.add_argument('--variant', default='flat', choices=['flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'pca'])
+    memory.set_defaults(func=cmd_memory)
+    
+    export_npy = sub.add_parser('export-npy', help='Write the flat index as a .npy for --search-backend numpy')
+    export_npy.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    export_npy.set_defaults(func=cmd_export_npy)
+    
+    bench_numpy = sub.add_parser('bench-numpy', help='NumPy search engine vs IndexFlatIP across corpus sizes')
+    bench_numpy.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    bench_numpy.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000, 100000],
+                             help='Corpus sizes (prefixes of the flat index, capped at its size)')
+    bench_numpy.add_argument('--block-size', type=int, default=16384, help='Rows per NumPy matmul block')
+    bench_numpy.add_argument('--queries', type=int, default=1000, help='Reference vectors used as queries')
+    bench_numpy.add_argument('--k', type=int, default=50, help='Neighbours per query (the service uses 50)')
+    bench_numpy.add_argument('--max-sim-diff', type=float, default=1e-5,
+                             help='Largest per-slot similarity difference accepted as identical')
+    bench_numpy.add_argument('--seed', type=int, default=0)
+    bench_numpy.set_defaults(func=cmd_bench_numpy)
+    
+    build = sub.add_parser('build', help='Embed a labelled image folder into the flat index (incremental)')
+    build.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Animal type')
+    build.add_argument('--images', required=True, help='Dataset root laid out as <root>/<breed label>/*.jpg')
+    build.add_argument('--batch-size', type=int, default=32, help='Images per YOLO/CLIP batch')
+    build.add_argument('--workers', type=int, default=4, help='Decode threads')
+    build.add_argument('--no-pet', default='full', choices=['full', 'skip'],
+                       help='Images where YOLO finds no pet: embed the whole image, or leave them out')
+    build.add_argument('--full', action='store_true', help='Ignore the manifest and re-embed everything')
+    build.add_argument('--dry-run', action='store_true', help='Only report how many images would be embedded')
+    build.set_defaults(func=cmd_build)
+    
+    args = parser.parse_args()
+    if args.data_dir:
+        Config().DATA_DIR = Path(args.data_dir)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,760 @@
+#!/usr/bin/env python3
+"""
+PawVerse Breed Model Tools
+Export and verification utilities for the models behind breed_detection.py.
+
+    python breed_model_tools.py export-onnx
+    python breed_model_tools.py check-onnx --images samples/*.jpg
+    python breed_model_tools.py quantize-onnx --mode static --type dog --image-root crops/
+    python breed_model_tools.py check-quant --backend torch --type dog --image-root crops/
+    python breed_model_tools.py check-optimized --type dog --image-root crops/
+    python breed_model_tools.py check-preprocess --images samples/*.jpg
+    python breed_model_tools.py check-startup --max-init-s 20 -- --backend onnx
+    python breed_model_tools.py check-gate --type dog --images samples/ --threshold 0.9
+"""
+
+import argparse
+import copy
+import json
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from breed_detection import (BreedDetector, ClipBatchPreprocessor, Config, ModelManager, OnnxClipEncoder,
+                             OnnxYoloDetector, cpu_supports_bf16, decode_image, iter_input_dir, optimize_clip_visual,
+                             quantize_clip_dynamic)
+from breed_index_tools import load_index, load_labels, search_leave_one_out
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def torch_models() -> ModelManager:
+    """Load the reference PyTorch models on CPU in FP32."""
+    config = Config()
+    config.BACKEND = "torch"
+    config.device = "cpu"
+    config.use_fp16 = False
+    return ModelManager()
+
+
+def sample_images(paths: list, count: int = 8, seed: int = 0) -> list:
+    """Decode the given images, or make synthetic ones (embedding parity only, no pets)."""
+    if paths:
+        return [decode_image(p, Config().DECODE_MAX_SIDE) for p in paths]
+    
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        h, w = 300 + 40 * i, 420 - 20 * i
+        gradient = np.linspace(0, 255, w, dtype=np.float32)[None, :, None]
+        noise = rng.normal(0, 40, (h, w, 3))
+        images.append(Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8)))
+    return images
+
+
+def index_sample_images(animal_type: str, count: int, image_root: str = None, seed: int = 0):
+    """
+    Random index entries whose crop (or source) image can be found, as (ids, images).
+    id_map paths are from the machine that built the index, so with image_root
+    they are looked up by file name under that directory instead.
+    """
+    labels = load_labels(animal_type)
+    rng = np.random.default_rng(seed)
+    ids, images = [], []
+    
+    for idx in rng.permutation(len(labels.codes)):
+        entry = labels.entry(int(idx))
+        for key in ("crop_path", "src_path"):
+            if not entry.get(key):
+                continue
+            path = Path(entry[key])
+            if image_root:
+                path = Path(image_root) / path.name
+            if path.exists():
+                ids.append(int(idx))
+                images.append(decode_image(path, Config().DECODE_MAX_SIDE))
+                break
+        if len(ids) == count:
+            break
+    
+    return np.array(ids, dtype=np.int64), images
+
+
+def box_iou(a: list, b: list) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def embedding_drift(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """Cosine and absolute differences between two (N, D) L2-normalised embedding sets."""
+    cosine = np.sum(reference * candidate, axis=1)
+    return {
+        "min_cosine": round(float(cosine.min()), 6),
+        "mean_cosine": round(float(cosine.mean()), 6),
+        "max_abs_diff": round(float(np.abs(reference - candidate).max()), 6)
+    }
+
+
+# ============================================================================
+# ONNX EXPORT + PARITY
+# ============================================================================
+
+class ClipVisual(torch.nn.Module):
+    """encode_image as a plain forward() for export."""
+    
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+    
+    def forward(self, image):
+        return self.clip_model.encode_image(image)
+
+
+def cmd_export_onnx(args):
+    config = Config()
+    models = torch_models()
+    yolo_path, clip_path = models.onnx_paths()
+    config.ONNX_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # CLIP visual tower, dynamic batch
+    start = time.time()
+    cfg = getattr(models.clip_model.visual, "preprocess_cfg", {})
+    size = int(np.atleast_1d(cfg.get("size", 224))[0])
+    torch.onnx.export(
+        ClipVisual(models.clip_model).eval(),
+        torch.zeros(1, 3, size, size),
+        str(clip_path),
+        input_names=["image"],
+        output_names=["embedding"],
+        dynamic_axes={"image": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=args.opset,
+        dynamo=False
+    )
+    
+    meta = {
+        "clip_model": config.CLIP_MODEL,
+        "pretrained": config.CLIP_PRETRAIN,
+        "image_size": size,
+        "mean": list(cfg.get("mean", models.clip_model.visual.image_mean)),
+        "std": list(cfg.get("std", models.clip_model.visual.image_std)),
+        "interpolation": cfg.get("interpolation", "bicubic"),
+        "resize_mode": cfg.get("resize_mode", "shortest")
+    }
+    with open(clip_path.with_suffix(".json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"[Export] CLIP visual -> {clip_path} ({time.time() - start:.1f}s)", file=sys.stderr)
+    
+    # YOLO (ultralytics writes next to the weights; dynamic batch/size)
+    start = time.time()
+    exported = models.yolo.export(format="onnx", imgsz=640, dynamic=True, simplify=False, opset=args.opset)
+    shutil.move(str(exported), str(yolo_path))
+    print(f"[Export] YOLO -> {yolo_path} ({time.time() - start:.1f}s)", file=sys.stderr)
+    
+    print(json.dumps({"success": True, "yolo": str(yolo_path), "clip": str(clip_path)}))
+
+
+def cmd_check_onnx(args):
+    """Parity gate: exits 1 when ONNX embeddings drift from torch beyond --tolerance."""
+    import onnxruntime as ort
+    
+    models = torch_models()
+    detector = BreedDetector()
+    yolo_path, clip_path = models.onnx_paths()
+    options = ort.SessionOptions()
+    encoder = OnnxClipEncoder(clip_path, options)
+    yolo = OnnxYoloDetector(yolo_path, options)
+    
+    images = sample_images(args.images)
+    
+    # One preprocessed batch for both encoders, so the gate measures torch vs ONNX only
+    # (not the batched preprocessing vs the per-image one)
+    batch = detector.preprocess_images(images)
+    
+    start = time.perf_counter()
+    reference = detector.encode_batch(batch)
+    torch_ms = (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    candidate = encoder.encode_image(batch.float().cpu().numpy())
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+    onnx_ms = (time.perf_counter() - start) * 1000
+    
+    drift = embedding_drift(reference, candidate)
+    
+    # Best box per image from each backend
+    ious, class_matches, compared = [], 0, 0
+    onnx_raw = yolo.predict(images, Config().YOLO_CONF, Config().YOLO_IOU, Config().YOLO_CLASSES)
+    for (bbox, _, cls), (xyxy, confs, classes) in zip(detector.detect_animals(images), onnx_raw):
+        if bbox is None or len(confs) == 0:
+            continue
+        best = int(np.argmax(confs))
+        ious.append(box_iou(bbox, xyxy[best].astype(int).tolist()))
+        class_matches += int(classes[best]) == cls
+        compared += 1
+    
+    passed = drift["min_cosine"] >= 1 - args.tolerance
+    print(json.dumps({
+        "success": passed,
+        "images": len(images),
+        "tolerance": args.tolerance,
+        **drift,
+        "clip_ms": {"torch": round(torch_ms, 1), "onnx": round(onnx_ms, 1)},
+        "detections_compared": compared,
+        "box_iou_min": round(min(ious), 4) if ious else None,
+        "class_agreement": round(class_matches / compared, 4) if compared else None
+    }, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+# ============================================================================
+# INT8 CLIP (quantization + accuracy regression)
+# ============================================================================
+
+def calibration_images(args) -> list:
+    """Index crops when they can be found, otherwise --images / synthetic samples."""
+    _, images = index_sample_images(args.type, args.samples, args.image_root, args.seed)
+    if not images:
+        print(f"[Quant] No {args.type} index images found, using --images", file=sys.stderr)
+        images = sample_images(args.images, args.samples, args.seed)
+    return images
+
+
+class CalibrationReader:
+    """onnxruntime CalibrationDataReader over preprocessed images."""
+    
+    def __init__(self, encoder: OnnxClipEncoder, images: list, batch_size: int = 8):
+        self.input_name = encoder.input_name
+        self.batches = iter([np.stack([encoder.preprocess(img) for img in images[i:i + batch_size]])
+                             for i in range(0, len(images), batch_size)])
+    
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+
+def cmd_quantize_onnx(args):
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    import onnxruntime as ort
+    
+    config = Config()
+    config.CLIP_QUANTIZE = None
+    _, fp32_path = ModelManager.onnx_paths()
+    config.CLIP_QUANTIZE = args.mode
+    _, int8_path = ModelManager.onnx_paths()
+    if not fp32_path.exists():
+        raise FileNotFoundError(f"ONNX model not found: {fp32_path} (run export-onnx first)")
+    
+    start = time.time()
+    if args.mode == "dynamic":
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    else:
+        encoder = OnnxClipEncoder(fp32_path, ort.SessionOptions())
+        images = calibration_images(args)
+        # One image per calibration run: the augmented graph keeps every activation alive
+        quantize_static(str(fp32_path), str(int8_path), CalibrationReader(encoder, images, batch_size=1),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    
+    with open(fp32_path.with_suffix(".json"), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    meta["quantization"] = args.mode
+    with open(int8_path.with_suffix(".json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    
+    print(json.dumps({
+        "success": True,
+        "mode": args.mode,
+        "path": str(int8_path),
+        "build_s": round(time.time() - start, 1),
+        "size_mb": {"fp32": round(fp32_path.stat().st_size / 2**20, 1),
+                    "int8": round(int8_path.stat().st_size / 2**20, 1)}
+    }))
+
+
+def clip_encoders(backend: str, mode: str):
+    """(fp32, int8) callables mapping a list of PIL images to L2-normalised (N, D) embeddings."""
+    if backend == "onnx":
+        import onnxruntime as ort
+        
+        config = Config()
+        encoders = []
+        for quantize in (None, mode):
+            config.CLIP_QUANTIZE = quantize
+            encoders.append(OnnxClipEncoder(ModelManager.onnx_paths()[1], ort.SessionOptions()))
+        config.CLIP_QUANTIZE = None
+        
+        def run(encoder):
+            def encode(images):
+                features = encoder.encode_image(np.stack([encoder.preprocess(img) for img in images]))
+                return features / np.linalg.norm(features, axis=1, keepdims=True)
+            return encode
+        return run(encoders[0]), run(encoders[1])
+    
+    if mode != "dynamic":
+        raise ValueError("torch backend only supports --mode dynamic (use --backend onnx for static)")
+    
+    models = torch_models()
+    fp32 = models.clip_model
+    int8 = quantize_clip_dynamic(copy.deepcopy(fp32))
+    
+    def run(model):
+        @torch.no_grad()
+        def encode(images):
+            features = model.encode_image(torch.stack([models.preprocess(img) for img in images]))
+            return torch.nn.functional.normalize(features, dim=-1).numpy()
+        return encode
+    return run(fp32), run(int8)
+
+
+def timed_embeddings(encode, images: list, batch_size: int):
+    """Embeddings for all images plus the mean milliseconds per image (one warm-up batch excluded)."""
+    encode(images[:batch_size])
+    start = time.perf_counter()
+    embeddings = np.concatenate([encode(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+    return embeddings.astype(np.float32), (time.perf_counter() - start) * 1000 / len(images)
+
+
+def top_breed_codes(labels, index, vectors: np.ndarray, ids: np.ndarray, k: int, top_n: int) -> np.ndarray:
+    """(N, top_n) breed codes by weighted vote, never letting a sample vote for its own index entry."""
+    sims, idxs = search_leave_one_out(index, np.ascontiguousarray(vectors), ids, k)
+    scores = labels.breed_scores(sims, idxs)
+    return np.argsort(-scores, axis=1, kind='stable')[:, :top_n]
+
+
+def breed_agreement(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    overlap = [len(set(r) & set(c)) / len(r) for r, c in zip(reference.tolist(), candidate.tolist())]
+    return {
+        "top1": round(float(np.mean(reference[:, 0] == candidate[:, 0])), 4),
+        f"top{reference.shape[1]}_overlap": round(float(np.mean(overlap)), 4)
+    }
+
+
+def cmd_check_quant(args):
+    """Regression gate: exits 1 when INT8 embeddings drift or breed rankings change beyond the limits."""
+    fp32_encode, int8_encode = clip_encoders(args.backend, args.mode)
+    
+    ids, images = index_sample_images(args.type, args.samples, args.image_root, args.seed)
+    if len(ids):
+        # Reference = the fp32 vectors stored in the index for those same crops
+        index = load_index(args.type, "flat")
+        reference = np.stack([index.reconstruct(int(i)) for i in ids])
+    else:
+        print(f"[Quant] No {args.type} index images found; comparing against live fp32 on --images",
+              file=sys.stderr)
+        index = load_index(args.type, "flat")
+        images = sample_images(args.images, args.samples, args.seed)
+        reference = None
+        ids = np.full(len(images), -1, dtype=np.int64)
+    
+    fp32, fp32_ms = timed_embeddings(fp32_encode, images, args.batch_size)
+    int8, int8_ms = timed_embeddings(int8_encode, images, args.batch_size)
+    if reference is None:
+        reference = fp32
+    
+    labels = load_labels(args.type)
+    ref_codes = top_breed_codes(labels, index, reference, ids, args.k, args.top_n)
+    fp32_agreement = breed_agreement(ref_codes, top_breed_codes(labels, index, fp32, ids, args.k, args.top_n))
+    int8_agreement = breed_agreement(ref_codes, top_breed_codes(labels, index, int8, ids, args.k, args.top_n))
+    
+    int8_drift = embedding_drift(reference, int8)
+    overlap_key = f"top{args.top_n}_overlap"
+    passed = int8_drift["min_cosine"] >= args.min_cosine and int8_agreement[overlap_key] >= args.min_agreement
+    
+    print(json.dumps({
+        "success": bool(passed),
+        "backend": args.backend,
+        "mode": args.mode,
+        "type": args.type,
+        "samples": len(images),
+        "reference": "index" if ids[0] >= 0 else "live_fp32",
+        "ms_per_image": {"fp32": round(fp32_ms, 2), "int8": round(int8_ms, 2)},
+        "speedup": round(fp32_ms / int8_ms, 2),
+        "drift": {"fp32": embedding_drift(reference, fp32), "int8": int8_drift,
+                  "int8_vs_fp32": embedding_drift(fp32, int8)},
+        "breed_agreement": {"fp32": fp32_agreement, "int8": int8_agreement},
+        "limits": {"min_cosine": args.min_cosine, f"min_{overlap_key}": args.min_agreement}
+    }, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+# ============================================================================
+# OPTIMIZED TORCH EXECUTION (bf16 / TorchScript / torch.compile vs eager fp32)
+# ============================================================================
+
+def cmd_check_optimized(args):
+    """
+    Regression gate for --optimize: exits 1 when the optimized CLIP encoder's
+    embeddings drift from the index or its breed rankings change beyond the
+    limits. Also reports the first-batch cost that --warmup moves to startup.
+    """
+    models = torch_models()
+    eager = models.clip_model
+    optimized = copy.deepcopy(eager)
+    
+    precision = "fp32"
+    if args.bf16:
+        if cpu_supports_bf16():
+            optimized, precision = optimized.to(torch.bfloat16), "bf16"
+        else:
+            print("[Optimize] No native BF16 on this CPU, checking FP32", file=sys.stderr)
+    if args.compile != "none":
+        optimized = optimize_clip_visual(optimized, args.compile, "cpu", ModelManager.compiled_clip_path(precision))
+    
+    def run(model, dtype):
+        @torch.inference_mode()
+        def encode(images):
+            batch = torch.stack([models.preprocess(img) for img in images]).to(dtype)
+            return torch.nn.functional.normalize(model.encode_image(batch).float(), dim=-1).numpy()
+        return encode
+    eager_encode = run(eager, torch.float32)
+    optimized_encode = run(optimized, torch.bfloat16 if precision == "bf16" else torch.float32)
+    
+    ids, images = index_sample_images(args.type, args.samples, args.image_root, args.seed)
+    if len(ids):
+        index = load_index(args.type, "flat")
+        reference = np.stack([index.reconstruct(int(i)) for i in ids])
+    else:
+        print(f"[Optimize] No {args.type} index images found; comparing against live fp32 on --images",
+              file=sys.stderr)
+        index = load_index(args.type, "flat")
+        images = sample_images(args.images, args.samples, args.seed)
+        reference = None
+        ids = np.full(len(images), -1, dtype=np.int64)
+    
+    first_batch_ms = {}
+    for name, encode in (("eager", eager_encode), ("optimized", optimized_encode)):
+        start = time.perf_counter()
+        encode(images[:args.batch_size])
+        first_batch_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+    
+    fp32, fp32_ms = timed_embeddings(eager_encode, images, args.batch_size)
+    fast, fast_ms = timed_embeddings(optimized_encode, images, args.batch_size)
+    if reference is None:
+        reference = fp32
+    
+    labels = load_labels(args.type)
+    ref_codes = top_breed_codes(labels, index, reference, ids, args.k, args.top_n)
+    fp32_agreement = breed_agreement(ref_codes, top_breed_codes(labels, index, fp32, ids, args.k, args.top_n))
+    fast_agreement = breed_agreement(ref_codes, top_breed_codes(labels, index, fast, ids, args.k, args.top_n))
+    
+    fast_drift = embedding_drift(reference, fast)
+    overlap_key = f"top{args.top_n}_overlap"
+    passed = fast_drift["min_cosine"] >= args.min_cosine and fast_agreement[overlap_key] >= args.min_agreement
+    
+    print(json.dumps({
+        "success": bool(passed),
+        "precision": precision,
+        "compile": args.compile,
+        "type": args.type,
+        "samples": len(images),
+        "reference": "index" if ids[0] >= 0 else "live_fp32",
+        "first_batch_ms": first_batch_ms,
+        "ms_per_image": {"eager": round(fp32_ms, 2), "optimized": round(fast_ms, 2)},
+        "speedup": round(fp32_ms / fast_ms, 2),
+        "drift": {"eager": embedding_drift(reference, fp32), "optimized": fast_drift,
+                  "optimized_vs_eager": embedding_drift(fp32, fast)},
+        "breed_agreement": {"eager": fp32_agreement, "optimized": fast_agreement},
+        "limits": {"min_cosine": args.min_cosine, f"min_{overlap_key}": args.min_agreement}
+    }, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+# ============================================================================
+# BATCH PREPROCESSING (equivalence with the open_clip transform)
+# ============================================================================
+
+def preprocess_cases(images: list) -> list:
+    """The given images plus shapes that stress the crop math: strips, smaller than the input, L, RGBA."""
+    base = images[0]
+    w, h = base.size
+    return images + [
+        base.crop((0, 0, max(1, w // 3), h)),
+        base.crop((0, 0, w, max(1, h // 4))),
+        base.resize((57, 43)),
+        base.convert('L'),
+        base.convert('RGBA')
+    ]
+
+
+def cmd_check_preprocess(args):
+    """Exits 1 when ClipBatchPreprocessor's input or embeddings drift from the open_clip transform's."""
+    models = torch_models()
+    batched = ClipBatchPreprocessor.from_config(getattr(models.clip_model.visual, "preprocess_cfg", None))
+    if batched is None:
+        print(json.dumps({"success": False, "error": "CLIP preprocess config not supported by the batch path"}))
+        sys.exit(1)
+    
+    images = preprocess_cases(sample_images(args.images, args.samples, args.seed))
+    
+    def reference_batch(chunk):
+        return torch.stack([models.preprocess(img) for img in chunk]).numpy()
+    
+    def batched_batch(chunk):
+        return batched(chunk).copy()
+    
+    timings, inputs = {}, {}
+    for name, run in (("open_clip", reference_batch), ("batched", batched_batch)):
+        run(images[:args.batch_size])
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out = np.concatenate([run(images[i:i + args.batch_size])
+                                  for i in range(0, len(images), args.batch_size)])
+        timings[name] = (time.perf_counter() - start) * 1000 / (args.repeat * len(images))
+        inputs[name] = out
+    
+    # Differences in units of one 8-bit level of the source pixels (rounded off float noise)
+    levels = np.abs(inputs["open_clip"] - inputs["batched"]) / batched.scale
+    max_level = round(float(levels.max()), 3)
+    
+    with torch.no_grad():
+        embeddings = [torch.nn.functional.normalize(models.clip_model.encode_image(torch.from_numpy(inputs[name])),
+                                                    dim=-1).numpy() for name in ("open_clip", "batched")]
+    drift = embedding_drift(*embeddings)
+    
+    passed = max_level <= args.max_levels and drift["min_cosine"] >= args.min_cosine
+    print(json.dumps({
+        "success": bool(passed),
+        "images": len(images),
+        "ms_per_image": {name: round(ms, 3) for name, ms in timings.items()},
+        "speedup": round(timings["open_clip"] / timings["batched"], 2),
+        "pixel_levels": {"max": max_level, "mean": round(float(levels.mean()), 5),
+                         "share_differing": round(float(np.mean(levels > 0.5)), 5)},
+        "embedding_drift": drift,
+        "limits": {"max_levels": args.max_levels, "min_cosine": args.min_cosine}
+    }, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+# ============================================================================
+# COLD START
+# ============================================================================
+
+HEAVY_MODULES = ("torch", "faiss", "open_clip", "ultralytics", "onnxruntime")
+
+IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import breed_detection\n"
+    "print(json.dumps({'import_ms': (time.perf_counter() - start) * 1000,\n"
+    "                  'heavy': [m for m in %r if m in sys.modules]}))\n" % (HEAVY_MODULES,)
+)
+
+
+def run_fresh(argv: list, cwd: Path):
+    """Run argv in a new interpreter. Returns (wall ms, completed process)."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, *argv], cwd=cwd, capture_output=True, text=True)
+    return (time.perf_counter() - start) * 1000, proc
+
+
+def child_json(proc):
+    """Last stdout line of a finished child as JSON, or None when it crashed or printed something else."""
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return None
+    try:
+        return json.loads(lines[-1])
+    except ValueError:
+        return None
+
+
+def child_failure(proc) -> str:
+    """Exit code and stderr tail of a child that didn't answer."""
+    tail = (proc.stderr.strip() or proc.stdout.strip())[-500:]
+    return f"exit code {proc.returncode}: {tail or 'no output'}"
+
+
+def cmd_check_startup(args):
+    """Cold-start gate: exits 1 when importing or initializing breed_detection.py exceeds the bounds."""
+    script = Path(__file__).with_name("breed_detection.py")
+    failures = []
+    
+    # Importing the module must not pull in the heavy stacks
+    _, proc = run_fresh(["-c", IMPORT_PROBE], script.parent)
+    probe = child_json(proc)
+    if probe is None:
+        failures.append(f"import probe failed, {child_failure(proc)}")
+    elif probe["heavy"]:
+        failures.append(f"import loads {', '.join(probe['heavy'])}")
+    if probe is not None and probe["import_ms"] > args.max_import_ms:
+        failures.append(f"import took {probe['import_ms']:.0f} ms > {args.max_import_ms:.0f} ms")
+    
+    # A usage error is answered without loading anything
+    usage_ms, _ = run_fresh([str(script)], script.parent)
+    if usage_ms > args.max_usage_ms:
+        failures.append(f"usage error took {usage_ms:.0f} ms > {args.max_usage_ms:.0f} ms")
+    
+    # Full cold start: interpreter + imports + model loads
+    init_args = [a for a in args.init_args if a != "--"]
+    init_ms, proc = run_fresh([str(script), "--init-only", "--profile-startup", *init_args], script.parent)
+    init = child_json(proc) or {"success": False, "error": child_failure(proc)}
+    if not init.get("success"):
+        failures.append(f"--init-only failed: {init.get('error')}")
+    elif init_ms > args.max_init_s * 1000:
+        failures.append(f"--init-only took {init_ms / 1000:.1f} s > {args.max_init_s:.1f} s")
+    
+    print(json.dumps({
+        "success": not failures,
+        "failures": failures,
+        "import_ms": round(probe["import_ms"], 1) if probe else None,
+        "heavy_on_import": probe["heavy"] if probe else None,
+        "usage_error_ms": round(usage_ms, 1),
+        "init_ms": round(init_ms, 1),
+        "init_args": init_args,
+        "startup": init.get("startup"),
+        "limits": {"max_import_ms": args.max_import_ms, "max_usage_ms": args.max_usage_ms,
+                   "max_init_s": args.max_init_s}
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+# ============================================================================
+# SPECIES GATE (fire rate, latency saved, agreement with the YOLO path)
+# ============================================================================
+
+def cmd_check_gate(args):
+    """Gate report: runs every image with and without the CLIP species gate; exits 1 if fired answers diverge."""
+    config = Config()
+    config.BACKEND = args.backend
+    config.RESULT_CACHE_SIZE = 0
+    detector = BreedDetector()
+    
+    paths = []
+    for item in args.images:
+        if Path(item).is_dir():
+            paths.extend(path for _, path in iter_input_dir(item))
+        else:
+            paths.append(item)
+    if not paths:
+        raise FileNotFoundError("No images given (--images files or directories)")
+    
+    def run(gate):
+        config.SPECIES_GATE = gate
+        detector.detect_breed(paths[0], args.type)  # Warm-up (prompt embeddings, first-call overheads)
+        latencies, results = [], []
+        for path in paths:
+            start = time.perf_counter()
+            results.append(detector.detect_breed(path, args.type))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return np.array(latencies), results
+    
+    base_ms, base = run(None)
+    gate_ms, gated = run(args.threshold)
+    
+    # Batches of one: a result without a yolo stage was answered by the gate
+    fired = np.array([r["success"] and "yolo" not in r["metadata"]["stage_ms"] for r in gated])
+    comparable = [i for i in np.flatnonzero(fired) if base[i]["success"]]
+    agreement = np.mean([gated[i]["breed_raw"] == base[i]["breed_raw"] for i in comparable]) if comparable else 1.0
+    passed = agreement >= args.min_agreement
+    
+    print(json.dumps({
+        "success": bool(passed),
+        "type": args.type,
+        "backend": args.backend,
+        "threshold": args.threshold,
+        "images": len(paths),
+        "fire_rate": round(float(fired.mean()), 4),
+        "fired_without_yolo_pet": int(sum(fired[i] and not base[i]["success"] for i in range(len(paths)))),
+        "breed_agreement_fired": round(float(agreement), 4),
+        "latency_ms": {
+            "yolo_mean": round(float(base_ms.mean()), 1),
+            "gate_mean": round(float(gate_ms.mean()), 1),
+            "saved_per_fired": round(float((base_ms - gate_ms)[fired].mean()), 1) if fired.any() else None,
+            "overhead_per_fallback": round(float((gate_ms - base_ms)[~fired].mean()), 1) if (~fired).any() else None
+        },
+        "min_agreement": args.min_agreement
+    }, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+# ============================================================================
+# CLI INTERFACE
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='PawVerse Breed Model Tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    
+    export = sub.add_parser('export-onnx', help='Export YOLO and the CLIP visual tower to Python/models/onnx')
+    export.add_argument('--opset', type=int, default=17)
+    export.set_defaults(func=cmd_export_onnx)
+    
+    check = sub.add_parser('check-onnx', help='Compare ONNX and torch embeddings/boxes (exit 1 on drift)')
+    check.add_argument('--images', nargs='*', default=[], help='Sample images (default: synthetic)')
+    check.add_argument('--tolerance', type=float, default=1e-4, help='Allowed 1 - cosine per image')
+    check.set_defaults(func=cmd_check_onnx)
+    
+    quantize = sub.add_parser('quantize-onnx', help='Write an INT8 copy of the exported CLIP visual graph')
+    quantize.add_argument('--mode', default='dynamic', choices=['dynamic', 'static'])
+    check_quant = sub.add_parser('check-quant', help='INT8 vs fp32 latency, embedding drift and breed agreement '
+                                                     '(exit 1 on regression)')
+    check_quant.add_argument('--backend', default='torch', choices=['torch', 'onnx'])
+    check_quant.add_argument('--mode', default='dynamic', choices=['dynamic', 'static'])
+    check_quant.add_argument('--batch-size', type=int, default=16)
+    check_quant.add_argument('--k', type=int, default=50, help='Neighbours per query (the service uses 50)')
+    check_quant.add_argument('--top-n', type=int, default=5, help='Breed candidates compared per sample')
+    check_quant.add_argument('--min-cosine', type=float, default=0.98, help='Lowest allowed cosine to the reference')
+    check_quant.add_argument('--min-agreement', type=float, default=0.95, help='Lowest allowed mean top-N overlap')
+    check_opt = sub.add_parser('check-optimized', help='bf16 / compiled vs eager fp32 CLIP latency, embedding drift '
+                                                       'and breed agreement (exit 1 on regression)')
+    check_opt.add_argument('--compile', default='script', choices=['none', 'script', 'compile'])
+    check_opt.add_argument('--no-bf16', dest='bf16', action='store_false', help='Keep FP32 weights')
+    check_opt.add_argument('--batch-size', type=int, default=16)
+    check_opt.add_argument('--k', type=int, default=50, help='Neighbours per query (the service uses 50)')
+    check_opt.add_argument('--top-n', type=int, default=5, help='Breed candidates compared per sample')
+    check_opt.add_argument('--min-cosine', type=float, default=0.99, help='Lowest allowed cosine to the reference')
+    check_opt.add_argument('--min-agreement', type=float, default=0.95, help='Lowest allowed mean top-N overlap')
+    for cmd in (quantize, check_quant, check_opt):
+        cmd.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Index whose crops are sampled')
+        cmd.add_argument('--samples', type=int, default=256, help='Index images used (calibration / evaluation)')
+        cmd.add_argument('--image-root', help='Directory holding the id_map crop/src images by file name')
+        cmd.add_argument('--images', nargs='*', default=[], help='Fallback images when no index images are found')
+        cmd.add_argument('--seed', type=int, default=0)
+    quantize.set_defaults(func=cmd_quantize_onnx)
+    check_quant.set_defaults(func=cmd_check_quant)
+    check_opt.set_defaults(func=cmd_check_optimized)
+    
+    check_pre = sub.add_parser('check-preprocess', help='Batched CLIP preprocessing vs the open_clip transform: '
+                                                        'speed and pixel/embedding equivalence (exit 1 on drift)')
+    check_pre.add_argument('--images', nargs='*', default=[], help='Sample images (default: synthetic)')
+    check_pre.add_argument('--samples', type=int, default=8, help='Synthetic images when --images is not given')
+    check_pre.add_argument('--batch-size', type=int, default=16)
+    check_pre.add_argument('--repeat', type=int, default=3, help='Timed passes over the images')
+    check_pre.add_argument('--max-levels', type=float, default=1.0, help='Largest allowed difference in 8-bit levels')
+    check_pre.add_argument('--min-cosine', type=float, default=0.9999, help='Lowest allowed embedding cosine')
+    check_pre.add_argument('--seed', type=int, default=0)
+    check_pre.set_defaults(func=cmd_check_preprocess)
+    
+    startup = sub.add_parser('check-startup', help='Bound cold-start time of breed_detection.py (exit 1 when exceeded)')
+    startup.add_argument('--max-import-ms', type=float, default=1000, help='Module import bound')
+    startup.add_argument('--max-usage-ms', type=float, default=2000, help='Bound for answering a usage error')
+    startup.add_argument('--max-init-s', type=float, default=30, help='Bound for a cold --init-only run')
+    startup.add_argument('init_args', nargs=argparse.REMAINDER, help='Extra breed_detection.py flags after --')
+    startup.set_defaults(func=cmd_check_startup)
+    
+    gate = sub.add_parser('check-gate', help='CLIP species gate fire rate, latency saved and breed agreement with '
+                                             'the YOLO path (exit 1 when fired answers diverge)')
+    gate.add_argument('--images', nargs='+', required=True, help='Image files or directories')
+    gate.add_argument('--type', default='dog', choices=['dog', 'cat'], help='Requested animal type')
+    gate.add_argument('--threshold', type=float, default=0.9, help='SPECIES_GATE probability to evaluate')
+    gate.add_argument('--backend', default='torch', choices=['torch', 'onnx'])
+    gate.add_argument('--min-agreement', type=float, default=0.95, help='Lowest allowed top-1 breed agreement')
+    gate.set_defaults(func=cmd_check_gate)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
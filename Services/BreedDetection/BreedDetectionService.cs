@@ -1,13 +1,16 @@
+using System.Collections.Concurrent;
 using System.Diagnostics;
+using System.IO.MemoryMappedFiles;
 using System.Text;
 using System.Text.Json;
+using System.Text.Json.Nodes;
 using Microsoft.EntityFrameworkCore;
 using PawVerseAPI.Data;
 using PawVerseAPI.Models.DTOs.BreedDetection;
 
 namespace PawVerseAPI.Services.BreedDetection
 {
-    public class BreedDetectionService : IBreedDetectionService
+    public class BreedDetectionService : IBreedDetectionService, IDisposable
     {
         private readonly IConfiguration _configuration;
         private readonly ILogger<BreedDetectionService> _logger;
@@ -17,8 +20,19 @@ namespace PawVerseAPI.Services.BreedDetection
         private readonly string _uploadPath;
         private readonly string _projectRoot;
         private readonly int _timeoutSeconds;
+        private readonly bool _useServerMode;
+        private readonly int _microBatchSize;
+        private readonly int _poolWorkers;
+        private readonly bool _optimizedInference;
+        private readonly int _indexReloadSeconds; // 0 = indexes only change on restart
+        private readonly string _searchBackend; // "faiss" | "numpy"
+        private readonly string _imageTransport; // "memory" | "shm" | "file"
         private bool _isInitialized = false;
-        private readonly SemaphoreSlim _lock = new(1, 1); // Serialize requests
+        private readonly SemaphoreSlim _lock = new(1, 1); // Serialize per-request processes
+        private Process? _serverProcess; // Long-running "--serve" process (models stay loaded)
+        private readonly SemaphoreSlim _serverLock = new(1, 1); // Server (re)start + stdin writes
+        private readonly ConcurrentDictionary<string, (Process Process, TaskCompletionSource<string?> Response)> _pending = new();
+        private long _nextRequestId;
         
         public BreedDetectionService(
             IConfiguration configuration,
@@ -56,12 +70,26 @@ namespace PawVerseAPI.Services.BreedDetection
                 ? uploadPathConfig 
                 : Path.Combine(_projectRoot, uploadPathConfig);
             _timeoutSeconds = int.Parse(_configuration["BreedDetection:ProcessTimeoutSeconds"] ?? "60");
+            _useServerMode = bool.Parse(_configuration["BreedDetection:UseServerMode"] ?? "true");
+            _microBatchSize = int.Parse(_configuration["BreedDetection:MicroBatchSize"] ?? "8");
+            _poolWorkers = int.Parse(_configuration["BreedDetection:PoolWorkers"] ?? "0");
+            _optimizedInference = bool.Parse(_configuration["BreedDetection:OptimizedInference"] ?? "false");
+            _indexReloadSeconds = int.Parse(_configuration["BreedDetection:IndexReloadSeconds"] ?? "30");
+            _searchBackend = (_configuration["BreedDetection:SearchBackend"] ?? "faiss").ToLowerInvariant();
+            _imageTransport = (_configuration["BreedDetection:ImageTransport"] ?? "memory").ToLowerInvariant();
             
             // Log paths for debugging
             _logger.LogInformation("Project Root: {ProjectRoot}", _projectRoot);
             _logger.LogInformation("Script Path: {ScriptPath}", _scriptPath);
             _logger.LogInformation("Python Path: {PythonPath}", _pythonPath);
             
+            // The POSIX shm transport writes under /dev/shm, which macOS (and some containers) lack
+            if (_imageTransport == "shm" && !OperatingSystem.IsWindows() && !Directory.Exists("/dev/shm"))
+            {
+                _logger.LogWarning("ImageTransport 'shm' needs /dev/shm, which this host lacks; using 'memory'");
+                _imageTransport = "memory";
+            }
+            
             // Verify script exists
             if (!File.Exists(_scriptPath))
             {
@@ -78,7 +106,9 @@ namespace PawVerseAPI.Services.BreedDetection
             {
                 _logger.LogInformation("Initializing breed detection models...");
                 
-                var result = await ExecutePythonAsync("--init-only", timeout: 120000); // 2 min
+                var result = _useServerMode
+                    ? await StartServerProcessAsync(timeout: 120000) // 2 min
+                    : await ExecutePythonAsync("--init-only", timeout: 120000);
                 
                 if (result.Success)
                 {
@@ -123,8 +153,12 @@ namespace PawVerseAPI.Services.BreedDetection
                 };
             }
             
-            // Serialize requests to avoid GPU OOM
-            await _lock.WaitAsync();
+            // Per-request processes each load the models, so run them one at a time to avoid
+            // GPU OOM; the server process batches concurrent requests itself
+            if (!_useServerMode)
+            {
+                await _lock.WaitAsync();
+            }
             
             try
             {
@@ -139,69 +173,58 @@ namespace PawVerseAPI.Services.BreedDetection
                     };
                 }
                 
-                // Step 2: Save image temporarily
-                var imagePath = await SaveImageAsync(imageFile);
+                // Step 2 + 3: Hand the image to Python and run detection
+                var pythonResult = await RunDetectionAsync(imageFile, animalType, _timeoutSeconds * 1000);
                 
-                try
+                if (!pythonResult.Success)
                 {
-                    // Step 3: Run Python detection
-                    var pythonResult = await ExecutePythonAsync(
-                        $"--image \"{imagePath}\" --type {animalType}",
-                        timeout: _timeoutSeconds * 1000
-                    );
-                    
-                    if (!pythonResult.Success)
-                    {
-                        return new DetectBreedResponse
-                        {
-                            Success = false,
-                            Error = pythonResult.Error,
-                            Message = pythonResult.Message
-                        };
-                    }
-                    
-                    // Step 4: Search products
-                    var (products, foundSpecific) = await SearchProductsAsync(
-                        pythonResult.Breed!, 
-                        pythonResult.AnimalType ?? animalType, 
-                        maxProducts);
-                    
-                    // Step 5: Build response message
-                    var animalName = (pythonResult.AnimalType ?? animalType).ToLower() == "cat" ? "mèo" : "chó";
-                    var message = foundSpecific
-                        ? $"Đã phát hiện giống {animalName}: {pythonResult.Breed}"
-                        : $"Đã phát hiện giống {animalName}: {pythonResult.Breed}. Chưa có sản phẩm đặc thù cho giống này, dưới đây là một số sản phẩm phù hợp cho {animalName}.";
-                    
-                    // Step 6: Map TopBreeds
-                    var topBreeds = pythonResult.TopBreeds?.Select(b => new BreedCandidate
-                    {
-                        Breed = b.Breed,
-                        Score = b.Score,
-                        Rank = b.Rank
-                    }).ToList();
-                    
-                    // Step 7: Build response
                     return new DetectBreedResponse
                     {
-                        Success = true,
-                        Message = message,
-                        Breed = pythonResult.Breed,
-                        Confidence = pythonResult.Confidence,
-                        AnimalType = pythonResult.AnimalType,
-                        TopBreeds = topBreeds,
-                        RecommendedProducts = products,
-                        Metadata = pythonResult.Metadata
+                        Success = false,
+                        Error = pythonResult.Error,
+                        Message = pythonResult.Message
                     };
                 }
-                finally
+                
+                // Step 4: Search products
+                var (products, foundSpecific) = await SearchProductsAsync(
+                    pythonResult.Breed!, 
+                    pythonResult.AnimalType ?? animalType, 
+                    maxProducts);
+                
+                // Step 5: Build response message
+                var animalName = (pythonResult.AnimalType ?? animalType).ToLower() == "cat" ? "mèo" : "chó";
+                var message = foundSpecific
+                    ? $"Đã phát hiện giống {animalName}: {pythonResult.Breed}"
+                    : $"Đã phát hiện giống {animalName}: {pythonResult.Breed}. Chưa có sản phẩm đặc thù cho giống này, dưới đây là một số sản phẩm phù hợp cho {animalName}.";
+                
+                // Step 6: Map TopBreeds
+                var topBreeds = pythonResult.TopBreeds?.Select(b => new BreedCandidate
                 {
-                    // Cleanup temp file
-                    CleanupFile(imagePath);
-                }
+                    Breed = b.Breed,
+                    Score = b.Score,
+                    Rank = b.Rank
+                }).ToList();
+                
+                // Step 7: Build response
+                return new DetectBreedResponse
+                {
+                    Success = true,
+                    Message = message,
+                    Breed = pythonResult.Breed,
+                    Confidence = pythonResult.Confidence,
+                    AnimalType = pythonResult.AnimalType,
+                    TopBreeds = topBreeds,
+                    RecommendedProducts = products,
+                    Metadata = pythonResult.Metadata
+                };
             }
             finally
             {
-                _lock.Release();
+                if (!_useServerMode)
+                {
+                    _lock.Release();
+                }
             }
         }
         
@@ -225,6 +248,86 @@ namespace PawVerseAPI.Services.BreedDetection
             return (true, null);
         }
         
+        /// <summary>
+        /// Sends the upload to Python without touching the disk by default: base64 in the
+        /// server request (or raw bytes on stdin for per-request processes). ImageTransport
+        /// "shm" uses a named shared-memory segment instead, "file" the old temp file.
+        /// </summary>
+        private async Task<PythonResult> RunDetectionAsync(IFormFile imageFile, string animalType, int timeout)
+        {
+            if (_imageTransport == "file")
+            {
+                var imagePath = await SaveImageAsync(imageFile);
+                try
+                {
+                    return _useServerMode
+                        ? await SendServerRequestAsync(
+                            new JsonObject { ["image"] = imagePath, ["type"] = animalType }, timeout)
+                        : await ExecutePythonAsync($"--image \"{imagePath}\" --type {animalType}", timeout);
+                }
+                finally
+                {
+                    CleanupFile(imagePath);
+                }
+            }
+            
+            var imageBytes = await ReadImageAsync(imageFile);
+            if (!_useServerMode)
+            {
+                return await ExecutePythonAsync($"--stdin --type {animalType}", timeout, imageBytes);
+            }
+            if (_imageTransport == "shm")
+            {
+                return await SendSharedMemoryRequestAsync(imageBytes, animalType, timeout);
+            }
+            
+            return await SendServerRequestAsync(new JsonObject
+            {
+                ["image"] = new JsonObject { ["b64"] = Convert.ToBase64String(imageBytes) },
+                ["type"] = animalType
+            }, timeout);
+        }
+        
+        private async Task<PythonResult> SendSharedMemoryRequestAsync(byte[] imageBytes, string animalType, int timeout)
+        {
+            var name = $"pawverse_{Guid.NewGuid():N}";
+            var request = new JsonObject
+            {
+                ["image"] = new JsonObject { ["shm"] = name, ["size"] = imageBytes.Length },
+                ["type"] = animalType
+            };
+            
+            if (OperatingSystem.IsWindows())
+            {
+                // Named file mapping (what Python's multiprocessing.shared_memory opens on Windows)
+                using var mapping = MemoryMappedFile.CreateNew(name, imageBytes.Length);
+                using (var view = mapping.CreateViewStream())
+                {
+                    await view.WriteAsync(imageBytes);
+                }
+                return await SendServerRequestAsync(request, timeout);
+            }
+            
+            // POSIX shared memory is a tmpfs file under /dev/shm: no disk write or fsync
+            var shmPath = Path.Combine("/dev/shm", name);
+            await File.WriteAllBytesAsync(shmPath, imageBytes);
+            try
+            {
+                return await SendServerRequestAsync(request, timeout);
+            }
+            finally
+            {
+                CleanupFile(shmPath);
+            }
+        }
+        
+        private static async Task<byte[]> ReadImageAsync(IFormFile file)
+        {
+            using var buffer = new MemoryStream((int)file.Length);
+            await file.CopyToAsync(buffer);
+            return buffer.ToArray();
+        }
+        
         private async Task<string> SaveImageAsync(IFormFile file)
         {
             var fileName = $"{Guid.NewGuid()}{Path.GetExtension(file.FileName)}";
@@ -236,12 +339,13 @@ namespace PawVerseAPI.Services.BreedDetection
             return filePath;
         }
         
-        private async Task<PythonResult> ExecutePythonAsync(string arguments, int timeout = 30000)
+        private async Task<PythonResult> ExecutePythonAsync(string arguments, int timeout = 30000, byte[]? stdinBytes = null)
         {
             var startInfo = new ProcessStartInfo
             {
                 FileName = _pythonPath,
                 Arguments = $"\"{_scriptPath}\" {arguments}",
+                RedirectStandardInput = stdinBytes != null,
                 RedirectStandardOutput = true,
                 RedirectStandardError = true,
                 UseShellExecute = false,
@@ -260,6 +364,11 @@ namespace PawVerseAPI.Services.BreedDetection
             process.BeginOutputReadLine();
             process.BeginErrorReadLine();
             
+            if (stdinBytes != null)
+            {
+                _ = WriteStdinAsync(process, stdinBytes);
+            }
+            
             var completed = await Task.Run(() => process.WaitForExit(timeout));
             
             if (!completed)
@@ -281,6 +390,213 @@ namespace PawVerseAPI.Services.BreedDetection
                 _logger.LogWarning("Python stderr: {Errors}", errors);
             }
             
+            return ParsePythonOutput(output, errors);
+        }
+        
+        private async Task WriteStdinAsync(Process process, byte[] data)
+        {
+            try
+            {
+                await process.StandardInput.BaseStream.WriteAsync(data);
+                process.StandardInput.Close();
+            }
+            catch (IOException ex)
+            {
+                // The process exited before reading its input; its output says why
+                _logger.LogWarning(ex, "Could not write the image to the Python process");
+            }
+        }
+        
+        private async Task<PythonResult> StartServerProcessAsync(int timeout)
+        {
+            StopServerProcess();
+            
+            // A worker pool (forked processes sharing the models) replaces micro-batching
+            var concurrency = _poolWorkers > 0 ? $"--pool {_poolWorkers}" : $"--micro-batch {_microBatchSize}";
+            // BF16 + TorchScript CLIP encoder and a warm-up before the ready line
+            if (_optimizedInference)
+            {
+                concurrency += " --optimize";
+            }
+            // Rebuilt FAISS indexes / id_maps are picked up without restarting the server
+            if (_indexReloadSeconds > 0)
+            {
+                concurrency += $" --index-reload {_indexReloadSeconds}";
+            }
+            // Small deployments: exact NumPy search over the .npy export, faiss is never imported
+            if (_searchBackend != "faiss")
+            {
+                concurrency += $" --search-backend {_searchBackend}";
+            }
+            var startInfo = new ProcessStartInfo
+            {
+                FileName = _pythonPath,
+                Arguments = $"\"{_scriptPath}\" --serve --preload {concurrency}",
+                RedirectStandardInput = true,
+                RedirectStandardOutput = true,
+                RedirectStandardError = true,
+                StandardInputEncoding = new UTF8Encoding(false),
+                StandardOutputEncoding = Encoding.UTF8,
+                UseShellExecute = false,
+                CreateNoWindow = true,
+                WorkingDirectory = _projectRoot
+            };
+            
+            var process = new Process { StartInfo = startInfo };
+            process.ErrorDataReceived += (s, e) => { if (e.Data != null) _logger.LogDebug("Python stderr: {Line}", e.Data); };
+            
+            process.Start();
+            process.BeginErrorReadLine();
+            _serverProcess = process;
+            
+            // First line is the ready signal, printed once models are loaded
+            var ready = await ReadServerLineAsync(timeout);
+            if (ready == null)
+            {
+                StopServerProcess();
+                return new PythonResult
+                {
+                    Success = false,
+                    Error = $"Python server did not become ready within {timeout}ms"
+                };
+            }
+            
+            // Responses can now arrive out of order (micro-batching), so one reader routes them by id
+            _ = Task.Run(() => ReadServerResponsesAsync(process));
+            
+            return ParsePythonOutput(ready, string.Empty);
+        }
+        
+        private async Task<PythonResult> SendServerRequestAsync(JsonObject request, int timeout)
+        {
+            var id = Interlocked.Increment(ref _nextRequestId).ToString();
+            var response = new TaskCompletionSource<string?>(TaskCreationOptions.RunContinuationsAsynchronously);
+            request["id"] = id;
+            
+            await _serverLock.WaitAsync();
+            try
+            {
+                // Restart the server if it died (crash, OOM kill)
+                if (_serverProcess == null || _serverProcess.HasExited)
+                {
+                    _logger.LogWarning("Python server is not running, restarting...");
+                    var started = await StartServerProcessAsync(timeout: 120000);
+                    if (!started.Success)
+                    {
+                        return started;
+                    }
+                }
+                
+                _pending[id] = (_serverProcess!, response);
+                await _serverProcess!.StandardInput.WriteLineAsync(request.ToJsonString());
+                await _serverProcess.StandardInput.FlushAsync();
+            }
+            finally
+            {
+                _serverLock.Release();
+            }
+            
+            var completed = await Task.WhenAny(response.Task, Task.Delay(timeout));
+            var output = completed == response.Task ? await response.Task : null;
+            if (output == null)
+            {
+                // Responses are matched by id, so a late one is simply dropped by the reader
+                _pending.TryRemove(id, out _);
+                return new PythonResult
+                {
+                    Success = false,
+                    Error = $"Python server returned no response (timed out after {timeout}ms or exited)"
+                };
+            }
+            
+            return ParsePythonOutput(output, string.Empty);
+        }
+        
+        private async Task ReadServerResponsesAsync(Process process)
+        {
+            try
+            {
+                string? line;
+                while ((line = await process.StandardOutput.ReadLineAsync()) != null)
+                {
+                    string? id = null;
+                    try
+                    {
+                        using var doc = JsonDocument.Parse(line);
+                        if (doc.RootElement.TryGetProperty("id", out var idElement))
+                        {
+                            id = idElement.ToString();
+                        }
+                    }
+                    catch (JsonException)
+                    {
+                    }
+                    
+                    if (id != null && _pending.TryRemove(id, out var pending))
+                    {
+                        pending.Response.TrySetResult(line);
+                    }
+                    else
+                    {
+                        _logger.LogWarning("Unmatched Python server response: {Line}", line);
+                    }
+                }
+            }
+            catch (Exception ex)
+            {
+                _logger.LogWarning(ex, "Python server output closed");
+            }
+            
+            // The process is gone: fail whatever was still waiting on it
+            foreach (var (id, pending) in _pending)
+            {
+                if (pending.Process == process && _pending.TryRemove(id, out _))
+                {
+                    pending.Response.TrySetResult(null);
+                }
+            }
+        }
+        
+        private async Task<string?> ReadServerLineAsync(int timeout)
+        {
+            var readTask = _serverProcess!.StandardOutput.ReadLineAsync();
+            var completed = await Task.WhenAny(readTask, Task.Delay(timeout));
+            
+            return completed == readTask ? await readTask : null;
+        }
+        
+        private void StopServerProcess()
+        {
+            if (_serverProcess == null)
+            {
+                return;
+            }
+            
+            try
+            {
+                if (!_serverProcess.HasExited)
+                {
+                    _serverProcess.Kill();
+                }
+            }
+            catch (Exception ex)
+            {
+                _logger.LogWarning(ex, "Failed to stop Python server process");
+            }
+            
+            _serverProcess.Dispose();
+            _serverProcess = null;
+        }
+        
+        public void Dispose()
+        {
+            StopServerProcess();
+            _lock.Dispose();
+            _serverLock.Dispose();
+        }
+        
+        private PythonResult ParsePythonOutput(string output, string errors)
+        {
             // Check if output is empty
             if (string.IsNullOrEmpty(output))
             {